@@ -0,0 +1,156 @@
+#!/usr/bin/python
+
+import argparse
+import json
+import multiprocessing
+import sys
+
+from cache import CacheError, parse_cache
+from loader import Image, LoadError
+from memory import PROTECTIONS
+from predictor import PREDICTORS, RETURN_STACK_DEPTH
+from processor import Y86Processor
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+## Processor reused by every job run in this worker process
+worker_processor = None
+
+def init_worker(max_cycles, time_limit, protection, predictor='taken',
+                return_stack=0, icache=None, dcache=None, counters=False):
+    global worker_processor
+    worker_processor = Y86Processor()
+    worker_processor.set_fast(True)
+    worker_processor.set_log_capacity(0)
+    worker_processor.set_max_step(max_cycles)
+    worker_processor.set_time_limit(time_limit)
+    worker_processor.set_protection(protection)
+    worker_processor.set_predictor(predictor)
+    worker_processor.set_return_stack(return_stack)
+    worker_processor.set_caches(icache and parse_cache('I-cache', icache),
+                                dcache and parse_cache('D-cache', dcache))
+    worker_processor.set_counters(counters)
+
+def simulate_one(job):
+    index, source = job
+    processor = worker_processor
+    if isinstance(source, string_types):
+        result = {'source': source}
+    else:
+        result = {'source': '<image %d>' % index}
+
+    try:
+        if isinstance(source, Image):
+            processor.set_image(source)
+        elif isinstance(source, string_types):
+            with open(source, 'r') as input_file:
+                processor.set_input_file(input_file)
+        else:
+            processor.set_input_file(source)
+    except (IOError, LoadError) as error:
+        result['error'] = str(error)
+        return result
+
+    ## Loading rebuilt memory; the pipeline still holds the last job
+    processor.reset_pipeline()
+    processor.run_processor()
+    result.update(processor.final_state())
+    result['error'] = None
+    return result
+
+def simulate_batch(sources, processes=None, max_cycles=10000, time_limit=None,
+                   protection='code', predictor='taken', return_stack=0,
+                   icache=None, dcache=None, counters=False):
+    ## Each source is a .yo path, a list of .yo lines or a loader.Image.
+    ## The caches are given as for --icache and --dcache, counters adds
+    ## the performance counters to each result. Results come back in the
+    ## order of the sources.
+    jobs = list(enumerate(sources))
+    options = (max_cycles, time_limit, protection, predictor, return_stack,
+               icache, dcache, counters)
+    if processes == 1 or len(jobs) <= 1:
+        init_worker(*options)
+        return [simulate_one(job) for job in jobs]
+
+    pool = multiprocessing.Pool(processes, init_worker, options)
+    try:
+        return pool.map(simulate_one, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+def format_result(result):
+    if result['error']:
+        return '%s\terror: %s' % (result['source'], result['error'])
+    cpi = result['cpi']
+    return '%s\t%s\t%d cycles\t%d instructions\tCPI %s' % (
+        result['source'], result['status'], result['cycles'],
+        result['instructions'], '%.3f' % cpi if cpi is not None else '-')
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='processor.py batch',
+        description='Simulate many .yo files in parallel')
+    parser.add_argument('inputs', nargs='+', metavar='input',
+                        help='.yo file to simulate')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of worker processes '
+                             '(default: one per CPU)')
+    parser.add_argument('-n', '--max-cycles', type=int, default=10000,
+                        help='stop each program after this many cycles, '
+                             '0 for no limit (default: 10000)')
+    parser.add_argument('-t', '--time-limit', type=float,
+                        help='stop each program after this many seconds')
+    parser.add_argument('--protection', choices=PROTECTIONS,
+                        default='code',
+                        help='write protection of the loaded image')
+    parser.add_argument('--predictor', choices=sorted(PREDICTORS),
+                        default='taken',
+                        help='branch predictor for conditional jumps '
+                             '(default: taken)')
+    parser.add_argument('--ras', type=int, nargs='?', const=RETURN_STACK_DEPTH,
+                        default=0, metavar='DEPTH',
+                        help='predict ret with a return address stack '
+                             '(default depth: %d) instead of stalling'
+                             % RETURN_STACK_DEPTH)
+    parser.add_argument('--icache', metavar='SPEC',
+                        help='model an instruction cache, see processor.py '
+                             '--help')
+    parser.add_argument('--dcache', metavar='SPEC',
+                        help='model a data cache, see processor.py --help')
+    parser.add_argument('--counters', action='store_true',
+                        help='add the performance counters of each run to '
+                             'the JSON results')
+    parser.add_argument('--json', metavar='PATH',
+                        help="write the results as JSON, '-' for stdout")
+    args = parser.parse_args(argv)
+    try:
+        for name, spec in (('I-cache', args.icache), ('D-cache', args.dcache)):
+            if spec:
+                parse_cache(name, spec)
+    except CacheError as error:
+        parser.error(str(error))
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = simulate_batch(args.inputs, args.jobs, args.max_cycles or None,
+                             args.time_limit, args.protection, args.predictor,
+                             args.ras, args.icache, args.dcache,
+                             args.counters)
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        if args.json:
+            with open(args.json, 'w') as output_file:
+                json.dump(results, output_file, indent=2, sort_keys=True)
+        for result in results:
+            sys.stdout.write(format_result(result) + '\n')
+    return 1 if any(result['error'] for result in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+#!/usr/bin/python
+
+## Timing model of the instruction and data caches. The caches only keep
+## tags: the data always comes from Memory, a cache only says how many
+## cycles an access takes.
+
+import struct
+
+POLICIES = ('lru', 'fifo', 'random')
+
+## Defaults of a cache given on the command line
+CACHE_DEFAULTS = {
+    'size': 1024,
+    'ways': 2,
+    'line': 16,
+    'policy': 'lru',
+    'write': 'back',
+    'penalty': 10,
+}
+
+class CacheError(Exception):
+    pass
+
+class Cache():
+    ## A set associative cache of `size` bytes in lines of `line` bytes.
+    ## Tags, dirty bits and replacement stamps live in flat arrays with one
+    ## slot per line, set after set. A write-back cache allocates on
+    ## writes and pays the miss penalty again to write a dirty victim
+    ## back. A write-through cache does not allocate on writes, which go
+    ## to memory through a write buffer and never stall.
+    COUNTERS = ('hits', 'misses', 'evictions', 'writebacks', 'stall_cycles')
+
+    def __init__(self, name, size=1024, ways=2, line=16, policy='lru',
+                 write_back=True, penalty=10):
+        if policy not in POLICIES:
+            raise CacheError('unknown replacement policy: %s' % policy)
+        if line <= 0 or line & (line - 1):
+            raise CacheError('line size must be a power of two')
+        if ways <= 0 or size <= 0 or size % (ways * line):
+            raise CacheError('size must be a multiple of ways * line')
+        sets = size // (ways * line)
+        if sets & (sets - 1):
+            raise CacheError('size / (ways * line) must be a power of two')
+        if penalty < 0:
+            raise CacheError('miss penalty must not be negative')
+
+        self.name = name
+        self.size = size
+        self.ways = ways
+        self.line = line
+        self.policy = policy
+        self.write_back = write_back
+        self.penalty = penalty
+        self.line_bits = line.bit_length() - 1
+        self.set_mask = sets - 1
+        self.reset()
+
+    def reset(self):
+        slots = (self.set_mask + 1) * self.ways
+        ## Line address (address >> line_bits) held by each slot, -1 if none
+        self.tags = [-1] * slots
+        self.dirty = bytearray(slots)
+        ## Last use (lru) or fill (fifo) of each slot
+        self.stamps = [0] * slots
+        self.clock = 0
+        ## State of the generator picking random victims
+        self.seed = 1
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+
+    def access(self, addr, size, write):
+        ## Returns the cycles the access stalls for, 0 on a hit
+        first = addr >> self.line_bits
+        last = (addr + size - 1) >> self.line_bits
+        latency = self.access_line(first, write)
+        if last != first:
+            latency += self.access_line(last, write)
+        self.stall_cycles += latency
+        return latency
+
+    def access_line(self, block, write):
+        tags = self.tags
+        ways = self.ways
+        base = (block & self.set_mask) * ways
+        slot = base
+        end = base + ways
+        while slot < end:
+            if tags[slot] == block:
+                break
+            slot += 1
+        else:
+            slot = -1
+
+        if slot >= 0:
+            self.hits += 1
+            if self.policy == 'lru':
+                self.clock += 1
+                self.stamps[slot] = self.clock
+            if write and self.write_back:
+                self.dirty[slot] = 1
+            return 0
+
+        self.misses += 1
+        if write and not self.write_back:
+            return 0
+
+        latency = self.penalty
+        slot = self.victim(base, end)
+        if tags[slot] != -1:
+            self.evictions += 1
+            if self.dirty[slot]:
+                self.writebacks += 1
+                latency += self.penalty
+        tags[slot] = block
+        self.dirty[slot] = 1 if write else 0
+        self.clock += 1
+        self.stamps[slot] = self.clock
+        return latency
+
+    def victim(self, base, end):
+        tags = self.tags
+        slot = base
+        while slot < end:
+            if tags[slot] == -1:
+                return slot
+            slot += 1
+        if self.policy == 'random':
+            self.seed = (self.seed * 1103515245 + 12345) & 0x7fffffff
+            return base + (self.seed >> 16) % (end - base)
+        stamps = self.stamps
+        victim = base
+        slot = base + 1
+        while slot < end:
+            if stamps[slot] < stamps[victim]:
+                victim = slot
+            slot += 1
+        return victim
+
+    def counts(self):
+        return tuple(getattr(self, name) for name in self.COUNTERS)
+
+    def add(self, counts, times=1):
+        for name, count in zip(self.COUNTERS, counts):
+            setattr(self, name, getattr(self, name) + count * times)
+
+    def describe(self):
+        return '%d bytes, %d-way, %d byte lines, %s, write-%s, %d cycle ' \
+               'miss penalty' % (self.size, self.ways, self.line, self.policy,
+                                 'back' if self.write_back else 'through',
+                                 self.penalty)
+
+    def summary(self):
+        accesses = self.hits + self.misses
+        rate = 100.0 * self.hits / accesses if accesses else 0.0
+        return '%s: %d hits, %d misses (%.1f%% hit rate), %d evictions, ' \
+               '%d writebacks, %d stall cycles' % (
+                   self.name, self.hits, self.misses, rate, self.evictions,
+                   self.writebacks, self.stall_cycles)
+
+    def to_dict(self):
+        result = dict((name, getattr(self, name)) for name in self.COUNTERS)
+        result.update({
+            'size': self.size,
+            'ways': self.ways,
+            'line': self.line,
+            'policy': self.policy,
+            'write_back': self.write_back,
+            'penalty': self.penalty,
+        })
+        return result
+
+    def state_layout(self):
+        ## Counters, tags, stamps, clock and seed, followed by the dirty bits
+        slots = len(self.tags)
+        return struct.Struct('<%dq%dq%dqqI' % (len(self.COUNTERS), slots,
+                                               slots))
+
+    def get_state(self):
+        return self.state_layout().pack(
+            *(list(self.counts()) + self.tags + self.stamps +
+              [self.clock, self.seed])) + bytes(self.dirty)
+
+    def set_state(self, data):
+        slots = len(self.tags)
+        layout = self.state_layout()
+        if len(data) != layout.size + slots:
+            raise ValueError('saved with another %s configuration'
+                             % self.name)
+        values = layout.unpack_from(data)
+        for name, value in zip(self.COUNTERS, values):
+            setattr(self, name, value)
+        values = values[len(self.COUNTERS):]
+        self.tags = list(values[:slots])
+        self.stamps = list(values[slots:2 * slots])
+        self.clock, self.seed = values[2 * slots:]
+        self.dirty = bytearray(data[layout.size:])
+
+def parse_cache(name, text):
+    ## Build a cache from 'key=value,...' with the keys of CACHE_DEFAULTS,
+    ## for example 'size=4096,ways=4,policy=fifo'. Raises CacheError.
+    options = dict(CACHE_DEFAULTS)
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        key, sep, value = item.partition('=')
+        key = key.strip()
+        if not sep or key not in options:
+            raise CacheError('bad cache option: %s' % item)
+        options[key] = value.strip()
+    try:
+        size, ways, line, penalty = [int(str(options[key]), 0) for key in
+                                     ('size', 'ways', 'line', 'penalty')]
+    except ValueError:
+        raise CacheError('cache size, ways, line and penalty are numbers')
+    if options['write'] not in ('back', 'through'):
+        raise CacheError('write must be back or through')
+    return Cache(name, size, ways, line, options['policy'],
+                 options['write'] == 'back', penalty)
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+## Datapath control signals of the pipeline, looked up by icode instead of
+## being recomputed from icode comparisons every cycle. The stall and
+## bubble logic is described in pipe.hcl.
+
+from collections import namedtuple
+
+from isa import (IRRMOVL, IIRMOVL, IRMMOVL, IMRMOVL, IOPL, IJXX, ICALL, IRET,
+                 IPUSHL, IPOPL, RESP, RNONE)
+
+## Number of distinct icodes, valid or not
+ICODE_COUNT = 16
+
+## Pipeline fields a signal can select, besides constants
+RA = 'rA'
+RB = 'rB'
+VALA = 'valA'
+VALB = 'valB'
+VALC = 'valC'
+VALE = 'valE'
+VALP = 'valP'
+
+SIGNALS = (
+    ## Decode: register ids read and written, whether valA is valP
+    'srcA', 'srcB', 'dstE', 'dstM', 'use_valP',
+    ## Execute: ALU inputs, whether ifun picks the ALU function, whether
+    ## the condition codes are set, whether the instruction has a condition
+    'aluA', 'aluB', 'alu_ifun', 'set_cc', 'conditional',
+    ## Memory: address source, read and write enables
+    'mem_addr', 'mem_read', 'mem_write',
+)
+
+Control = namedtuple('Control', SIGNALS)
+
+## The Y86 PIPE datapath control. Like an HCL case expression, each signal
+## lists (icodes, value) cases followed by a default: the first case whose
+## icodes contain the instruction gives the value.
+PIPE_CONTROL = {
+    'srcA': ([((IRRMOVL, IRMMOVL, IOPL, IPUSHL), RA),
+              ((IPOPL, IRET), RESP)], RNONE),
+    'srcB': ([((IOPL, IRMMOVL, IMRMOVL), RB),
+              ((IPUSHL, IPOPL, ICALL, IRET), RESP)], RNONE),
+    'dstE': ([((IRRMOVL, IIRMOVL, IOPL), RB),
+              ((IPUSHL, IPOPL, ICALL, IRET), RESP)], RNONE),
+    'dstM': ([((IMRMOVL, IPOPL), RA)], RNONE),
+    'use_valP': ([((ICALL, IJXX), True)], False),
+    'aluA': ([((IRRMOVL, IOPL), VALA),
+              ((IIRMOVL, IRMMOVL, IMRMOVL), VALC),
+              ((ICALL, IPUSHL), -4),
+              ((IRET, IPOPL), 4)], 0),
+    'aluB': ([((IRMMOVL, IMRMOVL, IOPL, ICALL, IPUSHL, IRET, IPOPL), VALB)],
+             0),
+    'alu_ifun': ([((IOPL,), True)], False),
+    'set_cc': ([((IOPL,), True)], False),
+    'conditional': ([((IJXX, IRRMOVL), True)], False),
+    'mem_addr': ([((IRMMOVL, IPUSHL, ICALL, IMRMOVL), VALE),
+                  ((IPOPL, IRET), VALA)], None),
+    'mem_read': ([((IMRMOVL, IPOPL, IRET), True)], False),
+    'mem_write': ([((IRMMOVL, IPUSHL, ICALL), True)], False),
+}
+
+class ControlError(Exception):
+    pass
+
+def compile_control(description):
+    ## Evaluate every signal of a description for every icode. Returns a
+    ## tuple of Control indexed by icode.
+    missing = [name for name in SIGNALS if name not in description]
+    if missing:
+        raise ControlError('no definition for: %s' % ', '.join(missing))
+    unknown = sorted(name for name in description if name not in SIGNALS)
+    if unknown:
+        raise ControlError('unknown signals: %s' % ', '.join(unknown))
+
+    table = []
+    for icode in range(ICODE_COUNT):
+        values = []
+        for name in SIGNALS:
+            cases, default = description[name]
+            value = default
+            for icodes, case_value in cases:
+                if icode in icodes:
+                    value = case_value
+                    break
+            values.append(value)
+        table.append(Control(*values))
+    return tuple(table)
+
+PIPE_TABLE = compile_control(PIPE_CONTROL)
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+## Performance counters of the pipeline. They are updated by a variant of
+## the register updates generated from the HCL, so a run without counters
+## pays nothing for them.
+
+from isa import (INOP, IHALT, IRRMOVL, IIRMOVL, IRMMOVL, IMRMOVL, IOPL, IJXX,
+                 ICALL, IRET, IPUSHL, IPOPL)
+
+## Pipeline registers, in the order of the stall and bubble counters
+STAGES = ('F', 'D', 'E', 'M', 'W')
+
+## Why a bubble was inserted. Every bubble carries its cause down to W,
+## where it is counted as a lost cycle. An HCL description names the
+## causes with the C constants, see the X_bubble_cause signals of pipe.hcl.
+CAUSES = ('startup', 'load_use', 'mispredict', 'ret_stall', 'ret_mispredict',
+          'icache', 'dcache', 'exception', 'other')
+CAUSE_CONSTANTS = {
+    'CSTARTUP': 0,
+    'CLOADUSE': 1,
+    'CMISPREDICT': 2,
+    'CRETSTALL': 3,
+    'CRETMISPREDICT': 4,
+    'CICACHE': 5,
+    'CDCACHE': 6,
+    'CEXCEPTION': 7,
+    'COTHER': 8,
+}
+CSTARTUP = CAUSE_CONSTANTS['CSTARTUP']
+CICACHE = CAUSE_CONSTANTS['CICACHE']
+
+## Where decode took an operand from. 0 is no operand, or valP.
+FORWARD_SOURCES = ('none', 'register', 'e_valE', 'm_valM', 'M_valE', 'W_valM',
+                   'W_valE')
+FNOSOURCE = 0
+
+ICODE_NAMES = {
+    INOP: 'nop',
+    IHALT: 'halt',
+    IRRMOVL: 'rrmovl',
+    IIRMOVL: 'irmovl',
+    IRMMOVL: 'rmmovl',
+    IMRMOVL: 'mrmovl',
+    IOPL: 'opl',
+    IJXX: 'jxx',
+    ICALL: 'call',
+    IRET: 'ret',
+    IPUSHL: 'pushl',
+    IPOPL: 'popl',
+}
+
+class PerfCounters():
+    ## Flat lists, indexed by stage, cause, forwarding source and icode,
+    ## so the generated code only has to bump an item
+    def __init__(self):
+        self.stalls = [0] * len(STAGES)
+        self.bubbles = [0] * len(STAGES)
+        self.lost = [0] * len(CAUSES)
+        self.forward = [0] * len(FORWARD_SOURCES)
+        self.mix = [0] * 16
+
+    def lists(self):
+        return (self.stalls, self.bubbles, self.lost, self.forward, self.mix)
+
+    def counts(self):
+        counts = ()
+        for counters in self.lists():
+            counts += tuple(counters)
+        return counts
+
+    def add(self, counts, times=1):
+        offset = 0
+        for counters in self.lists():
+            for index in range(len(counters)):
+                counters[index] += counts[offset + index] * times
+            offset += len(counters)
+
+    def to_dict(self, cycles, retired):
+        ## CPI is 1 plus the cycles lost to each cause per instruction,
+        ## apart from the cycles the last instructions spend draining
+        per_instruction = lambda count: \
+            float(count) / retired if retired else None
+        return {
+            'cycles': cycles,
+            'instructions': retired,
+            'cpi': per_instruction(cycles),
+            'lost_cycles': dict(zip(CAUSES, self.lost)),
+            'cpi_breakdown': dict([('base', 1.0 if retired else None)] +
+                                  [(cause, per_instruction(count))
+                                   for cause, count in zip(CAUSES, self.lost)]),
+            'stalls': dict(zip(STAGES, self.stalls)),
+            'bubbles': dict(zip(STAGES, self.bubbles)),
+            'forwarding': dict(zip(FORWARD_SOURCES[1:], self.forward[1:])),
+            'instruction_mix': dict((ICODE_NAMES.get(icode, '0x%x' % icode),
+                                     count)
+                                    for icode, count in enumerate(self.mix)
+                                    if count),
+        }
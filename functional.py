@@ -0,0 +1,363 @@
+#!/usr/bin/python
+
+import time
+from collections import deque
+
+from isa import (IRRMOVL, IIRMOVL, IRMMOVL, IMRMOVL, IOPL, IJXX, ICALL, IRET,
+                 IPUSHL, IPOPL, RESP, RNONE, REGISTER_COUNT, REGISTER_NAMES,
+                 ALUADD, ALUSUB, ALUAND, ALUXOR, TMAX, TMIN, SAOK, SADR,
+                 condition, decode_instruction, wrap)
+from loader import load_image
+from memory import Memory, PROTECTIONS, protect_image
+from tracing import format_state
+from translator import BlockCache
+
+## Instructions whose memory stage writes a word
+WRITE_ICODES = (IRMMOVL, IPUSHL, ICALL)
+
+class Divergence(Exception):
+    pass
+
+class Y86Functional():
+    ## Executes the Y86 instruction set one instruction at a time, with no
+    ## pipeline. Loading, memory and protection behave as in Y86Processor.
+    def __init__(self):
+        self.image = b''
+        self.code_ranges = []
+        self.protection = 'code'
+        self.time_limit = None
+        self.max_step = 10000
+        self.translate = True
+
+        self.reset()
+
+    def reset(self):
+        self.pc = 0
+        self.registers = [0] * REGISTER_COUNT
+        self.conditions = {
+            'ZF': 0,
+            'SF': 0,
+            'OF': 0,
+        }
+        self.stat = SAOK
+        self.retired = 0
+        self.stop_reason = None
+
+        ## (address, value) written by the last instruction, if any
+        self.last_write = None
+
+        self.reset_memory()
+
+    def reset_memory(self):
+        self.memory = Memory(self.image)
+        self.apply_protection()
+        ## Decoded instructions by address, dropped when memory is written
+        self.decoded = {}
+        self.blocks = BlockCache(self) if self.translate else None
+        ## Lowest and highest address an instruction was decoded at, so
+        ## that writes elsewhere skip invalidation
+        self.code_low = None
+        self.code_high = None
+        ## Whether the last memory write hit translated code
+        self.code_written = False
+
+    def set_protection(self, protection):
+        if protection not in PROTECTIONS:
+            raise ValueError('unknown protection policy: %s' % protection)
+        self.protection = protection
+        self.apply_protection()
+
+    def apply_protection(self):
+        protect_image(self.memory, len(self.image), self.code_ranges,
+                      self.protection)
+
+    def set_max_step(self, max_step):
+        ## Instructions to run, None runs until the program stops by itself
+        self.max_step = max_step
+
+    def set_time_limit(self, seconds):
+        self.time_limit = seconds
+
+    def set_translate(self, translate):
+        ## run_processor() runs translated basic blocks instead of
+        ## interpreting one instruction at a time
+        self.translate = translate
+        self.blocks = BlockCache(self) if translate else None
+
+    def compile(self, fin):
+        self.set_image(load_image(fin))
+
+    def set_image(self, image):
+        self.image = image.data
+        self.code_ranges = image.code_ranges
+        self.reset_memory()
+
+    def set_input_file(self, data):
+        self.compile(data)
+
+    def read_register(self, reg):
+        if reg == RNONE:
+            return 0
+        return self.registers[reg]
+
+    def write_register(self, reg, value):
+        if reg != RNONE:
+            self.registers[reg] = value
+
+    def decoded_at(self, pc):
+        if self.code_low is None or pc < self.code_low:
+            self.code_low = pc
+        if self.code_high is None or pc > self.code_high:
+            self.code_high = pc
+
+    def write_memory(self, addr, value):
+        self.memory.write_word(addr, value)
+        self.last_write = (addr, value)
+        ## The longest instruction is 6 bytes long
+        if self.code_low is None or addr + 4 <= self.code_low or \
+           addr - 5 > self.code_high:
+            self.code_written = False
+            return
+        for pc in range(addr - 5, addr + 4):
+            self.decoded.pop(pc, None)
+        if self.blocks is not None:
+            self.code_written = self.blocks.invalidate(addr)
+
+    def alu(self, alufun, a, b):
+        result = 0
+        if alufun == ALUADD:
+            result = b + a
+        elif alufun == ALUSUB:
+            result = b - a
+        elif alufun == ALUAND:
+            result = b & a
+        elif alufun == ALUXOR:
+            result = b ^ a
+
+        self.conditions['ZF'] = 1 if result == 0 else 0
+        self.conditions['SF'] = 1 if result < 0 else 0
+        self.conditions['OF'] = 1 if (result > TMAX) or (result < TMIN) else 0
+        return wrap(result)
+
+    def step(self):
+        ## Execute the instruction at pc and return its icode. An instruction
+        ## that fails leaves registers, memory and pc untouched and only sets
+        ## the status.
+        entry = self.decoded.get(self.pc)
+        if entry is None:
+            entry = self.decoded[self.pc] = decode_instruction(self.memory,
+                                                               self.pc)
+            self.decoded_at(self.pc)
+        icode, ifun, rA, rB, valC, valP, predPC, stat = entry
+        self.last_write = None
+        if stat != SAOK:
+            self.stat = stat
+            return icode
+
+        pc = valP
+        try:
+            if icode == IRRMOVL:
+                if condition(ifun, self.conditions):
+                    self.write_register(rB, self.read_register(rA))
+            elif icode == IIRMOVL:
+                self.write_register(rB, valC)
+            elif icode == IRMMOVL:
+                self.write_memory(wrap(valC + self.read_register(rB)),
+                                  self.read_register(rA))
+            elif icode == IMRMOVL:
+                addr = wrap(valC + self.read_register(rB))
+                self.write_register(rA, self.memory.read_word(addr))
+            elif icode == IOPL:
+                self.write_register(rB, self.alu(ifun, self.read_register(rA),
+                                                 self.read_register(rB)))
+            elif icode == IJXX:
+                if condition(ifun, self.conditions):
+                    pc = valC
+            elif icode == ICALL:
+                sp = wrap(self.read_register(RESP) - 4)
+                self.write_memory(sp, valP)
+                self.write_register(RESP, sp)
+                pc = valC
+            elif icode == IRET:
+                sp = self.read_register(RESP)
+                pc = self.memory.read_word(sp)
+                self.write_register(RESP, wrap(sp + 4))
+            elif icode == IPUSHL:
+                value = self.read_register(rA)
+                sp = wrap(self.read_register(RESP) - 4)
+                self.write_memory(sp, value)
+                self.write_register(RESP, sp)
+            elif icode == IPOPL:
+                sp = self.read_register(RESP)
+                value = self.memory.read_word(sp)
+                self.write_register(RESP, wrap(sp + 4))
+                self.write_register(rA, value)
+        except IndexError:
+            self.stat = SADR
+            return icode
+
+        self.pc = pc
+        self.retired += 1
+        return icode
+
+    def run_processor(self):
+        if self.time_limit is not None:
+            deadline = time.time() + self.time_limit
+        else:
+            deadline = None
+
+        step = 0
+        loops = 0
+        block = None
+        while self.stat == SAOK:
+            if self.max_step is not None and step >= self.max_step:
+                self.stop_reason = 'instructions'
+                return
+            if deadline is not None and loops & 0x3ff == 0 and \
+               time.time() > deadline:
+                self.stop_reason = 'time'
+                return
+            loops += 1
+
+            if self.blocks is not None:
+                ## Follow the link from the previous block when there is one
+                pc = self.pc
+                next_block = None
+                if block is not None:
+                    next_block = block.successors.get(pc)
+                if next_block is None or not next_block.valid:
+                    next_block = self.blocks.lookup(pc)
+                    if block is not None and next_block is not None:
+                        block.successors[pc] = next_block
+                block = next_block
+                if block is not None and (self.max_step is None or
+                        step + block.length <= self.max_step):
+                    retired = self.retired
+                    block.function(self)
+                    step += self.retired - retired
+                    continue
+                block = None
+
+            step += 1
+            self.step()
+        self.stop_reason = 'status'
+
+    def memory_changes(self):
+        return self.memory.changes(self.image)
+
+    def state_summary(self):
+        return format_state(['Status: %s' % self.stat,
+                             'Instructions: %d' % self.retired],
+                            self.registers, self.conditions,
+                            self.memory_changes())
+
+    def final_state(self):
+        return {
+            'status': self.stat,
+            'stop_reason': self.stop_reason,
+            'cycles': None,
+            'instructions': self.retired,
+            'cpi': None,
+            'registers': dict(zip(REGISTER_NAMES, self.registers)),
+            'conditions': dict(self.conditions),
+            'memory': self.memory_changes(),
+        }
+
+def run_lockstep(processor, machine=None):
+    ## Run `processor` one cycle at a time next to a functional simulator of
+    ## the same program, which executes one instruction whenever the
+    ## pipeline retires one. Registers are compared at every retirement,
+    ## memory writes as they happen, and the status, condition codes and
+    ## memory once the program stops. Raises Divergence on a mismatch.
+    if machine is None:
+        machine = Y86Functional()
+        machine.protection = processor.protection
+        machine.image = processor.image
+        machine.code_ranges = processor.code_ranges
+        machine.reset()
+
+    max_step = processor.max_step
+    time_limit = processor.time_limit
+    if time_limit is not None:
+        deadline = time.time() + time_limit
+    else:
+        deadline = None
+
+    pipeline_writes = deque()
+    machine_writes = deque()
+    processor.set_max_step(1)
+    processor.set_time_limit(None)
+    try:
+        step = 0
+        while True:
+            if max_step is not None and step >= max_step:
+                processor.stop_reason = 'cycles'
+                return machine
+            if deadline is not None and step & 0x3ff == 0 and \
+               time.time() > deadline:
+                processor.stop_reason = 'time'
+                return machine
+            step += 1
+
+            retired = processor.retired
+            processor.run_processor()
+            ## A store held in M by a data cache miss writes only once
+            if processor.M_icode in WRITE_ICODES and \
+               not processor.dmem_error and not processor.M_held:
+                pipeline_writes.append((processor.mem_addr, processor.M_valA))
+
+            if processor.retired > retired:
+                icode = machine.step()
+                if machine.stat != SAOK:
+                    raise Divergence('cycle %d: pipeline retired icode 0x%x, '
+                                     'functional stopped with %s at 0x%x'
+                                     % (processor.cycle, processor.W_icode,
+                                        machine.stat, machine.pc))
+                if icode != processor.W_icode:
+                    raise Divergence('cycle %d: pipeline retired icode 0x%x, '
+                                     'functional icode 0x%x'
+                                     % (processor.cycle, processor.W_icode,
+                                        icode))
+                if machine.last_write:
+                    machine_writes.append(machine.last_write)
+                compare_registers(processor, machine)
+
+            while pipeline_writes and machine_writes:
+                expected = machine_writes.popleft()
+                actual = pipeline_writes.popleft()
+                if actual != expected:
+                    raise Divergence('cycle %d: pipeline wrote %r, '
+                                     'functional wrote %r (address, value)'
+                                     % (processor.cycle, actual, expected))
+
+            if processor.stop_reason == 'status':
+                break
+
+        machine.step()
+        if processor.stat != machine.stat:
+            raise Divergence('cycle %d: pipeline stopped with %s, '
+                             'functional with %s'
+                             % (processor.cycle, processor.stat, machine.stat))
+        if pipeline_writes or machine_writes:
+            raise Divergence('unmatched memory writes: pipeline %r, '
+                             'functional %r' % (list(pipeline_writes),
+                                                list(machine_writes)))
+        compare_registers(processor, machine)
+        if processor.conditions != machine.conditions:
+            raise Divergence('condition codes: pipeline %r, functional %r'
+                             % (processor.conditions, machine.conditions))
+        if processor.memory_changes() != machine.memory_changes():
+            raise Divergence('memory contents differ')
+        return machine
+    finally:
+        processor.set_max_step(max_step)
+        processor.set_time_limit(time_limit)
+
+def compare_registers(processor, machine):
+    for reg, name in enumerate(REGISTER_NAMES):
+        if processor.registers[reg] != machine.registers[reg]:
+            raise Divergence('cycle %d: %s is 0x%x in the pipeline, '
+                             '0x%x in the functional simulator'
+                             % (processor.cycle, name,
+                                processor.registers[reg] & 0xffffffff,
+                                machine.registers[reg] & 0xffffffff))
@@ -7,26 +7,141 @@ from PyQt5.QtWidgets import (QMainWindow, QDesktopWidget, QApplication,
                              QFileDialog, QAction, QTextEdit, QMessageBox,
                              QGridLayout, QLabel, QLineEdit, QWidget,
                              QPushButton, QInputDialog, QSlider)
-from PyQt5.QtCore import QTimer, Qt
-from processor import Y86Processor, special_hex
+from PyQt5.QtCore import QTimer, Qt, QThread, QElapsedTimer, pyqtSignal
+from PyQt5.QtGui import QColor, QTextCursor, QTextFormat
+from loader import LoadError, SourceIndex
+from processor import Y86Processor
+from timeline import (Timeline, TraceTimeline, CHECKPOINT_INTERVAL,
+                      MAX_CHECKPOINTS)
+from tracefile import TraceFile, TraceFileError
+from tracing import (FIELDS, FIELD_NAMES, CONDITIONS, STAGE_NAMES,
+                     special_hex)
+
+## Register widgets in register number order
+REGISTER_WIDGETS = ('eax', 'ecx', 'edx', 'ebx', 'esp', 'ebp', 'esi', 'edi')
+
+## Every field shown, by the name of its <name>_text widget
+DISPLAY_FIELDS = ('cycle',) + CONDITIONS + REGISTER_WIDGETS + FIELD_NAMES
+
+## Fields that changed since the previous update
+CHANGED_STYLE = 'background-color: #fff3a0'
+
+## Background of the source line of the instruction in each stage; a line
+## in several stages at once gets the color of the latest one
+STAGE_COLORS = {
+    'F': '#dcecff',
+    'D': '#dcf5dc',
+    'E': '#fff3a0',
+    'M': '#ffe2c4',
+    'W': '#f0dcff',
+}
+
+## Milliseconds between two repaints while running; when the interval is
+## shorter, the cycles in between are skipped on screen
+FRAME_INTERVAL = 16
+
+## Budget of the background simulation of a loaded program; the display
+## stops where the simulation did
+MAX_CYCLES = 10000000
+MAX_SECONDS = 60
+
+## Seconds between two progress updates of the background simulation
+PROGRESS_INTERVAL = 0.1
+
+## Status line once the background simulation stops, by stop reason
+FINISHED_MESSAGES = {
+    'status': 'Finished after %d cycles',
+    'loop': 'Stopped after %d cycles: the program loops forever',
+    'cycles': 'Stopped after %d cycles: cycle limit reached',
+    'time': 'Stopped after %d cycles: time limit reached',
+}
+
+class SimulationWorker(QThread):
+    ## Runs a copy of the loaded processor ahead of the display and sends
+    ## its snapshots back, so the GUI only ever replays a few cycles. It
+    ## gives up after max_cycles cycles or max_seconds seconds, and stops
+    ## as soon as the pipeline stops changing.
+    progress = pyqtSignal(int)
+    checkpoint = pyqtSignal(int, bytes)
+    ## Last cycle, and why the run stopped: 'status', 'loop', 'cycles' or
+    ## 'time'
+    finished_at = pyqtSignal(int, str)
+
+    def __init__(self, snapshot, interval=CHECKPOINT_INTERVAL,
+                 max_cycles=MAX_CYCLES, max_seconds=MAX_SECONDS):
+        super(SimulationWorker, self).__init__()
+        self.interval = interval
+        self.max_cycles = max_cycles
+        self.max_seconds = max_seconds
+        ## Snapshots sent at the current interval
+        self.sent = 0
+        self.processor = Y86Processor()
+        self.processor.restore(snapshot)
+        self.processor.set_fast(True)
+        self.processor.set_log_capacity(0)
+        self.processor.set_checkpoint(interval, self.send_checkpoint)
+        ## Run in short slices with no cycle limit, so that a program
+        ## looping forever is seen as such
+        self.processor.set_max_step(None)
+        self.processor.set_time_limit(PROGRESS_INTERVAL)
+
+    def send_checkpoint(self, processor):
+        self.checkpoint.emit(processor.cycle, processor.snapshot())
+        ## The timeline keeps MAX_CHECKPOINTS snapshots at most; past that
+        ## only every other one would be kept, so send half as many
+        self.sent += 1
+        if self.sent >= MAX_CHECKPOINTS:
+            self.interval *= 2
+            self.sent = MAX_CHECKPOINTS // 2
+            processor.set_checkpoint(self.interval, self.send_checkpoint)
+
+    def run(self):
+        processor = self.processor
+        clock = QElapsedTimer()
+        clock.start()
+        while not self.isInterruptionRequested():
+            processor.run_processor()
+            self.progress.emit(processor.cycle)
+            reason = processor.stop_reason
+            if reason == 'time':
+                if processor.cycle + 1 >= self.max_cycles:
+                    reason = 'cycles'
+                elif clock.elapsed() >= self.max_seconds * 1000:
+                    reason = 'time'
+                else:
+                    continue
+            self.finished_at.emit(processor.cycle, reason)
+            return
 
 class MainWidget(QWidget):
 
     def __init__(self):
         super(MainWidget, self).__init__()
         self.processor = Y86Processor()
+        self.timeline = None
+        self.worker = None
+        ## Lines of the code view, by instruction address
+        self.source_index = SourceIndex()
+        ## Binary trace file being shown instead of a simulation
+        self.trace_file = None
+        ## Last cycle the worker has simulated so far
+        self.simulated_cycle = -1
         self.current_step = 0
         self.timer_interval = 1
+        ## Text currently shown in each field, and the fields marked changed
+        self.displayed = {}
+        self.highlighted = set()
         self.initUI()
 
     def initUI(self):
         self.grid = QGridLayout()
         self.grid.setSpacing(5)
 
-        self.init_processor_info()
-
+        ## The text area first, the processor info highlights its lines
         self.init_textarea()
 
+        self.init_processor_info()
+
         self.init_buttons()
 
         self.setLayout(self.grid)
@@ -66,6 +181,13 @@ class MainWidget(QWidget):
         set_interval_button.clicked.connect(self.show_set_interval_dialog)
         self.grid.addWidget(set_interval_button, 16, 8)
 
+        cancel_button = QPushButton('Cancel')
+        cancel_button.clicked.connect(self.cancel)
+        self.grid.addWidget(cancel_button, 16, 9)
+
+        self.progress_text = QLabel('')
+        self.grid.addWidget(self.progress_text, 17, 8, 1, 2)
+
     def init_fetch(self):
         fetch = QLabel('<b>Fetch:</b>')
         F_predPC = QLabel('F_predPC:')
@@ -324,92 +446,81 @@ class MainWidget(QWidget):
         self.init_cpu_conditions()
         self.init_register_files()
 
+        self.widgets = dict((name, getattr(self, name + '_text'))
+                            for name in DISPLAY_FIELDS)
         self.update_processor_info()
 
+    def initial_values(self):
+        ## What the fields show before the first cycle
+        values = {'cycle': '0', 'ZF': '0', 'SF': '0', 'OF': '0'}
+        for name in REGISTER_WIDGETS:
+            values[name] = '0x00000000'
+        for name, attr, padded in FIELDS:
+            if padded:
+                values[name] = '0x00000000'
+            elif name[2:] in ('rA', 'rB', 'dstE', 'dstM', 'srcA', 'srcB'):
+                values[name] = '0x8'
+            else:
+                values[name] = '0x0'
+        return values
+
+    def record_values(self, step, record):
+        values = {'cycle': str(step)}
+        for cc in CONDITIONS:
+            values[cc] = str(record['condition_code'][cc])
+        for reg, name in enumerate(REGISTER_WIDGETS):
+            values[name] = special_hex(record['registers'][reg])
+        for name in FIELD_NAMES:
+            values[name] = record[name]
+        return values
+
     def update_processor_info(self, step=-1):
         if step == -1:
-            self.cycle_text.setText('0')
-            self.ZF_text.setText('0')
-            self.SF_text.setText('0')
-            self.OF_text.setText('0')
-            self.eax_text.setText('0x00000000')
-            self.ecx_text.setText('0x00000000')
-            self.edx_text.setText('0x00000000')
-            self.ebx_text.setText('0x00000000')
-            self.esp_text.setText('0x00000000')
-            self.ebp_text.setText('0x00000000')
-            self.esi_text.setText('0x00000000')
-            self.edi_text.setText('0x00000000')
-            self.F_predPC_text.setText('0x0')
-            self.D_icode_text.setText('0x0')
-            self.D_ifun_text.setText('0x0')
-            self.D_rA_text.setText('0x8')
-            self.D_rB_text.setText('0x8')
-            self.D_valC_text.setText('0x00000000')
-            self.D_valP_text.setText('0x00000000')
-            self.E_icode_text.setText('0x0')
-            self.E_ifun_text.setText('0x0')
-            self.E_valC_text.setText('0x00000000')
-            self.E_valA_text.setText('0x00000000')
-            self.E_valB_text.setText('0x00000000')
-            self.E_dstE_text.setText('0x8')
-            self.E_dstM_text.setText('0x8')
-            self.E_srcA_text.setText('0x8')
-            self.E_srcB_text.setText('0x8')
-            self.M_icode_text.setText('0x0')
-            self.M_Bch_text.setText('0x0')
-            self.M_valE_text.setText('0x00000000')
-            self.M_valA_text.setText('0x00000000')
-            self.M_dstE_text.setText('0x8')
-            self.M_dstM_text.setText('0x8')
-            self.W_icode_text.setText('0x0')
-            self.W_valE_text.setText('0x00000000')
-            self.W_valM_text.setText('0x00000000')
-            self.W_dstE_text.setText('0x8')
-            self.W_dstM_text.setText('0x8')
+            values = self.initial_values()
+            self.highlight_source({})
         else:
             try:
-                self.cycle_text.setText(str(step))
-                self.ZF_text.setText(str(self.processor.log[step]['condition_code']['ZF']))
-                self.SF_text.setText(str(self.processor.log[step]['condition_code']['SF']))
-                self.OF_text.setText(str(self.processor.log[step]['condition_code']['OF']))
-                self.eax_text.setText(special_hex(self.processor.log[step]['registers'][0]))
-                self.ecx_text.setText(special_hex(self.processor.log[step]['registers'][1]))
-                self.edx_text.setText(special_hex(self.processor.log[step]['registers'][2]))
-                self.ebx_text.setText(special_hex(self.processor.log[step]['registers'][3]))
-                self.esp_text.setText(special_hex(self.processor.log[step]['registers'][4]))
-                self.ebp_text.setText(special_hex(self.processor.log[step]['registers'][5]))
-                self.esi_text.setText(special_hex(self.processor.log[step]['registers'][6]))
-                self.edi_text.setText(special_hex(self.processor.log[step]['registers'][7]))
-                self.F_predPC_text.setText(self.processor.log[step]['F_predPC'])
-                self.D_icode_text.setText(self.processor.log[step]['D_icode'])
-                self.D_ifun_text.setText(self.processor.log[step]['D_ifun'])
-                self.D_rA_text.setText(self.processor.log[step]['D_rA'])
-                self.D_rB_text.setText(self.processor.log[step]['D_rB'])
-                self.D_valC_text.setText(self.processor.log[step]['D_valC'])
-                self.D_valP_text.setText(self.processor.log[step]['D_valP'])
-                self.E_icode_text.setText(self.processor.log[step]['E_icode'])
-                self.E_ifun_text.setText(self.processor.log[step]['E_ifun'])
-                self.E_valC_text.setText(self.processor.log[step]['E_valC'])
-                self.E_valA_text.setText(self.processor.log[step]['E_valA'])
-                self.E_valB_text.setText(self.processor.log[step]['E_valB'])
-                self.E_dstE_text.setText(self.processor.log[step]['E_dstE'])
-                self.E_dstM_text.setText(self.processor.log[step]['E_dstM'])
-                self.E_srcA_text.setText(self.processor.log[step]['E_srcA'])
-                self.E_srcB_text.setText(self.processor.log[step]['E_srcB'])
-                self.M_icode_text.setText(self.processor.log[step]['M_icode'])
-                self.M_Bch_text.setText(self.processor.log[step]['M_Bch'])
-                self.M_valE_text.setText(self.processor.log[step]['M_valE'])
-                self.M_valA_text.setText(self.processor.log[step]['M_valA'])
-                self.M_dstE_text.setText(self.processor.log[step]['M_dstE'])
-                self.M_dstM_text.setText(self.processor.log[step]['M_dstM'])
-                self.W_icode_text.setText(self.processor.log[step]['W_icode'])
-                self.W_valE_text.setText(self.processor.log[step]['W_valE'])
-                self.W_valM_text.setText(self.processor.log[step]['W_valM'])
-                self.W_dstE_text.setText(self.processor.log[step]['W_dstE'])
-                self.W_dstM_text.setText(self.processor.log[step]['W_dstM'])
+                record = self.timeline.record(step)
             except IndexError:
                 self.show_warning_message('Run time error')
+                return
+            values = self.record_values(step, record)
+            self.highlight_source(record['stage_addresses'])
+
+        ## Only repaint the fields that differ from what is on screen, and
+        ## mark them until the next update
+        for name, text in values.items():
+            widget = self.widgets[name]
+            if self.displayed.get(name) == text:
+                if name in self.highlighted:
+                    widget.setStyleSheet('')
+                    self.highlighted.remove(name)
+                continue
+            widget.setText(text)
+            if self.displayed and name != 'cycle':
+                if name not in self.highlighted:
+                    widget.setStyleSheet(CHANGED_STYLE)
+                    self.highlighted.add(name)
+        self.displayed = values
+
+    def highlight_source(self, addresses):
+        ## Mark the .yo line of the instruction in each stage, given the
+        ## stage addresses of a log record
+        index = self.source_index
+        document = self.src_text.document()
+        selections = []
+        for stage in STAGE_NAMES:
+            addr = addresses.get(stage, -1)
+            number = index.line_number(addr) if addr >= 0 else None
+            if number is None:
+                continue
+            selection = QTextEdit.ExtraSelection()
+            selection.format.setBackground(QColor(STAGE_COLORS[stage]))
+            selection.format.setProperty(QTextFormat.FullWidthSelection, True)
+            selection.cursor = QTextCursor(
+                document.findBlockByNumber(number - 1))
+            selections.append(selection)
+        self.src_text.setExtraSelections(selections)
 
     def show_warning_message(self, string):
         message_box = QMessageBox()
@@ -435,12 +546,107 @@ class MainWidget(QWidget):
 
         with f:
             data = f.readlines()
-            self.processor.set_input_file(data)
+            try:
+                self.processor.reset()
+                self.processor.set_input_file(data)
+            except LoadError as error:
+                self.show_warning_message('Init Error: %s' % error)
+                return
             self.src_text.setText(''.join(line for line in data))
-            self.processor.run_processor()
+            self.source_index = self.processor.source_index
+            self.stop_worker()
+            self.close_trace()
+            self.timeline = Timeline(self.processor)
+            self.simulated_cycle = -1
+            self.current_step = 0
+            self.update_processor_info()
+            self.start_worker()
 
         f.close()
 
+    def show_trace_dialog(self):
+        fname = QFileDialog.getOpenFileName(self, 'Open trace', '~')[0]
+        if not fname:
+            return
+        try:
+            trace_file = open(fname, 'rb')
+        except IOError as error:
+            self.show_warning_message('Trace Error: %s' % error)
+            return
+        try:
+            trace = TraceFile(trace_file)
+            image = trace.image()
+        except (TraceFileError, LoadError) as error:
+            trace_file.close()
+            self.show_warning_message('Trace Error: %s' % error)
+            return
+        if not len(trace):
+            trace_file.close()
+            self.show_warning_message('Trace Error: the trace is empty')
+            return
+
+        ## Only the chunks of the cycles looked at are read
+        self.stop_worker()
+        self.close_trace()
+        self.trace_file = trace_file
+        self.src_text.setText(trace.source)
+        self.source_index = image.index
+        self.timeline = TraceTimeline(trace)
+        self.simulated_cycle = trace.last()
+        self.current_step = self.timeline.first()
+        self.update_processor_info(self.current_step)
+        self.progress_text.setText('Trace of %d cycles' % len(trace))
+
+    def close_trace(self):
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+
+    def start_worker(self):
+        self.worker = SimulationWorker(self.processor.snapshot(),
+                                       self.timeline.interval)
+        self.worker.checkpoint.connect(self.timeline.add_checkpoint)
+        self.worker.progress.connect(self.update_progress)
+        self.worker.finished_at.connect(self.simulation_finished)
+        self.progress_text.setText('Simulating...')
+        self.worker.start()
+
+    def stop_worker(self):
+        if self.worker is None:
+            return
+        self.worker.requestInterruption()
+        self.worker.wait()
+        self.worker.checkpoint.disconnect()
+        self.worker.progress.disconnect()
+        self.worker.finished_at.disconnect()
+        self.worker = None
+
+    def update_progress(self, cycle):
+        ## Ignore signals still queued by a worker that was stopped
+        if self.sender() is not self.worker:
+            return
+        self.simulated_cycle = cycle
+        self.progress_text.setText('Simulated %d cycles' % (cycle + 1))
+
+    def simulation_finished(self, cycle, reason):
+        if self.sender() is not self.worker:
+            return
+        self.simulated_cycle = cycle
+        self.timeline.finish(cycle)
+        self.progress_text.setText(FINISHED_MESSAGES[reason] % (cycle + 1))
+
+    def cancel(self):
+        if self.worker is None or not self.worker.isRunning():
+            return
+        self.stop_worker()
+        self.progress_text.setText('Cancelled after %d cycles'
+                                   % (self.simulated_cycle + 1))
+
+    def is_simulated(self, cycle):
+        ## Cycles past the worker are only shown once it gets there, unless
+        ## it was cancelled, in which case the display simulates them itself
+        return cycle <= self.simulated_cycle or self.worker is None
+
     def show_set_interval_dialog(self):
         val, ok = QInputDialog.getInt(self, 'Set Running interval', 'Enter the interval value:')
         if ok:
@@ -449,40 +655,62 @@ class MainWidget(QWidget):
             except:
                 self.show_warning_message('Invalid value')
 
+    def cycles_due(self):
+        ## Cycles that should have been shown since the last frame
+        elapsed = self.run_clock.restart()
+        if self.timer_interval <= 0:
+            return CHECKPOINT_INTERVAL
+        self.run_backlog += elapsed
+        due = self.run_backlog // self.timer_interval
+        self.run_backlog -= due * self.timer_interval
+        return due
+
     def run_helper(self):
-        if self.current_step == self.processor.cycle:
+        if self.timeline.is_last(self.current_step):
             self.run_timer.stop()
             self.show_warning_message('Process finished')
             return
-        self.current_step += 1
+        target = self.current_step + self.cycles_due()
+        if self.worker is not None:
+            ## Wait for the worker to catch up
+            target = min(target, self.simulated_cycle)
+        if target <= self.current_step:
+            return
+        self.current_step = self.timeline.seek(target)
         self.update_processor_info(self.current_step)
 
     def run(self):
-        if not self.processor.log:
+        if self.timeline is None:
             self.show_warning_message('Please choose a .yo file first')
             return
-        self.current_step = 0
+        self.current_step = self.timeline.first()
+        self.run_clock = QElapsedTimer()
+        self.run_clock.start()
+        self.run_backlog = 0
         self.run_timer = QTimer()
         self.run_timer.timeout.connect(self.run_helper)
-        self.run_timer.start(self.timer_interval)
+        self.run_timer.start(max(self.timer_interval, FRAME_INTERVAL))
         return
 
     def step(self):
-        if not self.processor.log:
+        if self.timeline is None:
             self.show_warning_message('Please choose a .yo file first')
             return
-        if self.current_step == self.processor.cycle:
+        if self.timeline.is_last(self.current_step):
             self.show_warning_message('Process finished')
             return
+        if not self.is_simulated(self.current_step + 1):
+            self.show_warning_message('Still simulating, please wait')
+            return
         self.current_step += 1
         self.update_processor_info(self.current_step)
         pass
 
     def back(self):
-        if not self.processor.log:
+        if self.timeline is None:
             self.show_warning_message('Please choose a .yo file first')
             return
-        if self.current_step == 0:
+        if self.current_step <= self.timeline.first():
             self.show_warning_message('This is the first cycle')
             return
         self.current_step -= 1
@@ -490,10 +718,10 @@ class MainWidget(QWidget):
         pass
 
     def reset(self):
-        if not self.processor.log:
+        if self.timeline is None:
             self.show_warning_message('Please choose a .yo file first')
             return
-        self.current_step = 0
+        self.current_step = self.timeline.first()
         self.update_processor_info(self.current_step)
         pass
 
@@ -517,9 +745,10 @@ class MainWindow(QMainWindow):
         self.setWindowTitle('Y86 Pipeline Simulator')
         self.show()
 
-        test = QTextEdit()
-        test.setGeometry(100, 100, 100, 100)
-        test.show()
+    def closeEvent(self, event):
+        self.main_widget.stop_worker()
+        self.main_widget.close_trace()
+        super(MainWindow, self).closeEvent(event)
 
     def center(self):
         screen = QDesktopWidget().screenGeometry()
@@ -553,16 +782,22 @@ class MainWindow(QMainWindow):
         reset.setStatusTip('Reset a running processor')
         reset.triggered.connect(self.main_widget.reset)
 
+        open_trace = QAction('Open trace', self)
+        open_trace.setShortcut('Ctrl+T')
+        open_trace.setStatusTip('Open a binary trace file')
+        open_trace.triggered.connect(self.main_widget.show_trace_dialog)
+
         menubar = self.menuBar()
         file_menu = menubar.addMenu('&File')
         file_menu.addAction(open_file)
+        file_menu.addAction(open_trace)
         processor_menu = menubar.addMenu('&Processor')
         processor_menu.addAction(run_file)
         processor_menu.addAction(step)
         processor_menu.addAction(back)
         processor_menu.addAction(reset)
 
-# if __name__ == '__main__':
-app = QApplication(sys.argv)
-main_window = MainWindow()
-sys.exit(app.exec_())
+if __name__ == '__main__':
+    app = QApplication(sys.argv)
+    main_window = MainWindow()
+    sys.exit(app.exec_())
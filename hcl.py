@@ -0,0 +1,550 @@
+#!/usr/bin/python
+
+## Compiler from an HCL description of the pipeline control logic to the
+## Python functions that update the pipeline registers
+
+import hashlib
+import os
+import re
+import sys
+
+import isa
+from counters import CAUSE_CONSTANTS
+
+## Bump when the generated code changes, so stale cache entries are ignored
+HCL_VERSION = 6
+
+## Where compiled descriptions are cached: $Y86_HCL_CACHE if set, else
+## ~/.cache/y86-hcl. 'off' turns the cache off.
+HCL_CACHE_DIR = os.environ.get('Y86_HCL_CACHE') or \
+    os.path.join(os.path.expanduser('~'), '.cache', 'y86-hcl')
+if HCL_CACHE_DIR == 'off':
+    HCL_CACHE_DIR = None
+
+def set_cache_dir(path):
+    ## Cache in `path` from now on, None or 'off' for no cache
+    global HCL_CACHE_DIR
+    HCL_CACHE_DIR = None if path == 'off' else path
+
+## Signals the description must define
+REQUIRED_SIGNALS = ('f_pc', 'F_stall', 'D_stall', 'D_bubble', 'E_stall',
+                    'E_bubble', 'M_stall', 'M_bubble', 'W_stall', 'W_bubble')
+
+## Signals giving the cause of the bubbles, only used with the performance
+## counters. A bubble whose cause is not defined counts as COTHER.
+CAUSE_SIGNALS = ('D_bubble_cause', 'E_bubble_cause', 'M_bubble_cause',
+                 'W_bubble_cause')
+
+## Names an HCL description can use for instruction, register, ALU,
+## status and jump codes, and for bubble causes
+CONSTANTS = dict((name, getattr(isa, name)) for name in dir(isa)
+                 if re.match(r'(I|F|R|ALU|S)[A-Z]+$', name))
+CONSTANTS.update(CAUSE_CONSTANTS)
+
+TOKEN = re.compile(r'''
+    (?P<space>[ \t\r]+|\#[^\n]*) |
+    (?P<newline>\n) |
+    (?P<number>0x[0-9a-fA-F]+|[0-9]+) |
+    (?P<name>[A-Za-z_][A-Za-z0-9_]*) |
+    (?P<string>'[^'\n]*') |
+    (?P<op>&&|\|\||==|!=|<=|>=|[-!<>=;:,\[\]{}()])
+''', re.VERBOSE)
+
+COMPARISONS = ('==', '!=', '<', '<=', '>', '>=')
+
+## The register updates run from W back to F, each right before the
+## combinational logic of its stage. A signal is evaluated when the
+## register it controls is updated, so signals of earlier stages see the
+## new contents of the later pipeline registers. F_held, E_held and M_held
+## tell the stages whether they are working on the same instruction again.
+## Instructions take their address along, for the profiler and for the
+## source lines of the trace; a bubble keeps the address it replaces.
+## The latched signals are the exception: they are evaluated at the start
+## of writeback_write, on the registers of the previous cycle, the way the
+## hardware sees them at the clock edge, and read from p afterwards.
+## The %(..._count)s lines are empty unless the performance counters are on.
+TEMPLATE = '''def select_pc(p):
+    return %(f_pc)s
+
+def writeback_write(p):
+%(latch)s
+    if %(W_stall)s:
+%(W_stall_count)s
+        return
+    if %(W_bubble)s:
+%(W_bubble_count)s
+        p.W_stat  = SBUB
+        p.W_icode = INOP
+        p.W_ifun  = FNONE
+        p.W_valE  = 0x0
+        p.W_valM  = 0x0
+        p.W_dstE  = RNONE
+        p.W_dstM  = RNONE
+        p.W_pred  = False
+        return
+    p.W_stat  = p.m_stat
+    p.W_icode = p.M_icode
+    p.W_ifun  = p.M_ifun
+    p.W_valE  = p.M_valE
+    p.W_valM  = p.m_valM
+    p.W_dstE  = p.M_dstE
+    p.W_dstM  = p.M_dstM
+    p.W_pred  = p.M_pred
+    p.W_addr  = p.M_addr
+%(W_count)s
+
+def memory_write(p):
+    if %(M_stall)s:
+        p.M_held = True
+%(M_stall_count)s
+        return
+    p.M_held = False
+    if %(M_bubble)s:
+%(M_bubble_count)s
+        p.M_stat  = SBUB
+        p.M_icode = INOP
+        p.M_ifun  = FNONE
+        p.M_Cnd   = False
+        p.M_valE  = 0x0
+        p.M_valA  = 0x0
+        p.M_dstE  = RNONE
+        p.M_dstM  = RNONE
+        p.M_valC  = 0x0
+        p.M_pred  = False
+        return
+    p.M_stat  = p.E_stat
+    p.M_icode = p.E_icode
+    p.M_ifun  = p.E_ifun
+    p.M_Cnd   = p.e_Cnd
+    p.M_valE  = p.e_valE
+    p.M_valA  = p.E_valA
+    p.M_dstE  = p.e_dstE
+    p.M_dstM  = p.E_dstM
+    p.M_valC  = p.E_valC
+    p.M_pred  = p.E_pred
+    p.M_addr  = p.E_addr
+%(M_count)s
+
+def execute_write(p):
+    if %(E_stall)s:
+        p.E_held = True
+%(E_stall_count)s
+        return
+    p.E_held = False
+    if %(E_bubble)s:
+%(E_bubble_count)s
+        p.E_icode = INOP
+        p.E_ifun  = FNONE
+        p.E_valC  = 0x0
+        p.E_valA  = 0x0
+        p.E_valB  = 0x0
+        p.E_dstE  = RNONE
+        p.E_dstM  = RNONE
+        p.E_srcA  = RNONE
+        p.E_srcB  = RNONE
+        p.E_pred  = False
+        p.E_stat  = SBUB
+        return
+    p.E_stat  = p.D_stat
+    p.E_icode = p.D_icode
+    p.E_ifun  = p.D_ifun
+    p.E_valC  = p.D_valC
+    p.E_valA  = p.d_valA
+    p.E_valB  = p.d_valB
+    p.E_dstE  = p.d_dstE
+    p.E_dstM  = p.d_dstM
+    p.E_srcA  = p.d_srcA
+    p.E_srcB  = p.d_srcB
+    p.E_pred  = p.D_pred
+    p.E_addr  = p.D_addr
+%(E_count)s
+
+def decode_write(p):
+    if %(D_stall)s:
+%(D_stall_count)s
+        return
+    if %(D_bubble)s:
+%(D_bubble_count)s
+        p.D_icode = INOP
+        p.D_ifun  = FNONE
+        p.D_rA    = RNONE
+        p.D_rB    = RNONE
+        p.D_valC  = 0x0
+        p.D_valP  = 0x0
+        p.D_pred  = False
+        p.D_stat  = SBUB
+        return
+    p.D_stat  = p.f_stat
+    p.D_icode = p.f_icode
+    p.D_ifun  = p.f_ifun
+    p.D_rA    = p.f_rA
+    p.D_rB    = p.f_rB
+    p.D_valC  = p.f_valC
+    p.D_valP  = p.f_valP
+    p.D_pred  = p.f_pred
+    p.D_addr  = p.f_addr
+%(D_count)s
+
+def fetch_write(p):
+    if %(F_stall)s:
+        p.F_held = True
+%(F_stall_count)s
+        return
+    p.F_held = False
+    p.F_predPC = p.f_predPC
+    p.F_stat = SAOK
+'''
+
+## What the %(..._count)s lines of TEMPLATE hold with the counters on.
+## Bubbles take their cause along, to be counted as lost cycles in W. A
+## cause is worked out before the bubble replaces the register contents.
+COUNTING = {
+    'W_stall_count': '        p.perf.stalls[4] += 1',
+    'W_bubble_count': '''        p.W_cause = %(W_bubble_cause)s
+        p.perf.bubbles[4] += 1
+        p.perf.lost[p.W_cause] += 1''',
+    'W_count': '''    p.W_cause = p.M_cause
+    if p.W_stat == SAOK:
+        p.perf.mix[p.W_icode] += 1
+    elif p.W_stat == SBUB:
+        p.perf.lost[p.W_cause] += 1''',
+    'M_stall_count': '        p.perf.stalls[3] += 1',
+    'M_bubble_count': '''        p.M_cause = %(M_bubble_cause)s
+        p.perf.bubbles[3] += 1''',
+    'M_count': '    p.M_cause = p.E_cause',
+    'E_stall_count': '        p.perf.stalls[2] += 1',
+    'E_bubble_count': '''        p.E_cause = %(E_bubble_cause)s
+        p.perf.bubbles[2] += 1''',
+    'E_count': '''    p.E_cause = p.D_cause
+    if p.E_stat == SAOK:
+        p.perf.forward[p.d_fwdA] += 1
+        p.perf.forward[p.d_fwdB] += 1''',
+    'D_stall_count': '        p.perf.stalls[1] += 1',
+    'D_bubble_count': '''        p.D_cause = %(D_bubble_cause)s
+        p.perf.bubbles[1] += 1''',
+    'D_count': '    p.D_cause = p.f_cause',
+    'F_stall_count': '        p.perf.stalls[0] += 1',
+}
+
+## Functions defined by TEMPLATE
+GENERATED = ('select_pc', 'writeback_write', 'memory_write', 'execute_write',
+             'decode_write', 'fetch_write')
+
+class HCLError(Exception):
+    pass
+
+class PipelineLogic():
+    ## The generated functions, each taking the processor as argument
+    def __init__(self, source):
+        self.source = source
+        namespace = dict(CONSTANTS)
+        exec(compile(source, '<hcl>', 'exec'), namespace)
+        for name in GENERATED:
+            if name not in namespace:
+                raise NameError('%s is not defined' % name)
+            setattr(self, name, namespace[name])
+
+def tokenize(text):
+    tokens = []
+    line = 1
+    pos = 0
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        if match is None:
+            raise HCLError('line %d: unexpected %r' % (line, text[pos]))
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == 'newline':
+            line += 1
+        elif kind != 'space':
+            tokens.append((kind, match.group(kind), line))
+    tokens.append(('end', None, line))
+    return tokens
+
+class Parser():
+    ## Recursive descent over the HCL subset used for the control logic:
+    ##   bool NAME = expression;   word NAME = expression;
+    ## with ||, &&, !, comparisons, `in { ... }` sets and [ case : value; ]
+    ## case expressions. quote, boolsig and wordsig declarations are
+    ## accepted and ignored. A definition prefixed with `latched` is
+    ## evaluated once at the start of the cycle, see TEMPLATE.
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.pos = 0
+        ## Names of the latched definitions, in order
+        self.latched = []
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def accept(self, value):
+        if self.peek()[1] == value and self.peek()[0] in ('op', 'name'):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, value):
+        kind, text, line = self.next()
+        if text != value or kind not in ('op', 'name'):
+            raise HCLError('line %d: expected %r, found %r'
+                           % (line, value, text if text is not None
+                              else 'end of file'))
+
+    def expect_name(self):
+        kind, text, line = self.next()
+        if kind != 'name':
+            raise HCLError('line %d: expected a name, found %r' % (line, text))
+        return text
+
+    def parse(self):
+        ## Returns {name: (expression tree, line)}
+        definitions = {}
+        while self.peek()[0] != 'end':
+            kind, text, line = self.next()
+            latched = kind == 'name' and text == 'latched'
+            if latched:
+                kind, text, line = self.next()
+                if kind != 'name' or text not in ('bool', 'word', 'int'):
+                    raise HCLError('line %d: expected a definition after '
+                                   'latched, found %r' % (line, text))
+            if kind == 'name' and text == 'quote':
+                self.expect_string()
+            elif kind == 'name' and text in ('boolsig', 'wordsig'):
+                self.expect_name()
+                self.expect_string()
+            elif kind == 'name' and text in ('bool', 'word', 'int'):
+                name = self.expect_name()
+                self.expect('=')
+                expression = self.expression()
+                self.expect(';')
+                if name in definitions:
+                    raise HCLError('line %d: %s is defined twice'
+                                   % (line, name))
+                definitions[name] = (expression, line)
+                if latched:
+                    self.latched.append(name)
+            else:
+                raise HCLError('line %d: expected a definition, found %r'
+                               % (line, text))
+        return definitions
+
+    def expect_string(self):
+        kind, text, line = self.next()
+        if kind != 'string':
+            raise HCLError('line %d: expected a quoted string, found %r'
+                           % (line, text))
+
+    def expression(self):
+        node = self.conjunction()
+        while self.accept('||'):
+            node = ('or', node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.accept('&&'):
+            node = ('and', node, self.negation())
+        return node
+
+    def negation(self):
+        if self.accept('!'):
+            return ('not', self.negation())
+        return self.comparison()
+
+    def comparison(self):
+        node = self.operand()
+        kind, text, line = self.peek()
+        if kind == 'op' and text in COMPARISONS:
+            self.pos += 1
+            return ('compare', text, node, self.operand())
+        if kind == 'name' and text == 'in':
+            self.pos += 1
+            self.expect('{')
+            items = [self.expression()]
+            while self.accept(','):
+                items.append(self.expression())
+            self.expect('}')
+            return ('in', node, items)
+        return node
+
+    def operand(self):
+        kind, text, line = self.next()
+        if kind == 'number':
+            return ('number', int(text, 0))
+        if kind == 'name':
+            return ('name', text, line)
+        if text == '-':
+            return ('negate', self.operand())
+        if text == '(':
+            node = self.expression()
+            self.expect(')')
+            return node
+        if text == '[':
+            cases = []
+            while not self.accept(']'):
+                condition = self.expression()
+                self.expect(':')
+                value = self.expression()
+                self.expect(';')
+                cases.append((condition, value))
+            return ('case', cases)
+        raise HCLError('line %d: unexpected %r' % (line, text if text
+                                                   is not None
+                                                   else 'end of file'))
+
+class Generator():
+    ## Turns expression trees into Python expressions over the processor
+    ## `p`. Constants become literals, processor fields become attribute
+    ## reads and other definitions are expanded in place, apart from the
+    ## latched ones, which are read from `p` as well.
+    def __init__(self, definitions, fields, latched=()):
+        self.definitions = definitions
+        self.fields = fields
+        self.latched = latched
+        self.expanding = []
+
+    def signal(self, name):
+        if name in self.expanding:
+            raise HCLError('line %d: %s depends on itself'
+                           % (self.definitions[name][1], name))
+        self.expanding.append(name)
+        code = self.generate(self.definitions[name][0])
+        self.expanding.pop()
+        return code
+
+    def generate(self, node):
+        kind = node[0]
+        if kind == 'number':
+            return repr(node[1])
+        if kind == 'name':
+            name, line = node[1], node[2]
+            if name in self.latched:
+                return 'p.%s' % name
+            if name in self.definitions:
+                return self.signal(name)
+            if name in CONSTANTS:
+                return repr(CONSTANTS[name])
+            if name in self.fields:
+                return 'p.%s' % name
+            raise HCLError('line %d: unknown name %s' % (line, name))
+        if kind == 'negate':
+            return '(-%s)' % self.generate(node[1])
+        if kind == 'not':
+            return '(not %s)' % self.generate(node[1])
+        if kind in ('and', 'or'):
+            return '(%s %s %s)' % (self.generate(node[1]), kind,
+                                   self.generate(node[2]))
+        if kind == 'compare':
+            return '(%s %s %s)' % (self.generate(node[2]), node[1],
+                                   self.generate(node[3]))
+        if kind == 'in':
+            return '(%s in (%s,))' % (self.generate(node[1]),
+                                      ', '.join(self.generate(item)
+                                                for item in node[2]))
+        if kind == 'case':
+            ## The first case that holds gives the value, 0 when none does
+            code = '0'
+            for condition, value in reversed(node[1]):
+                if condition[0] == 'number' and condition[1]:
+                    code = self.generate(value)
+                else:
+                    code = '(%s if %s else %s)' % (self.generate(value),
+                                                   self.generate(condition),
+                                                   code)
+            return code
+        raise HCLError('cannot generate %r' % (node,))
+
+def generate_source(text, fields, counting=False):
+    parser = Parser(text)
+    definitions = parser.parse()
+    missing = [name for name in REQUIRED_SIGNALS if name not in definitions]
+    if missing:
+        raise HCLError('no definition for: %s' % ', '.join(missing))
+    ## The latched signals are worked out from the registers alone
+    expander = Generator(definitions, fields)
+    latch = ['    p.%s = %s' % (name, expander.signal(name))
+             for name in parser.latched]
+    generator = Generator(definitions, fields, parser.latched)
+    signals = dict((name, generator.signal(name))
+                   for name in REQUIRED_SIGNALS)
+    signals['latch'] = '\n'.join(latch)
+    if counting:
+        causes = dict((name, generator.signal(name) if name in definitions
+                       else repr(CAUSE_CONSTANTS['COTHER']))
+                      for name in CAUSE_SIGNALS)
+        signals.update((name, code % causes)
+                       for name, code in COUNTING.items())
+    else:
+        signals.update((name, '') for name in COUNTING)
+    return TEMPLATE % signals
+
+## Hash of the code generator, filled in by generator_digest()
+generator_hash = None
+
+def generator_digest():
+    ## The source of this module, template and generator included, so that
+    ## a change to either misses the cache even without a new HCL_VERSION.
+    ## Without the source, the template and counting code stand in for it.
+    global generator_hash
+    if generator_hash is None:
+        try:
+            with open(os.path.splitext(__file__)[0] + '.py', 'r') as source:
+                text = source.read()
+        except (IOError, OSError):
+            text = TEMPLATE + repr(sorted(COUNTING.items()))
+        generator_hash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    return generator_hash
+
+def compile_hcl(text, fields, cache_dir=None, counting=False):
+    ## Compile a control description into a PipelineLogic. `fields` are
+    ## the processor attributes the description may read. With counting,
+    ## the register updates also update the performance counters in
+    ## p.perf. The generated code is cached in cache_dir, keyed by a hash
+    ## of the description and the generator; None caches in HCL_CACHE_DIR
+    ## and 'off' disables the cache.
+    if cache_dir is None:
+        cache_dir = HCL_CACHE_DIR
+    elif cache_dir == 'off':
+        cache_dir = None
+    key = hashlib.sha1(('%d\n%s\n%d\n%s\n%s' % (
+        HCL_VERSION, generator_digest(), counting, ' '.join(sorted(fields)),
+        text)).encode('utf-8')).hexdigest()
+    path = None
+    if cache_dir:
+        path = os.path.join(cache_dir, key + '.py')
+        try:
+            with open(path, 'r') as cache_file:
+                cached = cache_file.read()
+        except (IOError, OSError):
+            cached = None
+        ## A truncated or stale entry is generated again
+        if cached is not None:
+            try:
+                return PipelineLogic(cached)
+            except (SyntaxError, NameError) as error:
+                sys.stderr.write('HCL cache: regenerating %s: %s\n'
+                                 % (path, error))
+
+    source = generate_source(text, fields, counting)
+    logic = PipelineLogic(source)
+    if path:
+        ## The cache is only an optimisation, a read-only home is fine
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            temp_path = '%s.%d.tmp' % (path, os.getpid())
+            with open(temp_path, 'w') as cache_file:
+                cache_file.write(source)
+            os.rename(temp_path, path)
+        except (IOError, OSError):
+            pass
+    return logic
+
+def load_hcl(path, fields, cache_dir=None, counting=False):
+    with open(path, 'r') as hcl_file:
+        return compile_hcl(hcl_file.read(), fields, cache_dir, counting)
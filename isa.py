@@ -0,0 +1,137 @@
+#!/usr/bin/python
+
+## The Y86 instruction set, shared by the pipeline and functional simulators
+
+TMAX = 2**31-1
+TMIN = -TMAX -1
+
+## Instruction codes
+INOP    = 0x0
+IHALT   = 0x1
+IRRMOVL = 0x2
+IIRMOVL = 0x3
+IRMMOVL = 0x4
+IMRMOVL = 0x5
+IOPL    = 0x6
+IJXX    = 0x7
+ICALL   = 0x8
+IRET    = 0x9
+IPUSHL  = 0xa
+IPOPL   = 0xb
+
+FNONE   = 0x0
+
+## Registers
+RESP    = 0x4
+RNONE   = 0x8
+REGISTER_COUNT = 8
+REGISTER_NAMES = ('%eax', '%ecx', '%edx', '%ebx', '%esp', '%ebp', '%esi', '%edi')
+
+## ALU functions
+ALUADD  = 0x0
+ALUSUB  = 0x1
+ALUAND  = 0x2
+ALUXOR  = 0x3
+
+## Status codes
+SBUB    = 'BUB' # Bubble in stage
+SAOK    = 'AOK' # Normal execution
+SADR    = 'ADR' # Invalid memory address
+SINS    = 'INS' # Invalid instruction
+SHLT    = 'HLT' # Halt instruction encountered
+
+## Jump and conditional move functions
+FJMP    = 0x0
+FJLE    = 0x1
+FJL     = 0x2
+FJE     = 0x3
+FJNE    = 0x4
+FJGE    = 0x5
+FJG     = 0x6
+
+VALID_ICODES = frozenset((INOP, IHALT, IRRMOVL, IIRMOVL, IRMMOVL, IMRMOVL,
+                          IOPL, IJXX, ICALL, IRET, IPUSHL, IPOPL))
+NEED_REGIDS = frozenset((IRRMOVL, IOPL, IPUSHL, IPOPL, IIRMOVL, IRMMOVL,
+                         IMRMOVL))
+NEED_VALC = frozenset((IIRMOVL, IRMMOVL, IMRMOVL, IJXX, ICALL))
+
+def valid_register(reg):
+    return 0 <= reg < REGISTER_COUNT or reg == RNONE
+
+def decode_instruction(memory, pc):
+    ## Fetch the instruction at pc. Returns what the fetch stage produces:
+    ## (icode, ifun, rA, rB, valC, valP, predPC, stat)
+    f_valC = 0x0
+    f_rA = RNONE
+    f_rB = RNONE
+
+    f_pc = pc
+    imem_error = False
+
+    if not memory.executable(f_pc):
+        imem_error = True
+    else:
+        imem_byte = memory.read_byte(f_pc)
+        f_pc += 1
+
+    f_icode = INOP if imem_error else imem_byte >> 4
+    f_ifun = FNONE if imem_error else imem_byte & 0xf
+
+    instr_valid = f_icode in VALID_ICODES
+
+    if instr_valid:
+        if f_icode in NEED_REGIDS:
+            if not memory.executable(f_pc):
+                imem_error = True
+            else:
+                regids = memory.read_byte(f_pc)
+                f_rA = regids >> 4
+                f_rB = regids & 0xf
+                f_pc += 1
+                if not (valid_register(f_rA) and valid_register(f_rB)):
+                    imem_error = True
+
+        if f_icode in NEED_VALC:
+            if not memory.executable(f_pc, 4):
+                imem_error = True
+            else:
+                f_valC = memory.read_word(f_pc)
+                f_pc += 4
+
+    f_valP = f_pc
+    f_predPC = f_valC if f_icode in (IJXX, ICALL) else f_valP
+
+    f_stat = SAOK
+    if f_icode == IHALT:
+        f_stat = SHLT
+    if not instr_valid:
+        f_stat = SINS
+    if imem_error:
+        f_stat = SADR
+
+    return (f_icode, f_ifun, f_rA, f_rB, f_valC, f_valP, f_predPC, f_stat)
+
+def condition(ifun, conditions):
+    ## Whether a jump or conditional move with function ifun is taken
+    zf = conditions['ZF']
+    sf = conditions['SF']
+    of = conditions['OF']
+    if ifun == FJMP:
+        return True
+    if ifun == FJLE:
+        return (sf ^ of) | zf == 1
+    if ifun == FJL:
+        return sf ^ of == 1
+    if ifun == FJE:
+        return zf == 1
+    if ifun == FJNE:
+        return zf == 0
+    if ifun == FJGE:
+        return sf ^ of == 0
+    if ifun == FJG:
+        return (sf ^ of) | zf == 0
+    return False
+
+def wrap(value):
+    ## Wrap a result to a signed 32-bit word
+    return (value - TMIN) % (1 << 32) + TMIN
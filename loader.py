@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+import binascii
+import re
+from bisect import bisect_right
+
+from memory import MEM_LIMIT
+
+## Disassembly comments of data directives, as opposed to instructions
+data_re = re.compile(r"\s*(\w+:)?\s*\.(long|word|byte|quad)\b")
+
+class LoadError(Exception):
+    def __init__(self, line_number, message):
+        Exception.__init__(self, 'line %d: %s' % (line_number, message))
+        self.line_number = line_number
+
+class SourceIndex():
+    ## The .yo line of each instruction, in parallel lists sorted by
+    ## address: start, end, line number (from 1) and the disassembly after
+    ## the '|'. Looking an address up is a binary search.
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.line_numbers = []
+        self.texts = []
+        self.ordered = True
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, start, end, line_number, text):
+        if self.starts and start < self.starts[-1]:
+            self.ordered = False
+        self.starts.append(start)
+        self.ends.append(end)
+        self.line_numbers.append(line_number)
+        self.texts.append(text)
+
+    def finish(self):
+        ## Sort once at the end if the lines came out of address order
+        if not self.ordered:
+            entries = sorted(zip(self.starts, self.ends, self.line_numbers,
+                                 self.texts))
+            self.starts, self.ends, self.line_numbers, self.texts = \
+                [list(column) for column in zip(*entries)]
+            self.ordered = True
+
+    def find(self, addr):
+        ## Position of the instruction holding addr, or -1
+        index = bisect_right(self.starts, addr) - 1
+        if index >= 0 and addr < self.ends[index]:
+            return index
+        return -1
+
+    def lookup(self, addr):
+        ## (start, line number, disassembly) of the instruction holding
+        ## addr, or None
+        index = self.find(addr)
+        if index < 0:
+            return None
+        return self.starts[index], self.line_numbers[index], self.texts[index]
+
+    def line_number(self, addr):
+        index = self.find(addr)
+        return self.line_numbers[index] if index >= 0 else None
+
+class Image():
+    def __init__(self, data=b'', code_ranges=(), source=(), index=None):
+        self.data = data
+        ## [start, end) address ranges holding instructions
+        self.code_ranges = list(code_ranges)
+        ## The lines of the .yo file, and where each instruction is in them
+        self.source = list(source)
+        self.index = index if index is not None else SourceIndex()
+
+def parse_line(line, line_number):
+    ## Split a .yo line "0x014: 0d000000 | array: .long 0xd" into its
+    ## address, code bytes and comment. Lines without an address give None.
+    text, bar, comment = line.partition('|')
+    addr_text, colon, code = text.partition(':')
+    addr_text = addr_text.strip()
+    if not colon:
+        if addr_text:
+            raise LoadError(line_number, 'expected "address: code"')
+        return None, None, comment
+    try:
+        addr = int(addr_text, 16)
+    except ValueError:
+        raise LoadError(line_number, 'invalid address %r' % addr_text)
+    if addr < 0:
+        raise LoadError(line_number, 'negative address %r' % addr_text)
+    code = code.strip()
+    if not code:
+        return addr, None, comment
+    try:
+        code = binascii.unhexlify(code)
+    except (TypeError, ValueError, binascii.Error):
+        raise LoadError(line_number, 'invalid code %r' % code)
+    return addr, code, comment
+
+def load_image(lines):
+    chunks = []
+    code_ranges = []
+    source = []
+    index = SourceIndex()
+    for line_number, line in enumerate(lines, 1):
+        source.append(line.rstrip('\r\n'))
+        addr, code, comment = parse_line(line, line_number)
+        if code is None:
+            continue
+        chunks.append((addr, code, line_number))
+        if not data_re.match(comment):
+            code_ranges.append((addr, addr + len(code)))
+            index.add(addr, addr + len(code), line_number, comment.strip())
+
+    ## Chunks may come in any order as long as they do not overlap
+    chunks.sort()
+    end = 0
+    for addr, code, line_number in chunks:
+        if addr < end:
+            raise LoadError(line_number,
+                            'code at 0x%x overlaps earlier code' % addr)
+        end = addr + len(code)
+        if end > MEM_LIMIT:
+            raise LoadError(line_number, 'code at 0x%x is past the end of '
+                            'memory at 0x%x' % (addr, MEM_LIMIT))
+
+    ## The image becomes the start of memory.Memory, which is a flat
+    ## bytearray, so the gaps are filled with zeros here rather than kept
+    ## sparse. The check above bounds it to MEM_LIMIT bytes. Allocate it
+    ## once and copy every chunk into place.
+    data = bytearray(end)
+    for addr, code, line_number in chunks:
+        data[addr:addr + len(code)] = code
+    index.finish()
+    return Image(bytes(data), code_ranges, source, index)
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+
+import struct
+
+## Little-endian 32-bit signed word
+WORD = struct.Struct('<i')
+
+## Memory grows on demand up to this many bytes
+MEM_LIMIT = 1 << 20
+
+## Protection attributes, one byte of flags per memory byte
+PROT_WRITE = 0x1
+PROT_EXEC  = 0x2
+
+## Protection policies for a loaded image:
+## 'code':  instructions of the image are read-only, data is writable
+## 'image': the whole loaded image is read-only
+## 'none':  every address may be written
+PROTECTIONS = ('code', 'image', 'none')
+
+class ProtectionError(IndexError):
+    pass
+
+class Memory():
+    def __init__(self, image=b'', limit=MEM_LIMIT):
+        self.data = bytearray(image)
+        self.limit = limit
+
+        ## The loaded image is executable and writable until protected
+        self.attrs = bytearray([PROT_WRITE | PROT_EXEC]) * len(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def copy(self):
+        memory = Memory(limit=self.limit)
+        memory.data = bytearray(self.data)
+        memory.attrs = bytearray(self.attrs)
+        return memory
+
+    def grow(self, size):
+        if size > self.limit:
+            raise IndexError('address out of range')
+        ## Double the backing store so repeated stack pushes stay cheap
+        new_size = min(max(size, 2 * len(self.data)), self.limit)
+        grown = new_size - len(self.data)
+        self.data.extend(bytearray(grown))
+        self.attrs.extend(bytearray([PROT_WRITE]) * grown)
+
+    def protect(self, start, end, flags):
+        start = max(start, 0)
+        end = min(end, len(self.data))
+        if start < end:
+            self.attrs[start:end] = bytearray([flags]) * (end - start)
+
+    def writable(self, addr):
+        attrs = self.attrs
+        return attrs[addr] & attrs[addr+1] & attrs[addr+2] & attrs[addr+3] \
+               & PROT_WRITE != 0
+
+    def executable(self, addr, size=1):
+        if addr < 0 or addr + size > len(self.data):
+            return False
+        for a in range(addr, addr + size):
+            if not self.attrs[a] & PROT_EXEC:
+                return False
+        return True
+
+    def read_byte(self, addr):
+        if addr < 0 or addr >= len(self.data):
+            raise IndexError('address out of range')
+        return self.data[addr]
+
+    def read_word(self, addr):
+        if addr < 0 or addr + 4 > len(self.data):
+            raise IndexError('address out of range')
+        return WORD.unpack_from(self.data, addr)[0]
+
+    def write_word(self, addr, value):
+        if addr < 0:
+            raise IndexError('address out of range')
+        if addr + 4 > len(self.data):
+            self.grow(addr + 4)
+        if not self.writable(addr):
+            raise ProtectionError('write to read-only memory')
+        WORD.pack_into(self.data, addr, value)
+
+    def changes(self, image):
+        ## (address, initial value, current value) of every word that differs
+        ## from the loaded image
+        initial = bytearray(image)
+        initial.extend(bytearray(len(self.data) - len(initial)))
+        changes = []
+        for addr in range(0, len(self.data) - 3, 4):
+            old = WORD.unpack_from(initial, addr)[0]
+            new = WORD.unpack_from(self.data, addr)[0]
+            if old != new:
+                changes.append((addr, old, new))
+        return changes
+
+def protect_image(memory, image_size, code_ranges, protection):
+    if protection == 'none':
+        memory.protect(0, image_size, PROT_WRITE | PROT_EXEC)
+    elif protection == 'image':
+        memory.protect(0, image_size, PROT_EXEC)
+    else:
+        memory.protect(0, image_size, PROT_WRITE | PROT_EXEC)
+        for start, end in code_ranges:
+            memory.protect(start, end, PROT_EXEC)
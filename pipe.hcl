@@ -0,0 +1,101 @@
+## Control logic of the Y86 PIPE processor, compiled by hcl.py
+##
+## The pipeline registers are updated from W back to F, each right before
+## the combinational logic of its stage runs. Every signal is evaluated
+## when the register it controls is updated: F_stall sees the D, E, M and
+## W registers of this cycle, W_stall only sees last cycle's state.
+##
+## X_pred is set by the fetch stage: for a conditional jump, whether it
+## was predicted taken, for a ret, whether its target was predicted by the
+## return address stack. A predicted ret carries its target in valC.
+
+## A conditional jump went the other way than predicted. It is found in E
+## and fixed once the jump has moved on to M. E_mispredicted is latched:
+## it holds for the jump in E at the end of the previous cycle, so decode
+## still gets its bubble when the jump is squashed on its way to M.
+latched bool E_mispredicted = E_icode == IJXX && e_Cnd != E_pred;
+bool M_mispredicted = M_icode == IJXX && M_Cnd != M_pred;
+
+## A ret read another return address than the one it was predicted with
+bool ret_mispredicted = M_icode == IRET && M_pred && m_valM != M_valC;
+
+## A ret with no predicted target: fetch waits until it reaches W
+bool ret_waiting =
+	D_icode == IRET && !D_pred ||
+	E_icode == IRET && !E_pred ||
+	M_icode == IRET && !M_pred;
+
+## What address should instruction be fetched at
+word f_pc = [
+	# Mispredicted branch. Fetch at the path that was not predicted
+	M_mispredicted && M_Cnd : M_valC;
+	M_mispredicted : M_valA;
+	# Mispredicted ret. Fetch at the address it read
+	ret_mispredicted : m_valM;
+	# Completion of RET instruction
+	W_icode == IRET && !W_pred : W_valM;
+	# Default: Use predicted value of PC
+	1 : F_predPC;
+];
+
+## The load in E produces a register the instruction in D reads. It is
+## latched: by the time D is updated, E already holds the bubble that
+## load_use puts behind the load, and D has to stall all the same.
+latched bool load_use =
+	E_icode in { IMRMOVL, IPOPL } && E_dstM in { d_srcA, d_srcB };
+
+## The same check on the registers fetch sees: the load that has just
+## moved into E and the instruction just decoded. Fetch stalls for the
+## hazard a cycle ahead.
+bool load_use_next =
+	E_icode in { IMRMOVL, IPOPL } && E_dstM in { d_srcA, d_srcB };
+
+## The data cache is still serving a miss of the instruction in M: M keeps
+## it and W gets bubbles. E, D and F are updated after the memory stage
+## has run, so they wait on M_held instead.
+bool dmem_busy = m_wait > 0;
+
+## The instruction in W failed
+bool W_failed = W_stat in { SADR, SINS, SHLT };
+
+## A miss in the instruction cache needs no stall: fetch sends bubbles
+## until the instruction arrives
+bool F_stall = load_use_next || ret_waiting || M_held;
+
+bool D_stall = load_use || M_held;
+
+## E, M and W have already been updated this cycle: a ret may have moved
+## on from D, E or M to E, M or W
+bool D_bubble =
+	E_mispredicted || ret_mispredicted || ret_waiting ||
+	W_icode == IRET && !W_pred;
+
+bool E_stall = M_held;
+
+bool E_bubble = E_mispredicted || ret_mispredicted || load_use;
+
+bool M_stall = dmem_busy;
+
+bool M_bubble = m_stat in { SADR, SINS, SHLT } || W_failed;
+
+bool W_stall = W_failed;
+
+bool W_bubble = dmem_busy;
+
+## Why each bubble is inserted, for the performance counters. A fetch that
+## misses the instruction cache makes its own bubbles, counted as CICACHE.
+int D_bubble_cause = [
+	E_mispredicted : CMISPREDICT;
+	ret_mispredicted : CRETMISPREDICT;
+	1 : CRETSTALL;
+];
+
+int E_bubble_cause = [
+	E_mispredicted : CMISPREDICT;
+	ret_mispredicted : CRETMISPREDICT;
+	1 : CLOADUSE;
+];
+
+int M_bubble_cause = CEXCEPTION;
+
+int W_bubble_cause = CDCACHE;
@@ -0,0 +1,224 @@
+#!/usr/bin/python
+
+## Branch predictors for the fetch stage of the pipeline. A predictor is
+## asked at fetch whether a conditional jump is taken, and told the
+## outcome once the jump is executed.
+
+import struct
+
+## Table sizes, in 2-bit or 1-bit counters
+BIMODAL_ENTRIES = 1024
+GSHARE_HISTORY_BITS = 12
+
+## Depth of the return address stack when enabled without a depth
+RETURN_STACK_DEPTH = 16
+
+class BranchPredictor():
+    name = None
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        ## Bumped whenever the predictor changes what it will predict, so
+        ## the pipeline does not mistake a warming predictor for a fixed
+        ## point
+        self.changes = 0
+
+    def predict(self, pc, target):
+        ## Whether the conditional jump at pc to target is taken
+        return True
+
+    def update(self, pc, taken):
+        pass
+
+    def get_state(self):
+        return b''
+
+    def set_state(self, data):
+        if data:
+            raise ValueError('saved with another predictor than %s'
+                             % self.name)
+
+class AlwaysTaken(BranchPredictor):
+    name = 'taken'
+
+class NeverTaken(BranchPredictor):
+    name = 'not-taken'
+
+    def predict(self, pc, target):
+        return False
+
+class BackwardTaken(BranchPredictor):
+    ## Backward jumps close loops and are usually taken, forward ones not
+    name = 'btfn'
+
+    def predict(self, pc, target):
+        return target <= pc
+
+class Bimodal(BranchPredictor):
+    ## A table of saturating counters indexed by the jump address. With
+    ## 1-bit counters a jump is predicted to go the way it went last time.
+    def __init__(self, bits=2, entries=BIMODAL_ENTRIES):
+        self.name = 'bimodal%d' % bits
+        self.maximum = (1 << bits) - 1
+        self.threshold = 1 << (bits - 1)
+        self.entries = entries
+        BranchPredictor.__init__(self)
+
+    def reset(self):
+        BranchPredictor.reset(self)
+        ## Start out weakly taken
+        self.counters = bytearray([self.threshold]) * self.entries
+
+    def index(self, pc):
+        return pc % self.entries
+
+    def predict(self, pc, target):
+        return self.counters[self.index(pc)] >= self.threshold
+
+    def update(self, pc, taken):
+        index = self.index(pc)
+        counter = self.counters[index]
+        if taken and counter < self.maximum:
+            self.counters[index] = counter + 1
+            self.changes += 1
+        elif not taken and counter > 0:
+            self.counters[index] = counter - 1
+            self.changes += 1
+
+    def get_state(self):
+        return bytes(self.counters)
+
+    def set_state(self, data):
+        if len(data) != self.entries:
+            raise ValueError('saved with another predictor than %s'
+                             % self.name)
+        self.counters = bytearray(data)
+
+class GShare(Bimodal):
+    ## 2-bit counters indexed by the jump address xor the outcomes of the
+    ## last jumps, so one jump can be predicted differently depending on
+    ## the path that led to it
+    def __init__(self, history_bits=GSHARE_HISTORY_BITS):
+        self.mask = (1 << history_bits) - 1
+        Bimodal.__init__(self, 2, 1 << history_bits)
+        self.name = 'gshare'
+
+    def reset(self):
+        Bimodal.reset(self)
+        self.history = 0
+
+    def index(self, pc):
+        return (pc ^ self.history) & self.mask
+
+    def update(self, pc, taken):
+        Bimodal.update(self, pc, taken)
+        history = ((self.history << 1) | int(taken)) & self.mask
+        if history != self.history:
+            self.history = history
+            self.changes += 1
+
+    def get_state(self):
+        return struct.pack('<I', self.history) + bytes(self.counters)
+
+    def set_state(self, data):
+        Bimodal.set_state(self, data[4:])
+        self.history, = struct.unpack('<I', data[:4])
+
+class ReturnStack():
+    ## Return addresses of the calls in progress, newest last. A full
+    ## stack forgets its oldest entry.
+    def __init__(self, depth=RETURN_STACK_DEPTH):
+        self.depth = depth
+        self.entries = []
+
+    def push(self, address):
+        if len(self.entries) == self.depth:
+            del self.entries[0]
+        self.entries.append(address)
+
+    def pop(self):
+        if self.entries:
+            self.entries.pop()
+
+    def peek(self, skip=0):
+        ## The address `skip` entries below the top, None past the bottom
+        index = len(self.entries) - 1 - skip
+        return self.entries[index] if index >= 0 else None
+
+    def get_state(self):
+        return struct.pack('<%di' % len(self.entries), *self.entries)
+
+    def set_state(self, data):
+        self.entries = list(struct.unpack('<%di' % (len(data) // 4), data))
+        del self.entries[:-self.depth]
+
+PREDICTORS = {
+    'taken': AlwaysTaken,
+    'not-taken': NeverTaken,
+    'btfn': BackwardTaken,
+    'bimodal1': lambda: Bimodal(1),
+    'bimodal2': lambda: Bimodal(2),
+    'gshare': GShare,
+}
+
+def make_predictor(name):
+    if name not in PREDICTORS:
+        raise ValueError('unknown branch predictor: %s' % name)
+    return PREDICTORS[name]()
+
+class PredictionStats():
+    ## Outcomes of the control flow predictions of one run. Conditional
+    ## jumps are counted when they execute, returns when they read their
+    ## return address.
+    COUNTERS = ('branches', 'branch_mispredicts', 'returns',
+                'return_mispredicts', 'return_stalls')
+
+    ## Bubbles each event costs the PIPE pipeline
+    MISPREDICT_PENALTY = 2
+    RETURN_STALL_PENALTY = 3
+
+    def __init__(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+
+    def counts(self):
+        return tuple(getattr(self, name) for name in self.COUNTERS)
+
+    def add(self, counts, times=1):
+        for name, count in zip(self.COUNTERS, counts):
+            setattr(self, name, getattr(self, name) + count * times)
+
+    def cycles_lost(self):
+        return self.MISPREDICT_PENALTY * (self.branch_mispredicts +
+                                          self.return_mispredicts) + \
+               self.RETURN_STALL_PENALTY * self.return_stalls
+
+    def summary(self, predictor_name, return_stack_depth):
+        lines = []
+        if return_stack_depth:
+            lines.append('Predictor: %s, return stack of %d'
+                         % (predictor_name, return_stack_depth))
+        else:
+            lines.append('Predictor: %s' % predictor_name)
+        if self.branches:
+            lines.append('Branches: %d, %d mispredicted (%.1f%% correct)'
+                         % (self.branches, self.branch_mispredicts,
+                            100.0 * (self.branches - self.branch_mispredicts)
+                            / self.branches))
+        else:
+            lines.append('Branches: 0')
+        lines.append('Returns: %d, %d mispredicted, %d not predicted'
+                     % (self.returns, self.return_mispredicts,
+                        self.return_stalls))
+        lines.append('Cycles lost to control hazards: %d'
+                     % self.cycles_lost())
+        return lines
+
+    def to_dict(self, predictor_name, return_stack_depth):
+        result = dict((name, getattr(self, name)) for name in self.COUNTERS)
+        result['predictor'] = predictor_name
+        result['return_stack'] = return_stack_depth
+        result['cycles_lost'] = self.cycles_lost()
+        return result
@@ -1,20 +1,133 @@
 #!/usr/bin/python
 
+import argparse
 import io
-import re
+import json
+import os
+import struct
 import sys
-
-TMAX = 2**31-1
-TMIN = -TMAX -1
+import time
+import zlib
+from operator import attrgetter
+
+from cache import CacheError, parse_cache
+from control import (PIPE_TABLE, RA, RB, VALA, VALB, VALC, VALE,
+                     compile_control)
+from counters import CICACHE, CSTARTUP, FORWARD_SOURCES, PerfCounters
+from functional import Divergence, Y86Functional, run_lockstep
+from hcl import HCLError, compile_hcl, load_hcl, set_cache_dir
+from isa import TMAX, TMIN, REGISTER_NAMES, decode_instruction
+from loader import LoadError, SourceIndex, load_image
+from memory import Memory, PROTECTIONS, protect_image
+from profiler import Profiler
+from predictor import (PREDICTORS, RETURN_STACK_DEPTH, PredictionStats,
+                       ReturnStack, make_predictor)
+from tracefile import TraceFileWriter
+from tracing import (TraceWriter, CycleLog, CYCLE_FORMAT, format_cycle,
+                     format_source, format_stages, format_state,
+                     stage_addresses)
+
+## Processor state saved by snapshot(), in order
+STATE_FIELDS = (
+    'F_predPC',
+    'f_icode', 'f_ifun', 'f_valC', 'f_valP', 'f_rA', 'f_rB', 'f_predPC',
+    'f_pred',
+    'D_icode', 'D_ifun', 'D_rA', 'D_rB', 'D_valC', 'D_valP', 'D_pred',
+    'd_srcA', 'd_srcB', 'd_dstE', 'd_dstM', 'd_valA', 'd_valB',
+    'E_icode', 'E_ifun', 'E_valC', 'E_valA', 'E_valB', 'E_dstE', 'E_dstM',
+    'E_srcA', 'E_srcB', 'E_pred',
+    'e_valE', 'e_dstE', 'e_Cnd',
+    'M_icode', 'M_ifun', 'M_Cnd', 'M_valE', 'M_valA', 'M_dstE', 'M_dstM',
+    'M_valC', 'M_pred',
+    'm_valM', 'mem_addr', 'm_read', 'dmem_error',
+    'W_icode', 'W_ifun', 'W_valE', 'W_valM', 'W_dstE', 'W_dstM', 'W_pred',
+    'fetch_wait', 'fetch_miss_pc', 'fetch_pc', 'm_wait',
+    'f_cause', 'D_cause', 'E_cause', 'M_cause', 'W_cause', 'd_fwdA', 'd_fwdB',
+    'f_addr', 'D_addr', 'E_addr', 'M_addr', 'W_addr',
+)
+BOOL_FIELDS = frozenset(('e_Cnd', 'M_Cnd', 'm_read', 'dmem_error', 'f_pred',
+                         'D_pred', 'E_pred', 'M_pred', 'W_pred'))
+STAT_FIELDS = ('F_stat', 'f_stat', 'D_stat', 'E_stat', 'M_stat', 'm_stat',
+               'W_stat', 'stat')
+STATUS_CODES = ('BUB', 'AOK', 'ADR', 'INS', 'HLT')
+## Whether a stage keeps its instruction this cycle, set by the register
+## updates before the stages read them
+HELD_FIELDS = ('F_held', 'E_held', 'M_held')
+
+get_state = attrgetter(*(STATE_FIELDS + STAT_FIELDS))
+
+## The default control logic, and the fields a description can read
+PIPE_HCL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'pipe.hcl')
+HCL_FIELDS = STATE_FIELDS + STAT_FIELDS + HELD_FIELDS
+
+## pipe.hcl compiled by the first call of pipe_logic(), so importing this
+## module neither compiles it nor touches the cache
+pipe_logic_compiled = None
+
+def pipe_logic():
+    global pipe_logic_compiled
+    if pipe_logic_compiled is None:
+        pipe_logic_compiled = load_hcl(PIPE_HCL, HCL_FIELDS)
+    return pipe_logic_compiled
+
+## Where decode_stage takes an operand from, in its order of priority, as
+## an index of counters.FORWARD_SOURCES
+FORWARD_INDEX = dict((name, FORWARD_SOURCES.index(name))
+                     for name in FORWARD_SOURCES)
+
+## Snapshot layout: magic, version, cycle, retired, prediction counts,
+## state fields, status codes, registers, condition codes, then
+## length-prefixed zlib blobs. The cache blobs hold their counters.
+SNAPSHOT_MAGIC = b'Y86S'
+SNAPSHOT_VERSION = 5
+SNAPSHOT_HEADER = struct.Struct('<4sBqq%dq%di%dB8i3B' % (
+    len(PredictionStats.COUNTERS), len(STATE_FIELDS), len(STAT_FIELDS)))
+BLOB_LENGTH = struct.Struct('<I')
 
 class Y86Processor():
-    def __init__(self):
-        self.output_file = open('asum.txt', 'w')
+    def __init__(self, output_file=None):
+        self.set_output_file(output_file)
+        self.trace_file = None
+        self.image = b''
+        self.code_ranges = []
+        self.protection = 'code'
+        self.fast = False
+        self.time_limit = None
+        self.log_capacity = None
+        self.max_step = 10000
+        self.checkpoint_interval = None
+        self.checkpoint_callback = None
+        self.control = PIPE_TABLE
+        self.logic = pipe_logic()
+        self.hcl_text = None
+        self.counting = False
+        self.profiler = None
+        self.source = []
+        self.source_index = SourceIndex()
+        self.trace_source = False
+        self.predictor = make_predictor('taken')
+        self.return_stack = None
+        self.icache = None
+        self.dcache = None
 
         self.reset()
-        # TODO: set output_file
+
+    def set_output_file(self, output_file):
+        ## The per-cycle trace is only produced when an output file is set
+        self.trace = TraceWriter(output_file) if output_file else None
+
+    def set_trace_file(self, trace_file):
+        ## A tracefile.TraceFileWriter taking every cycle, or None
+        self.trace_file = trace_file
 
     def reset(self):
+        self.reset_pipeline()
+        self.reset_memory()
+
+    def reset_pipeline(self):
+        ## Empty the pipeline and clear the registers, counters and
+        ## predictors, leaving memory alone
         # Global constants
 
         ## Symbolic representation of Y86 Instruction Codes
@@ -74,6 +187,7 @@ class Y86Processor():
         self.f_rA = self.RNONE
         self.f_rB = self.RNONE
         self.f_predPC = 0
+        self.f_pred = False
         self.f_stat = self.SBUB
 
         ## Pipeline Register D
@@ -84,8 +198,7 @@ class Y86Processor():
         self.D_rB = self.RNONE
         self.D_valC = 0x0
         self.D_valP = 0x0
-
-        self.D_next_bub = False # Add this to correct the Decode bubble
+        self.D_pred = False # Taken for a jump, target known for a ret
 
         ## Intermediate Values in Decode Stage
         self.d_srcA = self.RNONE
@@ -106,6 +219,7 @@ class Y86Processor():
         self.E_dstM = self.RNONE
         self.E_srcA = self.RNONE
         self.E_srcB = self.RNONE
+        self.E_pred = False
 
         ## Intermediate Values in Execute Stage
         self.e_valE = 0x0
@@ -121,6 +235,8 @@ class Y86Processor():
         self.M_valA = 0x0
         self.M_dstE = self.RNONE
         self.M_dstM = self.RNONE
+        self.M_valC = 0x0
+        self.M_pred = False
 
         ## Intermediate Values in Memory Stage
         self.m_valM = 0x0
@@ -137,6 +253,37 @@ class Y86Processor():
         self.W_valM = 0x0
         self.W_dstE = self.RNONE
         self.W_dstM = self.RNONE
+        self.W_pred = False
+
+        ## Set by the register updates when a stage keeps its instruction
+        self.F_held = False
+        self.E_held = False
+        self.M_held = False
+
+        ## Cache misses in progress: cycles the fetch of fetch_miss_pc and
+        ## the memory access of the instruction in M still take. fetch_pc
+        ## is the address fetch last looked up in the instruction cache.
+        self.fetch_wait = 0
+        self.fetch_miss_pc = -1
+        self.fetch_pc = -1
+        self.m_wait = 0
+
+        ## For the performance counters: the cause of the bubble in each
+        ## stage, see counters.CAUSES, and where decode found its operands
+        self.f_cause = CSTARTUP
+        self.D_cause = CSTARTUP
+        self.E_cause = CSTARTUP
+        self.M_cause = CSTARTUP
+        self.W_cause = CSTARTUP
+        self.d_fwdA = FORWARD_INDEX['none']
+        self.d_fwdB = FORWARD_INDEX['none']
+        ## Address of the instruction in each stage, for the profiler and
+        ## the source lines of the trace
+        self.f_addr = 0
+        self.D_addr = 0
+        self.E_addr = 0
+        self.M_addr = 0
+        self.W_addr = 0
 
         self.stat = self.SAOK
 
@@ -159,152 +306,234 @@ class Y86Processor():
             'OF': 0,
         }
 
-        # Memory
-        self.memory = {}
-        self.memro = []
-
         self.cycle = -1
-
-        self.max_step = 10000
-
-        self.log = []
+        self.retired = 0
+
+        self.log = CycleLog(self.log_capacity)
+        self.stop_reason = None
+
+        ## Predictors start out cold for every run
+        self.predictor.reset()
+        if self.return_stack:
+            self.return_stack = ReturnStack(self.return_stack.depth)
+        self.stats = PredictionStats()
+        for cache in (self.icache, self.dcache):
+            if cache:
+                cache.reset()
+        self.perf = PerfCounters() if self.counting else None
+        if self.profiler:
+            self.profiler = Profiler()
+
+    def reset_memory(self):
+        self.memory = Memory(self.image)
+        self.apply_protection()
+        self.predecode()
+
+    def set_protection(self, protection):
+        if protection not in PROTECTIONS:
+            raise ValueError('unknown protection policy: %s' % protection)
+        self.protection = protection
+        self.apply_protection()
+
+    def apply_protection(self):
+        protect_image(self.memory, len(self.image), self.code_ranges,
+                      self.protection)
 
     def set_max_step(self, max_step):
+        ## None runs until the program stops by itself
         self.max_step = max_step
 
+    def set_time_limit(self, seconds):
+        ## Wall-clock budget of a run, None for no limit
+        self.time_limit = seconds
+
+    def set_checkpoint(self, interval, callback):
+        ## Call callback(processor) after every `interval` cycles
+        self.checkpoint_interval = interval
+        self.checkpoint_callback = callback
+
+    def set_log_capacity(self, capacity):
+        ## Number of most recent cycles kept in self.log, None keeps all
+        self.log_capacity = capacity
+        self.log = CycleLog(capacity)
+
+    def set_control(self, description):
+        ## Replace the pipeline control logic, see control.PIPE_CONTROL
+        self.control = compile_control(description)
+
+    def set_hcl(self, text):
+        ## Replace the stall and bubble logic with an HCL description, see
+        ## pipe.hcl. Raises HCLError if it does not compile.
+        self.logic = compile_hcl(text, HCL_FIELDS, counting=self.counting)
+        self.hcl_text = text
+
+    def set_counters(self, counting):
+        ## Count stalls, bubbles, lost cycles, forwarding and the
+        ## instruction mix in self.perf, see counters.py
+        self.counting = counting
+        if self.hcl_text is not None:
+            self.logic = compile_hcl(self.hcl_text, HCL_FIELDS,
+                                     counting=counting)
+        elif counting:
+            self.logic = load_hcl(PIPE_HCL, HCL_FIELDS, counting=True)
+        else:
+            self.logic = pipe_logic()
+        self.perf = PerfCounters() if counting else None
+
+    def set_profiler(self, profiling):
+        ## Profile the run by instruction address in self.profiler, see
+        ## profiler.py. The profiler needs the performance counters.
+        self.profiler = Profiler() if profiling else None
+        if profiling and not self.counting:
+            self.set_counters(True)
+
+    def set_predictor(self, name):
+        ## One of predictor.PREDICTORS, for conditional jumps
+        self.predictor = make_predictor(name)
+
+    def set_return_stack(self, depth):
+        ## Predict ret targets with a return address stack of this depth
+        ## instead of stalling fetch until the ret reaches W, 0 to stall
+        self.return_stack = ReturnStack(depth) if depth else None
+
+    def set_caches(self, icache=None, dcache=None):
+        ## cache.Cache timing models for fetch and for the memory stage,
+        ## None for memory that never stalls
+        self.icache = icache
+        self.dcache = dcache
+        for cache in self.caches():
+            cache.reset()
+
+    def set_trace_source(self, trace_source):
+        ## Follow every cycle of the trace with the .yo line of the
+        ## instruction in each stage
+        self.trace_source = trace_source
+
+    def set_fast(self, fast):
+        ## Fast mode runs the same pipeline but skips the trace and the log
+        self.fast = fast
+
     def compile(self, fin):
-        p = 0x000
-        self.bin_code = ''
-        for line in fin:
-            addr, code = get_addr(line), get_code(line)
-            bin_len = len(self.bin_code)
-            if addr is not None:
-                addr *= 2
-                if addr < bin_len:
-                    print("Init Error")
-                    sys.exit(1)
-                if code is not None:
-                    if addr > bin_len:
-                        self.bin_code += '0' * (addr - bin_len)
-                    self.bin_code += code
-        self.addr_len = len(self.bin_code) / 2 - 1
+        self.set_image(load_image(fin))
+
+    def set_image(self, image):
+        self.image = image.data
+        self.code_ranges = image.code_ranges
+        self.source = image.source
+        self.source_index = image.index
+        self.reset_memory()
 
     def set_input_file(self, data):
         self.compile(data)
 
-    def endian_parser(self, s):
-        correct_string = s[6] + s[7] + s[4] + s[5] + s[2] + s[3] + s[0] + s[1]
-        ans = int(correct_string, 16)
-        if ans > 0x7fffffff:
-            ans = -((~ans + 1) & 0xffffffff)
-        return ans
-
-    def cycle_log(self):
-        self.output_file.write('Cycle_%d\n--------------------\n' % self.cycle)
-        self.log[self.cycle]['condition_code'] = dict(self.conditions)
-        self.log[self.cycle]['registers'] = dict(self.registers)
-
     def fetch_stage(self):
-        ## Intermediate Values in Fetch Stage
-        self.f_icode = self.INOP
-        self.f_ifun = self.FNONE
-        self.f_valC = 0x0
-        self.f_valP = 0x0
-        self.f_rA = self.RNONE
-        self.f_rB = self.RNONE
-        self.f_predPC = 0
-        self.f_stat = self.SBUB
-
-        ## What address should instruction be fetched at
-        f_pc = self.F_predPC # Default: Use predicted value of PC
-        if (self.M_icode == self.IJXX) and (not self.M_Cnd):
-            f_pc = self.M_valA # Mispredicted branch. Fetch at incremented PC
-        elif (self.W_icode == self.IRET):
-            f_pc = self.W_valM # Completion of RET instruction.
-
-        saved_pc = f_pc
-        bin_p = f_pc * 2
-        imem_error = False
-
-        ## Check if imem_error
-        if (f_pc > self.addr_len) or (f_pc < 0):
-            imem_error = True
+        ## What address should instruction be fetched at, see f_pc in
+        ## pipe.hcl
+        f_pc = self.logic.select_pc(self)
+        self.f_addr = f_pc
+
+        ## Look the instruction up in the predecoded table
+        if 0 <= f_pc < len(self.decoded):
+            entry = self.decoded[f_pc]
+            if entry is None:
+                entry = self.decoded[f_pc] = self.decode_instruction(f_pc)
+                if self.code_low is None or f_pc < self.code_low:
+                    self.code_low = f_pc
+                if self.code_high is None or f_pc > self.code_high:
+                    self.code_high = f_pc
         else:
-            imem_code = int(self.bin_code[bin_p], 16)
-            imem_ifun = int(self.bin_code[bin_p+1], 16)
-            bin_p += 2
-            f_pc += 1
-
-        ## Determine icode of fetched instruction
-        self.f_icode = self.INOP if imem_error else imem_code
-        ## Determine ifun
-        self.f_ifun = self.FNONE if imem_error else imem_ifun
-
-        # Is instruction valid?
-        instr_valid = self.f_icode in (self.INOP, self.IHALT, self.IRRMOVL, \
-                                      self.IIRMOVL, self.IRMMOVL, self.IMRMOVL, \
-                                      self.IOPL, self.IJXX, self.ICALL, \
-                                      self.IRET, self.IPUSHL, self.IPOPL)
-
-        # Does fetched instruction require a regid byte?
-        need_regids = self.f_icode in (self.IRRMOVL, self.IOPL, self.IPUSHL, \
-                                       self.IPOPL, self.IIRMOVL, self.IRMMOVL, \
-                                       self.IMRMOVL)
-
-        # Does fetched instruction require a constant word?
-        need_valC = self.f_icode in (self.IIRMOVL, self.IRMMOVL, self.IMRMOVL, \
-                                     self.IJXX, self.ICALL)
-
-        if instr_valid:
-            try:
-                if need_regids:
-                    self.f_rA = int(self.bin_code[bin_p], 16)
-                    self.f_rB = int(self.bin_code[bin_p+1], 16)
-                    bin_p += 2
-                    f_pc += 1
-                    if ((self.f_rA not in self.registers) and (self.f_rA != self.RNONE))\
-                       or ((self.f_rB not in self.registers) and (self.f_rB != self.RNONE)):
-                        raise IndexError
-            except:
-                imem_error = True
+            entry = self.decode_instruction(f_pc)
+
+        if self.icache and self.fetch_missed(f_pc, entry):
+            ## Send a bubble down and fetch at f_pc again next cycle
+            (self.f_icode, self.f_ifun, self.f_rA, self.f_rB, self.f_valC,
+             self.f_valP, self.f_predPC, self.f_stat) = \
+                (self.INOP, self.FNONE, self.RNONE, self.RNONE, 0x0, 0x0,
+                 f_pc, self.SBUB)
+            self.f_pred = False
+            self.f_cause = CICACHE
+            return
 
-            try:
-                if need_valC:
-                    self.f_valC = self.endian_parser(self.bin_code[bin_p: bin_p+8])
-                    bin_p += 8
-                    f_pc += 4
-            except:
-                imem_error = True
-
-        self.f_valP = f_pc
-        self.f_predPC = self.f_valC if self.f_icode in (self.IJXX, self.ICALL) else self.f_valP
-
-        # Determine status code for fetched instruction
-        self.f_stat = self.SAOK # Default
-        if self.f_icode == self.IHALT:
-            self.f_stat = self.SHLT
-        if not instr_valid:
-            self.f_stat = self.SINS
-        if imem_error:
-            self.f_stat = self.SADR
-
-    def fetch_write(self):
-        F_bubble = False
-        F_stall = self.E_icode in (self.IMRMOVL, self.IPOPL) and \
-                  self.E_dstM in (self.d_srcA, self.d_srcB) or \
-                  self.IRET in (self.D_icode, self.E_icode, self.M_icode)
-
-        if F_stall:
+        (self.f_icode, self.f_ifun, self.f_rA, self.f_rB, self.f_valC,
+         self.f_valP, self.f_predPC, self.f_stat) = entry
+
+        ## Predict conditional jumps and, with a return stack, returns.
+        ## The predecoded entry assumes every jump is taken.
+        self.f_pred = False
+        if self.f_stat != self.SAOK:
+            return
+        if self.f_icode == self.IJXX:
+            if self.f_ifun == self.FJMP or \
+               self.predictor.predict(f_pc, self.f_valC):
+                self.f_pred = True
+            else:
+                self.f_predPC = self.f_valP
+        elif self.f_icode == self.IRET and self.return_stack:
+            target = self.predict_return()
+            if target is not None:
+                ## The predicted target travels down to M in valC, where
+                ## it is checked against the address the ret reads
+                self.f_valC = self.f_predPC = target
+                self.f_pred = True
+
+    def fetch_missed(self, f_pc, entry):
+        ## Whether the instruction at f_pc is still on its way from memory
+        if self.fetch_wait:
+            self.fetch_wait -= 1
+            if self.fetch_wait:
+                return True
+            if f_pc == self.fetch_miss_pc:
+                ## The line has arrived, with the instruction in it
+                self.fetch_pc = f_pc
+                return False
+        elif self.F_held and f_pc == self.fetch_pc:
+            ## F is stalled and fetches the same instruction again
+            return False
+        self.fetch_pc = f_pc
+        if entry[7] == self.SADR:
+            return False
+        latency = self.icache.access(f_pc, entry[5] - f_pc, False)
+        if latency:
+            self.fetch_wait = latency
+            self.fetch_miss_pc = f_pc
+            return True
+        return False
+
+    def predict_return(self):
+        ## The return stack is updated when calls and rets execute. The
+        ## instruction in D has not executed yet, so account for it here.
+        if self.D_stat == self.SAOK:
+            if self.D_icode == self.ICALL:
+                return self.D_valP
+            if self.D_icode == self.IRET:
+                return self.return_stack.peek(1)
+        return self.return_stack.peek()
+
+    def predecode(self):
+        ## A slot for the instruction starting at every address of the
+        ## image, filled by the fetch stage the first time it fetches there.
+        ## Each entry holds what the fetch stage produces for that address:
+        ## (icode, ifun, rA, rB, valC, valP, predPC, stat). Entries set to
+        ## None are decoded on demand.
+        self.decoded = [None] * len(self.image)
+        ## Lowest and highest address an instruction was decoded at, so
+        ## that writes elsewhere skip invalidation
+        self.code_low = None
+        self.code_high = None
+
+    def invalidate(self, addr, size=4):
+        ## Drop the predecoded instructions overlapping [addr, addr+size).
+        ## The longest instruction is 6 bytes long
+        if self.code_low is None or addr + size <= self.code_low or \
+           addr - 5 > self.code_high:
             return
-        self.F_predPC = self.f_predPC
-        self.F_stat = self.SAOK
+        start = max(addr - 5, 0)
+        end = min(addr + size, len(self.decoded))
+        for pc in range(start, end):
+            self.decoded[pc] = None
 
-    def fetch_log(self):
-        F_predPC = special_hex(self.F_predPC)
-        self.output_file.write('FETCH:\n')
-        self.output_file.write('\tF_predPC \t= %s\n' % F_predPC)
-        self.output_file.write('\n')
-        self.log[self.cycle]['F_predPC'] = F_predPC
+    def decode_instruction(self, pc):
+        return decode_instruction(self.memory, pc)
 
     def decode_stage(self):
         ## Intermediate Values in Decode Stage
@@ -315,25 +544,13 @@ class Y86Processor():
         self.d_valA = 0x0
         self.d_valB = 0x0
 
-        if self.D_icode in (self.IRRMOVL, self.IRMMOVL, self.IOPL, self.IPUSHL):
-            self.d_srcA = self.D_rA
-        elif self.D_icode in (self.IPOPL, self.IRET):
-            self.d_srcA = self.RESP
-
-        if self.D_icode in (self.IOPL, self.IRMMOVL, self.IMRMOVL):
-            self.d_srcB = self.D_rB
-        elif self.D_icode in (self.IPUSHL, self.IPOPL, self.ICALL, self.IRET):
-            self.d_srcB = self.RESP
-
-        if self.D_icode in (self.IRRMOVL, self.IIRMOVL, self.IOPL):
-            self.d_dstE = self.D_rB
-        elif self.D_icode in (self.IPUSHL, self.IPOPL, self.ICALL, self.IRET):
-            self.d_dstE = self.RESP
+        control = self.control[self.D_icode]
+        self.d_srcA = self.register_id(control.srcA)
+        self.d_srcB = self.register_id(control.srcB)
+        self.d_dstE = self.register_id(control.dstE)
+        self.d_dstM = self.register_id(control.dstM)
 
-        if self.D_icode in (self.IMRMOVL, self.IPOPL):
-            self.d_dstM = self.D_rA
-
-        if self.D_icode in (self.ICALL, self.IJXX):
+        if control.use_valP:
             self.d_valA = self.D_valP
         elif self.d_srcA == self.e_dstE:
             self.d_valA = self.e_valE
@@ -346,7 +563,8 @@ class Y86Processor():
         elif self.d_srcA == self.W_dstE:
             self.d_valA = self.W_valE
         else:
-            self.d_valA = self.registers[self.d_srcA]
+            ## RNONE reads as 0
+            self.d_valA = self.registers.get(self.d_srcA, 0)
 
         if self.d_srcB == self.e_dstE:
             self.d_valB = self.e_valE
@@ -359,87 +577,65 @@ class Y86Processor():
         elif self.d_srcB == self.W_dstE:
             self.d_valB = self.W_valE
         else:
-            self.d_valB = self.registers[self.d_srcB]
+            self.d_valB = self.registers.get(self.d_srcB, 0)
 
-    def decode_write(self):
-        D_stall = (self.E_icode in (self.IMRMOVL, self.IPOPL)) and \
-                  (self.E_dstM in (self.d_srcA, self.d_srcB))
-        if D_stall:
-            return
+    def count_decode_stage(self):
+        ## decode_stage, also noting where the operands came from
+        self.decode_stage()
+        if self.control[self.D_icode].use_valP:
+            self.d_fwdA = FORWARD_INDEX['none']
+        else:
+            self.d_fwdA = self.forward_source(self.d_srcA)
+        self.d_fwdB = self.forward_source(self.d_srcB)
+
+    def forward_source(self, src):
+        if src == self.RNONE:
+            return FORWARD_INDEX['none']
+        if src == self.e_dstE:
+            return FORWARD_INDEX['e_valE']
+        if src == self.M_dstM:
+            return FORWARD_INDEX['m_valM']
+        if src == self.M_dstE:
+            return FORWARD_INDEX['M_valE']
+        if src == self.W_dstM:
+            return FORWARD_INDEX['W_valM']
+        if src == self.W_dstE:
+            return FORWARD_INDEX['W_valE']
+        return FORWARD_INDEX['register']
+
+    def register_id(self, source):
+        ## The register a decode signal selects
+        if source == RA:
+            return self.D_rA
+        if source == RB:
+            return self.D_rB
+        return source
 
-        D_bubble = self.IRET in (self.D_icode, self.E_icode, self.M_icode)
-
-        if D_bubble or self.D_next_bub:
-            self.D_icode = self.INOP
-            self.D_ifun  = self.FNONE
-            self.D_rA    = self.RNONE
-            self.D_rB    = self.RNONE
-            self.D_valC  = 0x0
-            self.D_valP  = 0x0
-            self.D_stat  = self.SBUB
-            self.D_next_bub = False
+    def execute_stage(self):
+        if self.E_held:
+            ## Still the instruction that executed last cycle
             return
 
-        self.D_next_bub = self.E_icode == self.IJXX and (not self.e_Cnd)
-
-        self.D_stat  = self.f_stat
-        self.D_icode = self.f_icode
-        self.D_ifun  = self.f_ifun
-        self.D_rA    = self.f_rA
-        self.D_rB    = self.f_rB
-        self.D_valC  = self.f_valC
-        self.D_valP  = self.f_valP
-
-    def decode_log(self):
-        D_icode = special_hex(self.D_icode)
-        D_ifun = special_hex(self.D_ifun)
-        D_rA = special_hex(self.D_rA)
-        D_rB = special_hex(self.D_rB)
-        D_valC = special_hex(self.D_valC, True)
-        D_valP = special_hex(self.D_valP, True)
-        self.output_file.write('DECODE:\n')
-        self.output_file.write('\tD_icode  \t= %s\n' % D_icode)
-        self.output_file.write('\tD_ifun   \t= %s\n' % D_ifun)
-        self.output_file.write('\tD_rA     \t= %s\n' % D_rA)
-        self.output_file.write('\tD_rB     \t= %s\n' % D_rB)
-        self.output_file.write('\tD_valC   \t= %s\n' % D_valC)
-        self.output_file.write('\tD_valP   \t= %s\n' % D_valP)
-        self.output_file.write('\n')
-        self.log[self.cycle]['D_icode'] = D_icode
-        self.log[self.cycle]['D_ifun'] = D_ifun
-        self.log[self.cycle]['D_rA'] = D_rA
-        self.log[self.cycle]['D_rB'] = D_rB
-        self.log[self.cycle]['D_valC'] = D_valC
-        self.log[self.cycle]['D_valP'] = D_valP
-
-    def execute_stage(self):
         self.e_valE = 0x0
         self.e_dstE = self.RNONE
         self.e_Cnd = False
 
-        aluA = 0
-        aluB = 0
+        control = self.control[self.E_icode]
         alufun = self.ALUADD
 
-        if self.E_icode in (self.IRRMOVL, self.IOPL):
+        ## The ALU inputs are either pipeline fields or constants
+        aluA = control.aluA
+        if aluA == VALA:
             aluA = self.E_valA
-        elif self.E_icode in (self.IIRMOVL, self.IRMMOVL, self.IMRMOVL):
+        elif aluA == VALC:
             aluA = self.E_valC
-        elif self.E_icode in (self.ICALL, self.IPUSHL):
-            aluA = -4
-        elif self.E_icode in (self.IRET, self.IPOPL):
-            aluA = 4
-
-        if self.E_icode in (self.IRMMOVL, self.IMRMOVL, self.IOPL, self.ICALL, \
-                            self.IPUSHL, self.IRET, self.IPOPL):
-            aluB = self.E_valB
-        elif self.E_icode in (self.IRRMOVL, self.IIRMOVL):
-            aluB = 0
-
-        if self.E_icode == self.IOPL:
+
+        aluB = self.E_valB if control.aluB == VALB else control.aluB
+
+        if control.alu_ifun:
             alufun = self.E_ifun
 
-        set_cc = (self.E_icode == self.IOPL) and \
+        set_cc = control.set_cc and \
                  (self.m_stat not in (self.SADR, self.SINS, self.SHLT)) and \
                  (self.W_stat not in (self.SADR, self.SINS, self.SHLT))
 
@@ -465,7 +661,7 @@ class Y86Processor():
         if (alu_result < TMIN):
             alu_result = TMAX + alu_result - TMIN + 1
 
-        if self.E_icode in (self.IJXX, self.IRRMOVL):
+        if control.conditional:
             zf = self.conditions['ZF']
             sf = self.conditions['SF']
             of = self.conditions['OF']
@@ -485,68 +681,32 @@ class Y86Processor():
                 self.e_Cnd = True
 
         self.e_valE = alu_result
-        self.e_dstE = self.RNONE if (self.E_icode == self.IRRMOVL and not self.e_Cnd) else self.E_dstE
-
-    def execute_write(self):
-        E_bubble = (self.E_icode == self.IJXX and not self.e_Cnd) or \
-                   self.E_icode in (self.IMRMOVL, self.IPOPL) and \
-                   self.E_dstM in (self.d_srcA, self.d_srcB)
-        if E_bubble:
-            self.E_icode = self.INOP
-            self.E_ifun  = self.FNONE
-            self.E_valC  = 0x0
-            self.E_valA  = 0x0
-            self.E_valB  = 0x0
-            self.E_dstE  = self.RNONE
-            self.E_dstM  = self.RNONE
-            self.E_srcA  = self.RNONE
-            self.E_srcB  = self.RNONE
-            self.E_stat  = self.SBUB
-            return
+        self.e_dstE = self.RNONE if (control.conditional and not self.e_Cnd) else self.E_dstE
 
-        self.E_stat  = self.D_stat
-        self.E_icode = self.D_icode
-        self.E_ifun  = self.D_ifun
-        self.E_valC  = self.D_valC
-        self.E_valA  = self.d_valA
-        self.E_valB  = self.d_valB
-        self.E_dstE  = self.d_dstE
-        self.E_dstM  = self.d_dstM
-        self.E_srcA  = self.d_srcA
-        self.E_srcB  = self.d_srcB
-
-    def execute_log(self):
-        E_icode = special_hex(self.E_icode)
-        E_ifun = special_hex(self.E_ifun)
-        E_valC = special_hex(self.E_valC, True)
-        E_valA = special_hex(self.E_valA, True)
-        E_valB = special_hex(self.E_valB, True)
-        E_dstE = special_hex(self.E_dstE)
-        E_dstM = special_hex(self.E_dstM)
-        E_srcA = special_hex(self.E_srcA)
-        E_srcB = special_hex(self.E_srcB)
-        self.output_file.write('EXECUTE:\n')
-        self.output_file.write('\tE_icode  \t= %s\n' % E_icode)
-        self.output_file.write('\tE_ifun   \t= %s\n' % E_ifun)
-        self.output_file.write('\tE_valC   \t= %s\n' % E_valC)
-        self.output_file.write('\tE_valA   \t= %s\n' % E_valA)
-        self.output_file.write('\tE_valB   \t= %s\n' % E_valB)
-        self.output_file.write('\tE_dstE   \t= %s\n' % E_dstE)
-        self.output_file.write('\tE_dstM   \t= %s\n' % E_dstM)
-        self.output_file.write('\tE_srcA   \t= %s\n' % E_srcA)
-        self.output_file.write('\tE_srcB   \t= %s\n' % E_srcB)
-        self.output_file.write('\n')
-        self.log[self.cycle]['E_icode'] = E_icode
-        self.log[self.cycle]['E_ifun'] = E_ifun
-        self.log[self.cycle]['E_valC'] = E_valC
-        self.log[self.cycle]['E_valA'] = E_valA
-        self.log[self.cycle]['E_valB'] = E_valB
-        self.log[self.cycle]['E_dstE'] = E_dstE
-        self.log[self.cycle]['E_dstM'] = E_dstM
-        self.log[self.cycle]['E_srcA'] = E_srcA
-        self.log[self.cycle]['E_srcB'] = E_srcB
+        ## Train the predictors. Every instruction executes exactly once,
+        ## and none from a mispredicted path gets this far.
+        if self.E_stat != self.SAOK:
+            return
+        if self.E_icode == self.IJXX and self.E_ifun != self.FJMP:
+            ## valA is valP, and a jump is 5 bytes long
+            self.predictor.update(self.E_valA - 5, self.e_Cnd)
+            self.stats.branches += 1
+            if self.e_Cnd != self.E_pred:
+                self.stats.branch_mispredicts += 1
+        elif self.return_stack:
+            if self.E_icode == self.ICALL:
+                self.return_stack.push(self.E_valA)
+            elif self.E_icode == self.IRET:
+                self.return_stack.pop()
 
     def memory_stage(self):
+        if self.M_held:
+            ## The access of the instruction in M is already done, only
+            ## its cache miss is still being served
+            if self.m_wait:
+                self.m_wait -= 1
+            return
+
         ## Intermediate Values in Memory Stage
         self.m_valM = 0x0
         self.m_stat = self.SBUB
@@ -554,190 +714,641 @@ class Y86Processor():
         self.m_read = False
         self.dmem_error = False
 
-        if self.M_icode in (self.IRMMOVL, self.IPUSHL, self.ICALL, self.IMRMOVL):
+        control = self.control[self.M_icode]
+        if control.mem_addr == VALE:
             self.mem_addr = self.M_valE
-        elif self.M_icode in (self.IPOPL, self.IRET):
+        elif control.mem_addr == VALA:
             self.mem_addr = self.M_valA
 
-        mem_read = self.M_icode in (self.IMRMOVL, self.IPOPL, self.IRET)
+        mem_read = control.mem_read
 
-        mem_write = self.M_icode in (self.IRMMOVL, self.IPUSHL, self.ICALL)
+        mem_write = control.mem_write
 
+        ## An address out of range or a write to read-only memory, see
+        ## memory.ProtectionError
         if mem_read:
             try:
-                if self.mem_addr not in self.memory:
-                    addr = self.mem_addr * 2
-                    self.memory[self.mem_addr] = self.endian_parser(self.bin_code[addr: addr+8])
-                    self.memro.append(self.mem_addr)
-                self.m_valM = self.memory[self.mem_addr]
+                self.m_valM = self.memory.read_word(self.mem_addr)
                 self.m_read = True
-            except:
+            except IndexError:
                 self.dmem_error = True
 
         if mem_write:
             try:
-                if self.mem_addr in self.memro or self.mem_addr < 0:
-                    raise Exception
-                self.memory[self.mem_addr] = self.M_valA
-            except:
+                self.memory.write_word(self.mem_addr, self.M_valA)
+                self.invalidate(self.mem_addr)
+            except IndexError:
                 self.dmem_error = True
 
         self.m_stat = self.SADR if self.dmem_error else self.M_stat
 
-    def memory_write(self):
-        M_bubble = self.m_stat in (self.SADR, self.SINS, self.SHLT) or \
-                   self.W_stat in (self.SADR, self.SINS, self.SHLT)
-
-        if M_bubble:
-            self.M_stat  = self.SBUB
-            self.M_icode = self.INOP
-            self.M_ifun  = self.FNONE
-            self.M_Cnd   = False
-            self.M_valE  = 0x0
-            self.M_valA  = 0x0
-            self.M_dstE  = self.RNONE
-            self.M_dstM  = self.RNONE
-            return
+        if self.dcache and (mem_read or mem_write) and not self.dmem_error:
+            self.m_wait = self.dcache.access(self.mem_addr, 4, mem_write)
 
-        self.M_stat  = self.E_stat
-        self.M_icode = self.E_icode
-        self.M_ifun  = self.E_ifun
-        self.M_Cnd   = self.e_Cnd
-        self.M_valE  = self.e_valE
-        self.M_valA  = self.E_valA
-        self.M_dstE  = self.e_dstE
-        self.M_dstM  = self.E_dstM
-
-    def memory_log(self):
-        M_icode = special_hex(self.M_icode)
-        M_Bch = special_hex(self.M_Cnd)
-        M_valE = special_hex(self.M_valE, True)
-        M_valA = special_hex(self.M_valA, True)
-        M_dstE = special_hex(self.M_dstE)
-        M_dstM = special_hex(self.M_dstM)
-        self.output_file.write('MEMORY:\n')
-        self.output_file.write('\tM_icode  \t= %s\n' % M_icode)
-        self.output_file.write('\tM_Bch    \t= %s\n' % M_Bch)
-        self.output_file.write('\tM_valE   \t= %s\n' % M_valE)
-        self.output_file.write('\tM_valA   \t= %s\n' % M_valA)
-        self.output_file.write('\tM_dstE   \t= %s\n' % M_dstE)
-        self.output_file.write('\tM_dstM   \t= %s\n' % M_dstM)
-        self.output_file.write('\n')
-        self.log[self.cycle]['M_icode'] = M_icode
-        self.log[self.cycle]['M_Bch'] = M_Bch
-        self.log[self.cycle]['M_valE'] = M_valE
-        self.log[self.cycle]['M_valA'] = M_valA
-        self.log[self.cycle]['M_dstE'] = M_dstE
-        self.log[self.cycle]['M_dstM'] = M_dstM
+        if self.M_icode == self.IRET and self.M_stat == self.SAOK:
+            self.stats.returns += 1
+            if not self.M_pred:
+                self.stats.return_stalls += 1
+            elif self.m_valM != self.M_valC:
+                self.stats.return_mispredicts += 1
 
     def writeback_stage(self):
-        if self.W_dstE != self.RNONE:
-            self.registers[self.W_dstE] = self.W_valE
+        ## An instruction that failed does not update any register
+        if self.W_stat == self.SAOK:
+            if self.W_dstE != self.RNONE:
+                self.registers[self.W_dstE] = self.W_valE
 
-        if self.W_dstM != self.RNONE:
-            self.registers[self.W_dstM] = self.W_valM
+            if self.W_dstM != self.RNONE:
+                self.registers[self.W_dstM] = self.W_valM
 
         self.stat = self.SAOK if self.W_stat == self.SBUB else self.W_stat
-
-    def writeback_write(self):
-        W_stall = self.W_stat in (self.SADR, self.SINS, self.SHLT)
-        if W_stall:
-            return
-        self.W_stat  = self.m_stat
-        self.W_icode = self.M_icode
-        self.W_ifun  = self.M_ifun
-        self.W_valE  = self.M_valE
-        self.W_valM  = self.m_valM
-        self.W_dstE  = self.M_dstE
-        self.W_dstM  = self.M_dstM
-
-    def writeback_log(self):
-        W_icode = special_hex(self.W_icode)
-        W_valE = special_hex(self.W_valE, True)
-        W_valM = special_hex(self.W_valM, True)
-        W_dstE = special_hex(self.W_dstE)
-        W_dstM = special_hex(self.W_dstM)
-
-        self.output_file.write('WRITE BACK:\n')
-        self.output_file.write('\tW_icode  \t= %s\n' % W_icode)
-        self.output_file.write('\tW_valE   \t= %s\n' % W_valE)
-        self.output_file.write('\tW_valM   \t= %s\n' % W_valM)
-        self.output_file.write('\tW_dstE   \t= %s\n' % W_dstE)
-        self.output_file.write('\tW_dstM   \t= %s\n' % W_dstM)
-        self.output_file.write('\n')
-
-        self.log[self.cycle]['W_icode'] = W_icode
-        self.log[self.cycle]['W_valE'] = W_valE
-        self.log[self.cycle]['W_valM'] = W_valM
-        self.log[self.cycle]['W_dstE'] = W_dstE
-        self.log[self.cycle]['W_dstM'] = W_dstM
+        if self.W_stat == self.SAOK:
+            self.retired += 1
+
+    def log_cycle(self):
+        row = self.log.append(self)
+        if self.trace:
+            text = format_cycle(self.cycle, row)
+            if self.trace_source:
+                text += format_source(stage_addresses(self), self.source_index)
+            self.trace.write(text)
+        if self.trace_file:
+            self.trace_file.append(self)
+
+    def machine_state(self):
+        ## Everything the next cycle depends on, apart from memory
+        return (get_state(self), tuple(self.registers.values()),
+                tuple(self.conditions.values()), self.predictor.changes,
+                tuple(cache.misses for cache in self.caches()))
+
+    def log_repeated(self, times):
+        row = self.log.repeat(self, times)
+        if self.trace:
+            stages = format_stages(row)
+            if self.trace_source:
+                stages += format_source(stage_addresses(self),
+                                        self.source_index)
+            for cycle in range(self.cycle + 1, self.cycle + 1 + times):
+                self.trace.write(CYCLE_FORMAT % cycle + stages)
+        if self.trace_file:
+            self.trace_file.repeat(self, times)
+
+    def caches(self):
+        return [cache for cache in (self.icache, self.dcache) if cache]
+
+    def counted(self):
+        ## Everything with counts() and add() besides self.retired
+        counted = [self.stats] + self.caches()
+        if self.perf:
+            counted.append(self.perf)
+        return counted
+
+    def counts(self):
+        ## Counters a repeated cycle adds to
+        counts = (self.retired,)
+        for counted in self.counted():
+            counts += counted.counts()
+        return counts
+
+    def skip_cycles(self, count, per_cycle):
+        ## Account for `count` more cycles identical to the last one, which
+        ## is only right once the processor has stopped changing
+        interval = self.checkpoint_interval
+        while count > 0:
+            stride = count
+            if interval:
+                ## Stop at each checkpoint so the callback still runs
+                stride = min(count, interval - (self.cycle + 1) % interval)
+            if not self.fast:
+                self.log_repeated(stride)
+            if self.profiler:
+                self.profiler.sample(self, stride)
+            self.cycle += stride
+            self.retired += stride * per_cycle[0]
+            offset = 1
+            for counted in self.counted():
+                size = len(counted.counts())
+                counted.add(per_cycle[offset:offset + size], stride)
+                offset += size
+            count -= stride
+            if interval and (self.cycle + 1) % interval == 0:
+                self.checkpoint_callback(self)
 
     def run_processor(self):
-        for i in range(self.max_step):
+        if self.time_limit is not None:
+            deadline = time.time() + self.time_limit
+        else:
+            deadline = None
+
+        ## Fixed point detection: a cycle that leaves F_predPC alone may
+        ## leave the whole state alone. After two such cycles in a row any
+        ## memory write has already been repeated once, so memory is fixed
+        ## too and every later cycle is the same until the budget runs out.
+        last_predPC = None
+        last_state = None
+        last_counts = None
+        repeats = 0
+
+        ## The pipeline register updates generated from the HCL
+        logic = self.logic
+        writeback_write = logic.writeback_write
+        memory_write = logic.memory_write
+        execute_write = logic.execute_write
+        decode_write = logic.decode_write
+        fetch_write = logic.fetch_write
+        decode_stage = self.count_decode_stage if self.perf \
+            else self.decode_stage
+        profiler = self.profiler
+
+        step = 0
+        while True:
+            if self.max_step is not None and step >= self.max_step:
+                self.stop_reason = 'cycles'
+                break
+            ## Only look at the clock every 1024 cycles
+            if deadline is not None and step & 0x3ff == 0 and \
+               time.time() > deadline:
+                self.stop_reason = 'time'
+                break
+            step += 1
             self.cycle += 1
 
-            self.writeback_write()
+            writeback_write(self)
             self.writeback_stage()
 
-            self.memory_write()
+            memory_write(self)
             self.memory_stage()
 
-            self.execute_write()
+            execute_write(self)
             self.execute_stage()
 
-            self.decode_write()
-            self.decode_stage()
+            decode_write(self)
+            decode_stage()
 
-            self.fetch_write()
+            fetch_write(self)
             self.fetch_stage()
 
+            if not self.fast:
+                self.log_cycle()
+            if profiler:
+                profiler.sample(self)
 
-            self.log.append({})
-
-            self.cycle_log()
-            self.fetch_log()
-            self.decode_log()
-            self.execute_log()
-            self.memory_log()
-            self.writeback_log()
+            if self.checkpoint_interval and \
+               (self.cycle + 1) % self.checkpoint_interval == 0:
+                self.checkpoint_callback(self)
 
             if self.stat != 'AOK' and self.stat != 'BUB':
+                self.stop_reason = 'status'
                 break
 
-        self.output_file.close()
-
-addr_re = re.compile(r"(?<=0x).*?(?=:)")
-code_re = re.compile(r"(?<=:\s)\w+")
-
-def get_addr(string):
-    search_result = addr_re.search(string)
-    if search_result:
-        return int(search_result.group(0), 16)
-    return None
-
-def get_code(string):
-    search_result = code_re.search(string)
-    if search_result:
-        return search_result.group(0)
-    return None
-
-def special_hex(x, padding = False):
-    if x < 0:
-        x = (~(-x) + 1) & 0xffffffff
-
-    if padding:
-        ans = "0x%08x" % x
-    else:
-        ans = "0x%x" % x
-
-    return ans.lower()
+            if self.F_predPC != last_predPC:
+                last_predPC = self.F_predPC
+                last_state = None
+                repeats = 0
+                continue
+            state = self.machine_state()
+            if state != last_state:
+                last_state = state
+                last_counts = self.counts()
+                repeats = 0
+                continue
+            repeats += 1
+            if repeats < 2:
+                last_counts = self.counts()
+                continue
+            if self.max_step is None:
+                ## Nothing will ever change again
+                self.stop_reason = 'loop'
+                break
+            counts = self.counts()
+            self.skip_cycles(self.max_step - step,
+                             [a - b for a, b in zip(counts, last_counts)])
+            step = self.max_step
+
+        if self.trace:
+            self.trace.flush()
+
+    def state_summary(self):
+        return format_state(['Status: %s' % self.stat,
+                             'Cycles: %d' % (self.cycle + 1)] +
+                            self.stats.summary(self.predictor.name,
+                                               self.return_stack_depth()) +
+                            [cache.summary() for cache in self.caches()],
+                            [self.registers[reg] for reg in range(8)],
+                            self.conditions, self.memory_changes())
+
+    def return_stack_depth(self):
+        return self.return_stack.depth if self.return_stack else 0
+
+    def snapshot(self):
+        header = SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.cycle, self.retired,
+            *(list(self.stats.counts()) +
+              [int(getattr(self, field)) for field in STATE_FIELDS] +
+              [STATUS_CODES.index(getattr(self, field))
+               for field in STAT_FIELDS] +
+              [self.registers[reg] for reg in range(8)] +
+              [self.conditions[cc] for cc in ('ZF', 'SF', 'OF')]))
+        code_ranges = struct.pack('<%dI' % (2 * len(self.code_ranges)),
+                                  *[a for r in self.code_ranges for a in r])
+        blobs = [header]
+        return_stack = self.return_stack.get_state() \
+            if self.return_stack else b''
+        icache = self.icache.get_state() if self.icache else b''
+        dcache = self.dcache.get_state() if self.dcache else b''
+        perf = b''
+        if self.perf:
+            counts = self.perf.counts()
+            perf = struct.pack('<%dq' % len(counts), *counts)
+        profile = self.profiler.get_state() if self.profiler else b''
+        for blob in (self.image, code_ranges, bytes(self.memory.data),
+                     bytes(self.memory.attrs), self.predictor.get_state(),
+                     return_stack, icache, dcache, perf, profile,
+                     self.source_text()):
+            blob = zlib.compress(blob)
+            blobs.append(BLOB_LENGTH.pack(len(blob)))
+            blobs.append(blob)
+        return b''.join(blobs)
+
+    def source_text(self):
+        ## The .yo lines as UTF-8 bytes, for snapshots
+        text = '\n'.join(self.source)
+        return text if isinstance(text, bytes) else text.encode('utf-8')
+
+    def save_snapshot(self, path):
+        ## Write to a temporary file first so an interrupted save never
+        ## clobbers the previous checkpoint
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as snapshot_file:
+            snapshot_file.write(self.snapshot())
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
+
+    def load_snapshot(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self.restore(snapshot_file.read())
+
+    def restore(self, data):
+        values = SNAPSHOT_HEADER.unpack_from(data)
+        if values[0] != SNAPSHOT_MAGIC or values[1] != SNAPSHOT_VERSION:
+            raise ValueError('not a Y86 snapshot')
+        self.cycle, self.retired = values[2:4]
+        values = values[4:]
+        self.stats = PredictionStats()
+        self.stats.add(values[:len(PredictionStats.COUNTERS)])
+        values = values[len(PredictionStats.COUNTERS):]
+        for field, value in zip(STATE_FIELDS, values):
+            setattr(self, field, bool(value) if field in BOOL_FIELDS else value)
+        values = values[len(STATE_FIELDS):]
+        for field, value in zip(STAT_FIELDS, values):
+            setattr(self, field, STATUS_CODES[value])
+        values = values[len(STAT_FIELDS):]
+        for reg in range(8):
+            self.registers[reg] = values[reg]
+        for cc, value in zip(('ZF', 'SF', 'OF'), values[8:]):
+            self.conditions[cc] = value
+
+        blobs = []
+        offset = SNAPSHOT_HEADER.size
+        while offset < len(data):
+            length, = BLOB_LENGTH.unpack_from(data, offset)
+            offset += BLOB_LENGTH.size
+            blobs.append(zlib.decompress(data[offset:offset + length]))
+            offset += length
+        (image, code_ranges, memory_data, memory_attrs, predictor_state,
+         return_stack, icache, dcache, perf, profile, source) = blobs
+        self.predictor.set_state(predictor_state)
+        if self.return_stack:
+            self.return_stack.set_state(return_stack)
+        for name, cache, state in (('an instruction', self.icache, icache),
+                                   ('a data', self.dcache, dcache)):
+            if cache:
+                cache.set_state(state)
+            elif state:
+                raise ValueError('saved with %s cache' % name)
+        if self.counting:
+            self.perf = PerfCounters()
+            size = len(self.perf.counts())
+            if len(perf) != 8 * size:
+                raise ValueError('saved without performance counters')
+            self.perf.add(struct.unpack('<%dq' % size, perf))
+        if self.profiler:
+            self.profiler = Profiler()
+            self.profiler.set_state(profile)
+
+        ## The source lines and their index go with the image. Restoring a
+        ## snapshot of the program already loaded keeps them.
+        if source != self.source_text():
+            lines = source.decode('utf-8').split('\n') if source else []
+            loaded = load_image(lines)
+            self.source = loaded.source
+            self.source_index = loaded.index
+
+        self.image = image
+        code_ranges = struct.unpack('<%dI' % (len(code_ranges) // 4),
+                                    code_ranges)
+        self.code_ranges = list(zip(code_ranges[0::2], code_ranges[1::2]))
+        self.memory = Memory(image)
+        self.memory.data = bytearray(memory_data)
+        self.memory.attrs = bytearray(memory_attrs)
+        self.predecode()
+        self.log = CycleLog(self.log_capacity, self.cycle + 1)
+
+    def load_state(self, pc, registers, conditions, memory):
+        ## Start with an empty pipeline fetching at pc, from the architectural
+        ## state of another simulator. The memory is used as it is.
+        self.reset_pipeline()
+        self.F_predPC = pc
+        for reg, value in enumerate(registers):
+            self.registers[reg] = value
+        self.conditions.update(conditions)
+        self.memory = memory
+        self.predecode()
+
+    def final_state(self):
+        cycles = self.cycle + 1
+        return {
+            'status': self.stat,
+            'stop_reason': self.stop_reason,
+            'cycles': cycles,
+            'instructions': self.retired,
+            'cpi': float(cycles) / self.retired if self.retired else None,
+            'registers': dict((name, self.registers[reg]) for name, reg
+                              in zip(REGISTER_NAMES, sorted(self.registers))),
+            'conditions': dict(self.conditions),
+            'memory': self.memory_changes(),
+            'prediction': self.stats.to_dict(self.predictor.name,
+                                             self.return_stack_depth()),
+            'caches': dict((name, cache.to_dict()) for name, cache
+                           in (('icache', self.icache),
+                               ('dcache', self.dcache)) if cache),
+            'counters': self.perf.to_dict(cycles, self.retired)
+                        if self.perf else None,
+            'profile': self.profiler.to_dict() if self.profiler else None,
+        }
 
-def main():
-    input_file = open('asum.yo', 'r')
+    def memory_changes(self):
+        return self.memory.changes(self.image)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Y86 pipeline simulator')
+    parser.add_argument('inputs', nargs='+', metavar='input',
+                        help='.yo file to simulate')
+    parser.add_argument('-o', '--output',
+                        help="output file, '-' for stdout "
+                             "(default: the input path with a .txt suffix)")
+    parser.add_argument('-n', '--max-cycles', type=int, default=10000,
+                        help='stop after this many cycles, 0 for no limit '
+                             '(default: 10000)')
+    parser.add_argument('-t', '--time-limit', type=float,
+                        help='stop after this many seconds')
+    parser.add_argument('-f', '--fast', action='store_true',
+                        help='skip the per-cycle trace and only report the '
+                             'final state')
+    parser.add_argument('--checkpoint', metavar='PATH',
+                        help='save a snapshot of the processor to PATH '
+                             'periodically and when the run ends')
+    parser.add_argument('--checkpoint-interval', type=int, default=1000000,
+                        metavar='CYCLES',
+                        help='cycles between checkpoints (default: 1000000)')
+    parser.add_argument('--resume', metavar='PATH',
+                        help='continue from a snapshot saved with '
+                             '--checkpoint')
+    parser.add_argument('-e', '--engine', default='pipeline',
+                        choices=('pipeline', 'functional', 'lockstep'),
+                        help='pipeline: cycle accurate model (default), '
+                             'functional: one instruction at a time, no '
+                             'trace, -n counts instructions, lockstep: '
+                             'pipeline checked against the functional model')
+    parser.add_argument('--hcl', metavar='PATH',
+                        help='pipeline control logic to use instead of '
+                             'pipe.hcl')
+    parser.add_argument('--hcl-cache', metavar='PATH',
+                        help="directory to cache compiled HCL in, 'off' for "
+                             "no cache (default: $Y86_HCL_CACHE or "
+                             "~/.cache/y86-hcl)")
+    parser.add_argument('--predictor', choices=sorted(PREDICTORS),
+                        default='taken',
+                        help='branch predictor for conditional jumps '
+                             '(default: taken)')
+    parser.add_argument('--ras', type=int, nargs='?', const=RETURN_STACK_DEPTH,
+                        default=0, metavar='DEPTH',
+                        help='predict ret with a return address stack '
+                             '(default depth: %d) instead of stalling'
+                             % RETURN_STACK_DEPTH)
+    parser.add_argument('--icache', metavar='SPEC',
+                        help='model an instruction cache, SPEC is '
+                             'key=value,... with size, ways, line, policy '
+                             '(lru, fifo, random), write (back, through) and '
+                             'penalty in cycles, e.g. size=4096,ways=4')
+    parser.add_argument('--dcache', metavar='SPEC',
+                        help='model a data cache, SPEC as for --icache')
+    parser.add_argument('--counters', metavar='PATH',
+                        help="write the performance counters of the run as "
+                             "JSON to PATH, '-' for stdout")
+    parser.add_argument('--profile', metavar='PATH',
+                        help="write the cycles, stalls and branch outcomes "
+                             "of each instruction next to the .yo source to "
+                             "PATH, '-' for stdout")
+    parser.add_argument('--trace-source', action='store_true',
+                        help='show the .yo line of the instruction in each '
+                             'stage after every cycle of the trace')
+    parser.add_argument('--trace-file', metavar='PATH',
+                        help='also write the per-cycle trace to PATH in the '
+                             'compact binary format, see the trace '
+                             'subcommand')
+    parser.add_argument('-v', '--verbosity', type=int, choices=(0, 1, 2),
+                        default=2,
+                        help='0: no output, 1: final state only, '
+                             '2: per-cycle trace (default)')
+    args = parser.parse_args(argv)
+    if args.output not in (None, '-') and len(args.inputs) > 1:
+        parser.error('--output needs a single input unless it is -')
+    if (args.checkpoint or args.resume) and len(args.inputs) > 1:
+        parser.error('--checkpoint and --resume need a single input')
+    if (args.checkpoint or args.resume) and args.engine != 'pipeline':
+        parser.error('--checkpoint and --resume need the pipeline engine')
+    if args.hcl and args.engine == 'functional':
+        parser.error('--hcl needs the pipeline or lockstep engine')
+    if (args.predictor != 'taken' or args.ras) and \
+       args.engine == 'functional':
+        parser.error('--predictor and --ras need the pipeline or lockstep '
+                     'engine')
+    if args.ras < 0:
+        parser.error('--ras needs a positive depth')
+    if args.counters not in (None, '-') and len(args.inputs) > 1:
+        parser.error('--counters needs a single input unless it is -')
+    if args.profile not in (None, '-') and len(args.inputs) > 1:
+        parser.error('--profile needs a single input unless it is -')
+    if (args.counters or args.profile) and args.engine == 'functional':
+        parser.error('--counters and --profile need the pipeline or '
+                     'lockstep engine')
+    if args.trace_file and len(args.inputs) > 1:
+        parser.error('--trace-file needs a single input')
+    if args.trace_file and (args.fast or args.engine == 'functional'):
+        parser.error('--trace-file needs the pipeline or lockstep engine '
+                     'without --fast')
+    if (args.icache or args.dcache) and args.engine == 'functional':
+        parser.error('--icache and --dcache need the pipeline or lockstep '
+                     'engine')
+    try:
+        args.icache = args.icache and parse_cache('I-cache', args.icache)
+        args.dcache = args.dcache and parse_cache('D-cache', args.dcache)
+    except CacheError as error:
+        parser.error(str(error))
+    return args
+
+def load_processor(input_path, max_cycles=10000, fast=False, time_limit=None):
     processor = Y86Processor()
-    processor.set_input_file(input_file)
-    input_file.close()
-    processor.run_processor()
+    processor.set_fast(fast)
+    ## The trace is streamed out, nothing needs to stay in memory
+    processor.set_log_capacity(0)
+    processor.set_max_step(max_cycles or None)
+    processor.set_time_limit(time_limit)
+    with open(input_path, 'r') as input_file:
+        processor.set_input_file(input_file)
+    return processor
+
+def load_functional(input_path, max_steps=10000, time_limit=None):
+    machine = Y86Functional()
+    machine.set_max_step(max_steps or None)
+    machine.set_time_limit(time_limit)
+    with open(input_path, 'r') as input_file:
+        machine.set_input_file(input_file)
+    return machine
+
+def report(processor, output_file, verbosity, run):
+    if verbosity >= 2:
+        processor.set_output_file(output_file)
+    run()
+    if verbosity == 1:
+        output_file.write(processor.state_summary())
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == 'batch':
+        import batch
+        return batch.main(argv[1:])
+    if argv and argv[0] == 'sample':
+        import sampling
+        return sampling.main(argv[1:])
+    if argv and argv[0] == 'trace':
+        import tracefile
+        return tracefile.main(argv[1:])
+
+    args = parse_args(argv)
+    if args.hcl_cache:
+        set_cache_dir(args.hcl_cache)
+    hcl_text = None
+    if args.hcl:
+        try:
+            with open(args.hcl, 'r') as hcl_file:
+                hcl_text = hcl_file.read()
+        except IOError as error:
+            sys.stderr.write('HCL Error: %s\n' % error)
+            return 1
+    failed = 0
+    for input_path in args.inputs:
+        try:
+            run_input(args, input_path, hcl_text)
+        except HCLError as error:
+            sys.stderr.write('HCL Error: %s: %s\n' % (args.hcl, error))
+            return 1
+        except LoadError as error:
+            sys.stderr.write('Init Error: %s: %s\n' % (input_path, error))
+            failed += 1
+        except Divergence as error:
+            sys.stderr.write('Lockstep Error: %s: %s\n' % (input_path, error))
+            failed += 1
+        except ValueError as error:
+            ## A snapshot that does not fit this run
+            if not args.resume:
+                raise
+            sys.stderr.write('Resume Error: %s: %s\n' % (args.resume, error))
+            failed += 1
+    return 1 if failed else 0
+
+def run_input(args, input_path, hcl_text=None):
+    if args.engine == 'functional':
+        processor = load_functional(input_path, args.max_cycles,
+                                    args.time_limit)
+    else:
+        processor = load_processor(input_path, args.max_cycles, args.fast,
+                                   args.time_limit)
+        if hcl_text is not None:
+            processor.set_hcl(hcl_text)
+        processor.set_predictor(args.predictor)
+        processor.set_return_stack(args.ras)
+        processor.set_caches(args.icache, args.dcache)
+        processor.set_counters(bool(args.counters))
+        processor.set_profiler(bool(args.profile))
+        processor.set_trace_source(args.trace_source)
+    if args.engine == 'lockstep':
+        run = lambda: run_lockstep(processor)
+    else:
+        run = processor.run_processor
+    if args.resume:
+        processor.load_snapshot(args.resume)
+    if args.checkpoint:
+        processor.set_checkpoint(args.checkpoint_interval,
+            lambda processor: processor.save_snapshot(args.checkpoint))
+    if args.trace_file:
+        run_untraced = run
+        run = lambda: run_with_trace_file(processor, args.trace_file,
+                                          run_untraced)
+    if args.fast or args.engine == 'functional':
+        verbosity = min(args.verbosity, 1)
+    else:
+        verbosity = args.verbosity
+    if verbosity == 0:
+        run()
+    elif args.output == '-':
+        report(processor, sys.stdout, verbosity, run)
+    else:
+        output_path = args.output or os.path.splitext(input_path)[0] + '.txt'
+        with open(output_path, 'w') as output_file:
+            report(processor, output_file, verbosity, run)
+    if args.checkpoint:
+        processor.save_snapshot(args.checkpoint)
+    if args.counters:
+        write_counters(processor, input_path, args.counters)
+    if args.profile:
+        write_profile(processor, input_path, args.profile)
+
+def run_with_trace_file(processor, path, run):
+    ## The binary trace gets its index even when the run fails, so the
+    ## cycles up to the failure can still be read
+    with open(path, 'wb') as trace_file:
+        processor.set_trace_file(TraceFileWriter(trace_file, processor.source))
+        try:
+            run()
+        finally:
+            processor.trace_file.close()
+            processor.set_trace_file(None)
+
+def write_profile(processor, input_path, path):
+    lines = ['Profile of %s' % input_path, '']
+    lines += processor.profiler.annotate(processor.source,
+                                         processor.source_index,
+                                         processor.cycle + 1)
+    text = '\n'.join(lines) + '\n'
+    if path == '-':
+        sys.stdout.write(text)
+    else:
+        with open(path, 'w') as output_file:
+            output_file.write(text)
+
+def write_counters(processor, input_path, path):
+    result = processor.perf.to_dict(processor.cycle + 1, processor.retired)
+    result['source'] = input_path
+    if path == '-':
+        json.dump(result, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(path, 'w') as output_file:
+            json.dump(result, output_file, indent=2, sort_keys=True)
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
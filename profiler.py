@@ -0,0 +1,138 @@
+#!/usr/bin/python
+
+## Per-instruction profile of a pipeline run, like perf annotate. Every
+## cycle is charged to the oldest instruction that has not retired yet: a
+## cycle in which an instruction retires costs it one cycle, a bubble in W
+## is a lost cycle charged to the next instruction that retires, by cause.
+
+import struct
+
+from counters import CAUSES
+from isa import IJXX, SAOK, SBUB
+
+## Columns of a profile entry, followed by the lost cycles of each cause
+RETIRED = 0
+CYCLES = 1
+BRANCHES = 2
+TAKEN = 3
+MISPREDICTED = 4
+LOST = 5
+
+## Instructions listed in the hot spot table
+HOT_SPOTS = 10
+
+class Profiler():
+    def __init__(self):
+        ## Entry lists by instruction address
+        self.entries = {}
+        ## Lost cycles by cause waiting for the next instruction to retire
+        self.pending = [0] * len(CAUSES)
+
+    def entry(self, addr):
+        entry = self.entries.get(addr)
+        if entry is None:
+            entry = self.entries[addr] = [0] * (LOST + len(CAUSES))
+        return entry
+
+    def sample(self, p, times=1):
+        ## Account for the cycle the processor has just run, `times` times
+        ## over when it repeats
+        if p.W_stat == SBUB:
+            self.pending[p.W_cause] += times
+        else:
+            ## An instruction that failed in W does not retire, but the
+            ## cycles spent on it are still its own
+            entry = self.entry(p.W_addr)
+            if p.W_stat == SAOK:
+                entry[RETIRED] += times
+            entry[CYCLES] += times + sum(self.pending)
+            for cause, lost in enumerate(self.pending):
+                if lost:
+                    entry[LOST + cause] += lost
+                    self.pending[cause] = 0
+
+        ## A jump in M is on the right path, and it is only counted when it
+        ## gets there rather than while it is held
+        if p.M_icode == IJXX and p.M_stat == SAOK and not p.M_held:
+            entry = self.entry(p.M_addr)
+            entry[BRANCHES] += times
+            if p.M_Cnd:
+                entry[TAKEN] += times
+            if p.M_Cnd != p.M_pred:
+                entry[MISPREDICTED] += times
+
+    def hot_spots(self, limit=HOT_SPOTS):
+        ## (addr, entry) of the instructions that took the most cycles
+        return sorted(self.entries.items(),
+                      key=lambda item: (-item[1][CYCLES], item[0]))[:limit]
+
+    def annotate(self, source, index, cycles):
+        ## The profile as lines of text: the hot spots, then the source
+        ## with the profile of each instruction next to its line.
+        ## index is the loader.SourceIndex of the source.
+        lines_by_number = dict(zip(index.line_numbers, index.starts))
+        percent = lambda count: 100.0 * count / cycles if cycles else 0.0
+
+        lines = ['Hot spots (%d cycles):' % cycles,
+                 '%8s %6s %8s %8s  %s' % ('Cycles', '%', 'Count', 'Lost',
+                                          'Instruction')]
+        for addr, entry in self.hot_spots():
+            number = index.line_number(addr)
+            text = source[number - 1] if number else '0x%03x:' % addr
+            lines.append('%8d %5.1f%% %8d %8d  %s' % (
+                entry[CYCLES], percent(entry[CYCLES]), entry[RETIRED],
+                sum(entry[LOST:]), text.strip()))
+        lines.append('')
+
+        lines.append('%8s %6s %8s %8s %-14s %11s | %s' % (
+            'Cycles', '%', 'Count', 'Lost', 'Mostly', 'Taken/Miss',
+            'Source'))
+        blank = ' ' * 60 + ' | '
+        for number, text in enumerate(source, 1):
+            addr = lines_by_number.get(number)
+            entry = self.entries.get(addr) if addr is not None else None
+            if entry is None:
+                lines.append(blank + text)
+                continue
+            lost = entry[LOST:]
+            cause = ''
+            if sum(lost):
+                cause = CAUSES[lost.index(max(lost))]
+            branches = ''
+            if entry[BRANCHES]:
+                branches = '%d/%d' % (entry[TAKEN], entry[MISPREDICTED])
+            lines.append('%8d %5.1f%% %8d %8d %-14s %11s | %s' % (
+                entry[CYCLES], percent(entry[CYCLES]), entry[RETIRED],
+                sum(lost), cause, branches, text))
+        return lines
+
+    def get_state(self):
+        ## The pending lost cycles, then the address and columns of each
+        ## entry
+        values = list(self.pending)
+        for addr, entry in sorted(self.entries.items()):
+            values.append(addr)
+            values.extend(entry)
+        return struct.pack('<%dq' % len(values), *values)
+
+    def set_state(self, data):
+        size = LOST + len(CAUSES)
+        count = len(data) // 8
+        if count < len(CAUSES) or (count - len(CAUSES)) % (size + 1):
+            raise ValueError('saved without the profiler')
+        values = struct.unpack('<%dq' % count, data)
+        self.pending = list(values[:len(CAUSES)])
+        self.entries = {}
+        for offset in range(len(CAUSES), count, size + 1):
+            self.entries[values[offset]] = \
+                list(values[offset + 1:offset + 1 + size])
+
+    def to_dict(self):
+        return dict(('0x%x' % addr, {
+            'retired': entry[RETIRED],
+            'cycles': entry[CYCLES],
+            'branches': entry[BRANCHES],
+            'taken': entry[TAKEN],
+            'mispredicted': entry[MISPREDICTED],
+            'lost_cycles': dict(zip(CAUSES, entry[LOST:])),
+        }) for addr, entry in self.entries.items())
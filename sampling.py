@@ -0,0 +1,166 @@
+#!/usr/bin/python
+
+import argparse
+import json
+import math
+import sys
+
+from functional import Y86Functional
+from isa import SAOK
+from loader import LoadError, load_image
+from memory import PROTECTIONS
+from processor import Y86Processor
+
+## Two-sided 95% confidence, normal approximation
+Z_95 = 1.96
+
+## Sampling points of a run unless told otherwise, so that a program that
+## never stops still gives an estimate
+MAX_SAMPLES = 1000
+
+def sample_program(image, period=100000, warmup=1000, window=10000,
+                   max_instructions=None, protection='code',
+                   max_samples=MAX_SAMPLES):
+    ## Estimate the cycle count of a program without simulating every cycle.
+    ## The functional simulator runs the whole program; every `period`
+    ## instructions its state is copied into an empty pipeline, which runs
+    ## `warmup` cycles to fill up and then `window` measured cycles. The
+    ## CPI of the windows is extrapolated to every instruction. The run
+    ## stops after max_instructions instructions or max_samples sampling
+    ## points, None for no limit.
+    machine = Y86Functional()
+    machine.set_protection(protection)
+    machine.set_image(image)
+    processor = Y86Processor()
+    processor.set_fast(True)
+    processor.set_log_capacity(0)
+    processor.set_protection(protection)
+    processor.set_image(image)
+
+    samples = []
+    points = 0
+    while machine.stat == SAOK:
+        if max_instructions is not None and machine.retired >= max_instructions:
+            break
+        if max_samples is not None and points >= max_samples:
+            break
+        points += 1
+        processor.load_state(machine.pc, machine.registers,
+                             machine.conditions, machine.memory.copy())
+        processor.set_max_step(warmup)
+        processor.run_processor()
+        if processor.stop_reason == 'status':
+            ## The program ended while warming up: measure all of it
+            if processor.retired:
+                samples.append(float(processor.cycle + 1) / processor.retired)
+        else:
+            cycle = processor.cycle
+            retired = processor.retired
+            processor.set_max_step(window)
+            processor.run_processor()
+            if processor.retired > retired:
+                samples.append(float(processor.cycle - cycle) /
+                               (processor.retired - retired))
+
+        ## Fast forward to the next sampling point
+        steps = period
+        if max_instructions is not None:
+            steps = min(steps, max_instructions - machine.retired)
+        machine.set_max_step(steps)
+        machine.run_processor()
+
+    result = {
+        'status': machine.stat,
+        'instructions': machine.retired,
+        'samples': len(samples),
+        'cpi': None,
+        'cpi_interval': None,
+        'cycles': None,
+        'cycles_interval': None,
+    }
+    if samples:
+        cpi = sum(samples) / len(samples)
+        result['cpi'] = cpi
+        result['cycles'] = cpi * machine.retired
+    if len(samples) > 1:
+        variance = sum((x - cpi) ** 2 for x in samples) / (len(samples) - 1)
+        interval = Z_95 * math.sqrt(variance / len(samples))
+        result['cpi_interval'] = interval
+        result['cycles_interval'] = interval * machine.retired
+    return result
+
+def format_result(result):
+    if result.get('error'):
+        return '%s\terror: %s' % (result['source'], result['error'])
+    if result['cpi'] is None:
+        return '%s\t%s\t%d instructions\tno samples' % (
+            result['source'], result['status'], result['instructions'])
+    if result['cpi_interval'] is None:
+        ## A single sample gives no interval
+        return '%s\t%s\t%d instructions\t%.0f cycles\tCPI %.3f (1 sample)' % (
+            result['source'], result['status'], result['instructions'],
+            result['cycles'], result['cpi'])
+    return '%s\t%s\t%d instructions\t%.0f +- %.0f cycles\t' \
+           'CPI %.3f +- %.3f (%d samples)' % (
+        result['source'], result['status'], result['instructions'],
+        result['cycles'], result['cycles_interval'], result['cpi'],
+        result['cpi_interval'], result['samples'])
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='processor.py sample',
+        description='Estimate cycles and CPI of long programs by sampling')
+    parser.add_argument('inputs', nargs='+', metavar='input',
+                        help='.yo file to simulate')
+    parser.add_argument('--period', type=int, default=100000,
+                        help='instructions between samples (default: 100000)')
+    parser.add_argument('--warmup', type=int, default=1000,
+                        help='pipeline cycles before each measurement '
+                             '(default: 1000)')
+    parser.add_argument('--window', type=int, default=10000,
+                        help='pipeline cycles measured per sample '
+                             '(default: 10000)')
+    parser.add_argument('-n', '--max-instructions', type=int, default=0,
+                        help='stop after this many instructions, 0 for no '
+                             'limit (default: 0)')
+    parser.add_argument('--max-samples', type=int, default=MAX_SAMPLES,
+                        help='stop after this many samples, 0 for no limit '
+                             '(default: %d)' % MAX_SAMPLES)
+    parser.add_argument('--protection', choices=PROTECTIONS,
+                        default='code',
+                        help='write protection of the loaded image')
+    parser.add_argument('--json', metavar='PATH',
+                        help="write the results as JSON, '-' for stdout")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    for input_path in args.inputs:
+        result = {'source': input_path, 'error': None}
+        try:
+            with open(input_path, 'r') as input_file:
+                image = load_image(input_file)
+        except (IOError, LoadError) as error:
+            result['error'] = str(error)
+        else:
+            result.update(sample_program(image, args.period, args.warmup,
+                                         args.window,
+                                         args.max_instructions or None,
+                                         args.protection,
+                                         args.max_samples or None))
+        results.append(result)
+
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        if args.json:
+            with open(args.json, 'w') as output_file:
+                json.dump(results, output_file, indent=2, sort_keys=True)
+        for result in results:
+            sys.stdout.write(format_result(result) + '\n')
+    return 1 if any(result['error'] for result in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+
+## Compare the per-cycle traces of two source trees on random programs:
+##
+##   python tests/compare_traces.py OLD_TREE [NEW_TREE] [--seeds 0:300]
+##
+## NEW_TREE defaults to this tree. Each tree runs `processor.py PROG.yo
+## -o -` in its own process, so any two versions with the command-line
+## runner can be compared. The seeds whose traces differ are listed, with
+## the first cycle they differ in.
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+
+from randprog import random_yo
+
+def trace(tree, path, cycles):
+    return subprocess.check_output(
+        [sys.executable, os.path.join(tree, 'processor.py'), path, '-o', '-',
+         '-n', str(cycles)], stderr=subprocess.STDOUT)
+
+def first_difference(old, new):
+    ## The "Cycle_N" header of the first cycle that differs
+    header = b''
+    for old_line, new_line in zip(old.splitlines(), new.splitlines()):
+        if old_line.startswith(b'Cycle_'):
+            header = old_line
+        if old_line != new_line:
+            return header.decode('ascii')
+    return 'the end'
+
+def compare(old_tree, new_tree, seeds, cycles):
+    ## Returns [(seed, first differing cycle)]
+    differences = []
+    directory = tempfile.mkdtemp()
+    try:
+        for seed in seeds:
+            path = os.path.join(directory, 'random%d.yo' % seed)
+            with open(path, 'w') as program_file:
+                program_file.write(random_yo(seed))
+            old = trace(old_tree, path, cycles)
+            new = trace(new_tree, path, cycles)
+            if old != new:
+                differences.append((seed, first_difference(old, new)))
+    finally:
+        shutil.rmtree(directory)
+    return differences
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Compare the traces of two trees on random programs')
+    parser.add_argument('old', help='source tree to compare against')
+    parser.add_argument('new', nargs='?', default=os.path.dirname(TESTS),
+                        help='source tree to check (default: this one)')
+    parser.add_argument('--seeds', default='0:300', metavar='FIRST:END',
+                        help='random programs to run (default: 0:300)')
+    parser.add_argument('-n', '--max-cycles', type=int, default=400,
+                        help='cycles to trace per program (default: 400)')
+    args = parser.parse_args(argv)
+    first, end = args.seeds.split(':')
+    args.seeds = range(int(first), int(end))
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    differences = compare(args.old, args.new, args.seeds, args.max_cycles)
+    for seed, cycle in differences:
+        print('seed %d: traces differ from %s' % (seed, cycle))
+    print('%d of %d programs differ' % (len(differences), len(args.seeds)))
+    return 1 if differences else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+
+## Random Y86 programs for comparing pipeline models, written out as .yo
+## listings. A program is a main body of straight-line code, forward
+## jumps and calls into a few small functions, working on a data block.
+## Now and then a load or store goes to an address outside memory, which
+## ends the program with an exception.
+
+import random
+
+REGISTERS = {'%eax': 0, '%ecx': 1, '%edx': 2, '%ebx': 3, '%esp': 4,
+             '%ebp': 5, '%esi': 6, '%edi': 7}
+OPERATIONS = {'addl': 0, 'subl': 1, 'andl': 2, 'xorl': 3}
+JUMPS = {'jmp': 0, 'jle': 1, 'jl': 2, 'je': 3, 'jne': 4, 'jge': 5, 'jg': 6}
+MOVES = {'rrmovl': 0, 'cmovle': 1, 'cmovl': 2, 'cmove': 3, 'cmovne': 4,
+         'cmovge': 5, 'cmovg': 6}
+
+## Registers the bodies write; %esp holds the stack and %edi the data
+WORKING = ('%eax', '%ecx', '%edx', '%ebx', '%esi', '%ebp')
+FUNCTIONS = 3
+DATA_WORDS = 8
+BAD_ADDRESS = 0x7fff0000
+
+def body(rng, count, prefix, calls):
+    lines = []
+    for i in range(count):
+        lines.append('%s%d:' % (prefix, i))
+        choice = rng.random()
+        a = rng.choice(WORKING)
+        b = rng.choice(WORKING)
+        word = 4 * rng.randrange(DATA_WORDS)
+        if choice < 0.14:
+            lines.append('irmovl $%d, %s' % (rng.choice(
+                [0, 1, -1, 4, 0x7fffffff, -0x80000000,
+                 rng.randint(-99, 99)]), a))
+        elif choice < 0.28:
+            lines.append('%s %s, %s' % (rng.choice(sorted(OPERATIONS)), a, b))
+        elif choice < 0.38:
+            lines.append('%s %s, %s' % (rng.choice(sorted(MOVES)), a, b))
+        elif choice < 0.47:
+            lines.append('rmmovl %s, %d(%%edi)' % (a, word))
+        elif choice < 0.57:
+            lines.append('mrmovl %d(%%edi), %s' % (word, a))
+            if rng.random() < 0.5:
+                ## Use the loaded register right away
+                lines.append('addl %s, %s' % (a, b))
+        elif choice < 0.59:
+            lines.append('irmovl $%d, %s' % (BAD_ADDRESS, a))
+            lines.append(rng.choice(['rmmovl %s, 0(%s)' % (b, a),
+                                     'mrmovl 0(%s), %s' % (a, b)]))
+        elif choice < 0.66:
+            lines.append('pushl %s' % a)
+            lines.append('popl %s' % b)
+        elif choice < 0.78 and i + 1 < count:
+            lines.append('%s %s%d' % (rng.choice(sorted(JUMPS)), prefix,
+                                      rng.randint(i + 1, count - 1)))
+        elif choice < 0.86 and calls:
+            lines.append('call F%d' % rng.randrange(FUNCTIONS))
+        elif choice < 0.9:
+            lines.append('pushl %esp')
+            lines.append('popl %s' % a)
+        else:
+            lines.append('nop')
+    return lines
+
+def program(seed):
+    ## Assembly source of random program `seed`
+    rng = random.Random(seed)
+    lines = ['irmovl Stack, %esp', 'irmovl Data, %edi']
+    lines += body(rng, rng.randint(5, 40), 'M', True)
+    lines.append('halt')
+    for function in range(FUNCTIONS):
+        lines.append('F%d:' % function)
+        lines += body(rng, rng.randint(1, 8), 'F%dL' % function, False)
+        lines.append('ret')
+    lines += ['.align 4', 'Data:']
+    lines += ['.long %d' % rng.randint(-5, 5) for i in range(DATA_WORDS)]
+    lines += ['.pos 0x400', 'Stack:']
+    return lines
+
+def little_endian(value):
+    value &= 0xffffffff
+    return ''.join('%02x' % ((value >> (8 * i)) & 0xff) for i in range(4))
+
+def size(op):
+    if op in ('nop', 'halt', 'ret'):
+        return 1
+    if op in OPERATIONS or op in MOVES or op in ('pushl', 'popl'):
+        return 2
+    if op in ('irmovl', 'rmmovl', 'mrmovl'):
+        return 6
+    if op in JUMPS or op == 'call':
+        return 5
+    if op == '.long':
+        return 4
+    return 0
+
+def split(line):
+    ## (label or None, statement)
+    label = None
+    if ':' in line:
+        label, line = line.split(':', 1)
+    return label, line.strip()
+
+def assemble(lines):
+    ## The .yo listing of the assembly lines of program()
+    labels = {}
+    placed = []
+    pc = 0
+    for line in lines:
+        label, text = split(line)
+        op = text.split()[0] if text else ''
+        if op == '.pos':
+            pc = int(text.split()[1], 0)
+        elif op == '.align':
+            align = int(text.split()[1], 0)
+            pc = (pc + align - 1) // align * align
+        if label:
+            labels[label] = pc
+        placed.append((pc, line, op, text))
+        pc += size(op)
+
+    def value(text):
+        text = text.strip().lstrip('$')
+        return labels[text] if text in labels else int(text, 0)
+
+    listing = []
+    for pc, line, op, text in placed:
+        args = [arg.strip() for arg in text[len(op):].split(',')] \
+            if len(text) > len(op) else []
+        code = ''
+        if op == 'nop':
+            code = '00'
+        elif op == 'halt':
+            code = '10'
+        elif op == 'ret':
+            code = '90'
+        elif op in MOVES:
+            code = '2%x%x%x' % (MOVES[op], REGISTERS[args[0]],
+                                REGISTERS[args[1]])
+        elif op == 'irmovl':
+            code = '308%x' % REGISTERS[args[1]] + little_endian(value(args[0]))
+        elif op in ('rmmovl', 'mrmovl'):
+            register, memory = args if op == 'rmmovl' else args[::-1]
+            displacement, base = memory.rstrip(')').split('(')
+            code = '%s%x%x' % ('40' if op == 'rmmovl' else '50',
+                               REGISTERS[register], REGISTERS[base]) + \
+                little_endian(value(displacement or '0'))
+        elif op in OPERATIONS:
+            code = '6%x%x%x' % (OPERATIONS[op], REGISTERS[args[0]],
+                                REGISTERS[args[1]])
+        elif op in JUMPS:
+            code = '7%x' % JUMPS[op] + little_endian(value(args[0]))
+        elif op == 'call':
+            code = '80' + little_endian(value(args[0]))
+        elif op == 'pushl':
+            code = 'a0%x8' % REGISTERS[args[0]]
+        elif op == 'popl':
+            code = 'b0%x8' % REGISTERS[args[0]]
+        elif op == '.long':
+            code = little_endian(value(args[0]))
+        listing.append('  0x%03x: %-12s | %s' % (pc, code, line))
+    return '\n'.join(listing) + '\n'
+
+def random_yo(seed):
+    return assemble(program(seed))
@@ -0,0 +1,31 @@
+#!/usr/bin/python
+
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+from batch import simulate_batch
+from processor import Y86Processor
+
+FIXTURES = ['ret.yo', 'fault.yo', 'countdown.yo', 'ret.yo']
+
+class BatchTest(unittest.TestCase):
+    def test_reused_processor(self):
+        ## One processor runs every job in turn and must start each one
+        ## from scratch
+        paths = [os.path.join(TESTS, name) for name in FIXTURES]
+        results = simulate_batch(paths, processes=1)
+        for path, result in zip(paths, results):
+            processor = Y86Processor()
+            with open(path, 'r') as input_file:
+                processor.set_input_file(input_file)
+            processor.run_processor()
+            expected = processor.final_state()
+            for key in ('status', 'cycles', 'registers', 'memory'):
+                self.assertEqual(result[key], expected[key])
+
+if __name__ == '__main__':
+    unittest.main()
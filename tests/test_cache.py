@@ -0,0 +1,65 @@
+#!/usr/bin/python
+
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+from cache import Cache, parse_cache
+from processor import Y86Processor
+
+DCACHE = 'size=256,ways=2,policy=random'
+
+def load(name, dcache=DCACHE):
+    processor = Y86Processor()
+    processor.set_fast(True)
+    processor.set_log_capacity(0)
+    processor.set_max_step(None)
+    with open(os.path.join(TESTS, name), 'r') as input_file:
+        processor.set_input_file(input_file)
+    processor.set_caches(None, parse_cache('D-cache', dcache))
+    return processor
+
+class CacheStateTest(unittest.TestCase):
+    def test_round_trip(self):
+        for policy in ('lru', 'fifo', 'random'):
+            cache = Cache('D-cache', 128, 2, 16, policy, True, 10)
+            for addr in range(0, 1024, 12):
+                cache.access(addr, 4, addr % 3 == 0)
+            copy = Cache('D-cache', 128, 2, 16, policy, True, 10)
+            copy.set_state(cache.get_state())
+            self.assertEqual(copy.tags, cache.tags)
+            self.assertEqual(copy.stamps, cache.stamps)
+            self.assertEqual(copy.clock, cache.clock)
+            self.assertEqual(copy.seed, cache.seed)
+            self.assertEqual(copy.dirty, cache.dirty)
+            self.assertEqual(copy.counts(), cache.counts())
+
+    def test_other_configuration(self):
+        cache = Cache('D-cache', 128, 2, 16)
+        other = Cache('D-cache', 256, 2, 16)
+        self.assertRaises(ValueError, other.set_state, cache.get_state())
+
+    def test_resume_keeps_timing(self):
+        ## Random replacement of conflicting lines depends on the whole
+        ## cache state, so a run resumed from a snapshot only takes as many
+        ## cycles as a straight one if all of it survives
+        straight = load('conflict.yo')
+        straight.run_processor()
+
+        first = load('conflict.yo')
+        first.set_max_step(100)
+        first.run_processor()
+        resumed = load('conflict.yo')
+        resumed.restore(first.snapshot())
+        resumed.set_max_step(None)
+        resumed.run_processor()
+
+        self.assertEqual(resumed.stat, 'HLT')
+        self.assertEqual(resumed.cycle, straight.cycle)
+        self.assertEqual(resumed.dcache.counts(), straight.dcache.counts())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+from cache import parse_cache
+from processor import Y86Processor
+from randprog import random_yo
+
+def run_lines(lines, counting=True, caches=False, depth=0):
+    processor = Y86Processor()
+    processor.set_log_capacity(0)
+    processor.set_max_step(None)
+    processor.set_counters(counting)
+    processor.set_return_stack(depth)
+    if caches:
+        processor.set_caches(parse_cache('icache', 'size=64,ways=1,line=8'),
+                             parse_cache('dcache', 'size=64,ways=2,line=8'))
+    processor.set_input_file(lines)
+    processor.run_processor()
+    return processor
+
+def run(name, **options):
+    with open(os.path.join(TESTS, name), 'r') as input_file:
+        return run_lines(input_file.readlines(), **options)
+
+class CountersTest(unittest.TestCase):
+    def assertAccounted(self, processor):
+        ## Every cycle W holds a retired instruction or a bubble, apart
+        ## from the last one when the program stopped on its own
+        counters = processor.final_state()['counters']
+        stopped = int(processor.stat != 'AOK')
+        self.assertEqual(counters['cycles'],
+                         counters['instructions'] + stopped +
+                         sum(counters['lost_cycles'].values()))
+
+    def test_fixtures(self):
+        for name in ('ret.yo', 'fault.yo', 'rnone.yo', 'countdown.yo'):
+            self.assertAccounted(run(name))
+
+    def test_random_programs(self):
+        for seed in range(30):
+            lines = random_yo(seed).splitlines(True)
+            for caches in (False, True):
+                self.assertAccounted(run_lines(lines, caches=caches))
+
+    def test_causes(self):
+        lost = run('countdown.yo').final_state()['counters']['lost_cycles']
+        self.assertEqual(lost['startup'], 4)
+        ## One mispredicted jump, ten rets waiting for W
+        self.assertEqual(lost['mispredict'], 2)
+        self.assertEqual(lost['ret_stall'], 30)
+        lost = run('countdown.yo', depth=4).final_state()['counters']
+        self.assertEqual(lost['lost_cycles']['ret_stall'], 0)
+
+    def test_timing_unchanged(self):
+        for seed in range(10):
+            lines = random_yo(seed).splitlines(True)
+            counted = run_lines(lines)
+            plain = run_lines(lines, counting=False)
+            self.assertEqual(counted.cycle, plain.cycle)
+            self.assertEqual(counted.registers, plain.registers)
+
+if __name__ == '__main__':
+    unittest.main()
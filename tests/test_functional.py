@@ -0,0 +1,49 @@
+#!/usr/bin/python
+
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+from functional import Y86Functional, run_lockstep
+from processor import Y86Processor
+from randprog import random_yo
+
+def load_lines(lines, machine=None):
+    processor = machine or Y86Processor()
+    if machine is None:
+        processor.set_fast(True)
+        processor.set_log_capacity(0)
+    processor.set_max_step(None)
+    processor.set_input_file(lines)
+    return processor
+
+def load(name, machine=None):
+    with open(os.path.join(TESTS, name), 'r') as input_file:
+        return load_lines(input_file.readlines(), machine)
+
+class FunctionalTest(unittest.TestCase):
+    def test_fixtures_in_lockstep(self):
+        for name in ('ret.yo', 'fault.yo', 'rnone.yo'):
+            processor = load(name)
+            machine = run_lockstep(processor)
+            self.assertEqual(machine.stat, processor.stat)
+
+    def test_random_programs_in_lockstep(self):
+        ## Calls, returns, jumps, loads, stores and faulting accesses
+        for seed in range(50):
+            run_lockstep(load_lines(random_yo(seed).splitlines(True)))
+
+    def test_final_state(self):
+        processor = load('ret.yo')
+        processor.run_processor()
+        machine = load('ret.yo', Y86Functional())
+        machine.run_processor()
+        for key in ('status', 'registers', 'conditions', 'memory'):
+            self.assertEqual(machine.final_state()[key],
+                             processor.final_state()[key])
+
+if __name__ == '__main__':
+    unittest.main()
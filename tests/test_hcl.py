@@ -0,0 +1,72 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+import hcl
+from processor import HCL_FIELDS, PIPE_HCL
+
+def cache_entries(directory):
+    return [name for name in os.listdir(directory) if name.endswith('.py')]
+
+class Messages(list):
+    def write(self, text):
+        self.append(text)
+
+class HCLCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(PIPE_HCL, 'r') as hcl_file:
+            self.text = hcl_file.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_broken_entry_is_regenerated(self):
+        logic = hcl.compile_hcl(self.text, HCL_FIELDS, self.directory)
+        name, = cache_entries(self.directory)
+        ## Valid Python that fails only when run
+        with open(os.path.join(self.directory, name), 'w') as cache_file:
+            cache_file.write('undefined_name\n')
+        stderr = sys.stderr
+        sys.stderr = Messages()
+        try:
+            again = hcl.compile_hcl(self.text, HCL_FIELDS, self.directory)
+        finally:
+            messages, sys.stderr = sys.stderr, stderr
+        self.assertTrue(name in ''.join(messages))
+        self.assertEqual(again.source, logic.source)
+        with open(os.path.join(self.directory, name), 'r') as cache_file:
+            self.assertEqual(cache_file.read(), logic.source)
+
+    def test_generator_is_in_the_key(self):
+        hcl.compile_hcl(self.text, HCL_FIELDS, self.directory)
+        saved = hcl.generator_hash
+        try:
+            hcl.generator_hash = 'another generator'
+            hcl.compile_hcl(self.text, HCL_FIELDS, self.directory)
+        finally:
+            hcl.generator_hash = saved
+        self.assertEqual(len(cache_entries(self.directory)), 2)
+
+    def test_cache_off(self):
+        saved = hcl.HCL_CACHE_DIR
+        try:
+            hcl.set_cache_dir(self.directory)
+            hcl.compile_hcl(self.text, HCL_FIELDS)
+            self.assertEqual(len(cache_entries(self.directory)), 1)
+            hcl.set_cache_dir('off')
+            logic = hcl.compile_hcl(self.text, HCL_FIELDS, counting=True)
+        finally:
+            hcl.HCL_CACHE_DIR = saved
+        self.assertTrue(logic.source)
+        self.assertEqual(len(cache_entries(self.directory)), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+#!/usr/bin/python
+
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+from loader import LoadError, load_image
+from memory import MEM_LIMIT
+
+class LoaderTest(unittest.TestCase):
+    def test_gaps_and_order(self):
+        image = load_image(['  0x010: 10           | halt\n',
+                            '  0x000: 00           | nop\n'])
+        self.assertEqual(image.data, b'\x00' * 16 + b'\x10')
+        self.assertEqual(image.index.line_number(0x10), 1)
+
+    def test_overlap(self):
+        self.assertRaises(LoadError, load_image,
+                          ['  0x000: 30f001000000 | irmovl $1, %eax\n',
+                           '  0x004: 00           | nop\n'])
+
+    def test_past_memory(self):
+        ## A .pos far out would otherwise allocate an image that large
+        try:
+            load_image(['  0x%x: 00 | nop\n' % MEM_LIMIT])
+        except LoadError as error:
+            self.assertEqual(error.line_number, 1)
+        else:
+            self.fail('no LoadError')
+
+if __name__ == '__main__':
+    unittest.main()
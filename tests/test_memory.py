@@ -0,0 +1,70 @@
+#!/usr/bin/python
+
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+from memory import (MEM_LIMIT, PROT_EXEC, PROT_WRITE, Memory,
+                    ProtectionError)
+
+class MemoryTest(unittest.TestCase):
+    def test_little_endian_words(self):
+        memory = Memory(b'\x01\x02\x03\x04\x05')
+        self.assertEqual(memory.read_byte(0), 1)
+        self.assertEqual(memory.read_word(0), 0x04030201)
+        ## Unaligned words see the same bytes
+        self.assertEqual(memory.read_word(1), 0x05040302)
+
+    def test_overlapping_writes(self):
+        memory = Memory()
+        memory.write_word(0, -1)
+        memory.write_word(2, 0)
+        self.assertEqual(memory.read_word(0), 0xffff)
+
+    def test_negative_addresses(self):
+        memory = Memory(b'\x00' * 8)
+        self.assertRaises(IndexError, memory.read_word, -4)
+        self.assertRaises(IndexError, memory.read_byte, -1)
+        self.assertRaises(IndexError, memory.write_word, -4, 1)
+
+    def test_grows_up_to_the_limit(self):
+        memory = Memory(limit=64)
+        memory.write_word(60, 7)
+        self.assertEqual(memory.read_word(60), 7)
+        self.assertEqual(memory.read_word(0), 0)
+        self.assertRaises(IndexError, memory.write_word, 61, 7)
+        self.assertRaises(IndexError, memory.read_word, 64)
+
+    def test_stores_past_the_limit_fault(self):
+        ## Memory stops at MEM_LIMIT, past it stores fault as ADR does
+        memory = Memory()
+        memory.write_word(MEM_LIMIT - 4, 1)
+        self.assertRaises(IndexError, memory.write_word, MEM_LIMIT, 1)
+        self.assertRaises(IndexError, memory.write_word, 0x7fff0000, 1)
+
+    def test_protection(self):
+        memory = Memory(b'\x00' * 16)
+        ## The loaded image is writable and executable until protected
+        self.assertTrue(memory.executable(0, 16))
+        memory.write_word(0, 1)
+        memory.protect(0, 8, PROT_EXEC)
+        self.assertRaises(ProtectionError, memory.write_word, 4, 1)
+        ## A word is read-only if any of its bytes is
+        self.assertRaises(ProtectionError, memory.write_word, 6, 1)
+        memory.write_word(8, 1)
+        self.assertEqual(memory.read_word(4), 0)
+
+    def test_grown_memory_is_not_executable(self):
+        memory = Memory(b'\x00' * 4)
+        memory.write_word(32, 1)
+        self.assertTrue(memory.executable(0, 4))
+        self.assertFalse(memory.executable(32))
+        self.assertFalse(memory.executable(2, 4))
+        memory.protect(32, 36, PROT_WRITE | PROT_EXEC)
+        self.assertTrue(memory.executable(32, 4))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+from functional import run_lockstep
+from processor import Y86Processor
+
+def load(name):
+    processor = Y86Processor()
+    processor.set_log_capacity(None)
+    with open(os.path.join(TESTS, name), 'r') as input_file:
+        processor.set_input_file(input_file)
+    return processor
+
+def run(name):
+    processor = load(name)
+    processor.set_max_step(1000)
+    processor.run_processor()
+    return processor
+
+class PipelineTest(unittest.TestCase):
+    def test_ret_leaves_decode_alone_from_w(self):
+        processor = run('ret.yo')
+        self.assertEqual(processor.stat, 'HLT')
+        self.assertEqual(processor.registers[0], 1)
+        self.assertEqual(processor.registers[4], 0x100)
+
+    def test_faulting_pop_writes_no_register(self):
+        processor = run('fault.yo')
+        self.assertEqual(processor.stat, 'ADR')
+        self.assertEqual(processor.registers[0], 7)
+        self.assertEqual(processor.registers[4], 0x7fff0000)
+
+    def test_rnone_reads_zero(self):
+        ## With popl in E, M and W no forwarding source is RNONE
+        processor = run('rnone.yo')
+        self.assertEqual(processor.stat, 'HLT')
+        self.assertEqual([processor.registers[reg] for reg in range(4)],
+                         [1, 3, 1, 2])
+
+    def test_ret_behind_load(self):
+        ## The ret waits for the load of %esp instead of being squashed by
+        ## the bubble that goes in behind the load
+        processor = load('load_ret.yo')
+        processor.set_max_step(1000)
+        run_lockstep(processor)
+        self.assertEqual(processor.stat, 'HLT')
+        self.assertEqual(processor.registers[0], 1)
+
+    def test_store_into_read_only_code(self):
+        ## memory.ProtectionError is a memory fault like a bad address
+        processor = run('smc.yo')
+        self.assertEqual(processor.stat, 'ADR')
+        self.assertEqual(processor.registers[3], 7)
+
+    def test_store_into_fetched_code(self):
+        ## F is decoded by the first call and rewritten after it. The
+        ## second call is fetched before the store, but the table must not
+        ## keep the old instruction.
+        processor = load('smc.yo')
+        processor.set_protection('none')
+        processor.set_max_step(1000)
+        processor.run_processor()
+        self.assertEqual(processor.stat, 'HLT')
+        self.assertEqual(processor.decoded[0x33][4], 7)
+
+    def test_decoded_on_demand(self):
+        processor = load('smc.yo')
+        self.assertEqual(processor.decoded.count(None),
+                         len(processor.decoded))
+
+class FixedPointTest(unittest.TestCase):
+    def test_skipped_cycles_match_simulated_ones(self):
+        ## A run of one cycle at a time never finds the fixed point
+        skipped = load('loop.yo')
+        skipped.set_max_step(1000)
+        skipped_checkpoints = []
+        skipped.set_checkpoint(64, lambda p: skipped_checkpoints.append(
+            (p.cycle, p.retired)))
+        skipped.run_processor()
+
+        simulated = load('loop.yo')
+        simulated.set_max_step(1)
+        simulated_checkpoints = []
+        simulated.set_checkpoint(64, lambda p: simulated_checkpoints.append(
+            (p.cycle, p.retired)))
+        for cycle in range(1000):
+            simulated.run_processor()
+
+        self.assertEqual(skipped.stop_reason, 'cycles')
+        self.assertEqual(skipped.cycle, simulated.cycle)
+        self.assertEqual(skipped.retired, simulated.retired)
+        self.assertEqual(skipped.state_summary(), simulated.state_summary())
+        self.assertEqual(skipped_checkpoints, simulated_checkpoints)
+        for cycle in range(1000):
+            self.assertEqual(skipped.log.record(cycle),
+                             simulated.log.record(cycle))
+
+    def test_loop_without_limit(self):
+        processor = load('loop.yo')
+        processor.set_max_step(None)
+        processor.run_processor()
+        self.assertEqual(processor.stop_reason, 'loop')
+        self.assertEqual(processor.stat, 'AOK')
+        self.assertTrue(processor.cycle < 20)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+from functional import run_lockstep
+from predictor import Bimodal, GShare, ReturnStack, make_predictor
+from processor import Y86Processor
+from randprog import random_yo
+
+def load_lines(lines, predictor, depth):
+    processor = Y86Processor()
+    processor.set_fast(True)
+    processor.set_log_capacity(0)
+    processor.set_max_step(None)
+    processor.set_predictor(predictor)
+    processor.set_return_stack(depth)
+    processor.set_input_file(lines)
+    return processor
+
+def load(name, predictor, depth):
+    with open(os.path.join(TESTS, name), 'r') as input_file:
+        return load_lines(input_file.readlines(), predictor, depth)
+
+class PredictorTest(unittest.TestCase):
+    def test_saturating_counters(self):
+        predictor = Bimodal(2)
+        self.assertTrue(predictor.predict(0x10, 0))
+        predictor.update(0x10, False)
+        self.assertFalse(predictor.predict(0x10, 0))
+        predictor.update(0x10, False)
+        predictor.update(0x10, True)
+        self.assertFalse(predictor.predict(0x10, 0))
+        ## Other jumps keep their own counter
+        self.assertTrue(predictor.predict(0x20, 0))
+
+    def test_state_round_trip(self):
+        predictor = GShare()
+        for taken in (True, False, False, True):
+            predictor.update(0x10, taken)
+        copy = GShare()
+        copy.set_state(predictor.get_state())
+        self.assertEqual(copy.history, predictor.history)
+        self.assertEqual(copy.counters, predictor.counters)
+        self.assertRaises(ValueError, make_predictor('taken').set_state,
+                          predictor.get_state())
+
+    def test_return_stack_forgets_oldest(self):
+        stack = ReturnStack(2)
+        for address in (1, 2, 3):
+            stack.push(address)
+        self.assertEqual(stack.peek(), 3)
+        self.assertEqual(stack.peek(1), 2)
+        self.assertEqual(stack.peek(2), None)
+
+    def test_countdown(self):
+        ## The backward jump is taken 9 times of 10
+        expected = {'taken': 1, 'not-taken': 9, 'btfn': 1, 'bimodal1': 1,
+                    'bimodal2': 1, 'gshare': 1}
+        for name, mispredicts in expected.items():
+            for depth in (0, 4):
+                processor = load('countdown.yo', name, depth)
+                processor.run_processor()
+                prediction = processor.final_state()['prediction']
+                self.assertEqual(processor.registers[6], 10)
+                self.assertEqual(prediction['branches'], 10)
+                self.assertEqual(prediction['branch_mispredicts'],
+                                 mispredicts)
+                self.assertEqual(prediction['returns'], 10)
+                self.assertEqual(prediction['return_stalls'],
+                                 0 if depth else 10)
+
+    def test_random_programs_in_lockstep(self):
+        for name in ('not-taken', 'btfn', 'gshare'):
+            for depth in (0, 4):
+                for seed in range(10):
+                    lines = random_yo(seed).splitlines(True)
+                    run_lockstep(load_lines(lines, name, depth))
+
+if __name__ == '__main__':
+    unittest.main()
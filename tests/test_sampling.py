@@ -0,0 +1,33 @@
+#!/usr/bin/python
+
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+from loader import load_image
+from sampling import sample_program
+
+def image(name):
+    with open(os.path.join(TESTS, name), 'r') as input_file:
+        return load_image(input_file)
+
+class SamplingTest(unittest.TestCase):
+    def test_program_that_never_stops(self):
+        result = sample_program(image('loop.yo'), period=100, warmup=10,
+                                window=50, max_samples=5)
+        self.assertEqual(result['status'], 'AOK')
+        self.assertEqual(result['samples'], 5)
+        self.assertEqual(result['instructions'], 5 * 100)
+
+    def test_program_that_halts(self):
+        result = sample_program(image('countdown.yo'), period=10, warmup=5,
+                                window=20)
+        self.assertEqual(result['status'], 'HLT')
+        self.assertEqual(result['instructions'], 54)
+        self.assertTrue(result['cpi'] > 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+from processor import Y86Processor
+
+def profiled():
+    processor = Y86Processor()
+    processor.set_log_capacity(0)
+    processor.set_max_step(None)
+    processor.set_counters(True)
+    processor.set_profiler(True)
+    return processor
+
+def load(name, processor):
+    with open(os.path.join(TESTS, name), 'r') as input_file:
+        processor.set_input_file(input_file)
+    return processor
+
+class SnapshotTest(unittest.TestCase):
+    def test_profile_survives(self):
+        straight = load('countdown.yo', profiled())
+        straight.run_processor()
+
+        first = load('countdown.yo', profiled())
+        first.set_max_step(40)
+        first.run_processor()
+        resumed = profiled()
+        resumed.restore(first.snapshot())
+        resumed.run_processor()
+
+        self.assertEqual(resumed.cycle, straight.cycle)
+        self.assertEqual(resumed.profiler.to_dict(),
+                         straight.profiler.to_dict())
+
+    def test_source_comes_back(self):
+        ## A processor that never loaded the program gets its source lines
+        ## from the snapshot
+        first = load('countdown.yo', Y86Processor())
+        first.set_max_step(20)
+        first.run_processor()
+        resumed = Y86Processor()
+        resumed.restore(first.snapshot())
+        self.assertEqual(resumed.source, first.source)
+        self.assertEqual(resumed.source_index.lookup(0x12),
+                         first.source_index.lookup(0x12))
+
+    def test_profiler_needed(self):
+        first = Y86Processor()
+        first.set_counters(True)
+        load('countdown.yo', first)
+        self.assertRaises(ValueError, profiled().restore, first.snapshot())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+#!/usr/bin/python
+
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+from processor import Y86Processor
+from timeline import Timeline
+
+def load(name):
+    processor = Y86Processor()
+    with open(os.path.join(TESTS, name), 'r') as input_file:
+        processor.set_input_file(input_file)
+    return processor
+
+class TimelineTest(unittest.TestCase):
+    def test_checkpoints_are_thinned(self):
+        reference = load('conflict.yo')
+        reference.set_log_capacity(None)
+        reference.set_max_step(None)
+        reference.run_processor()
+
+        timeline = Timeline(load('conflict.yo'), interval=10,
+                            max_checkpoints=8)
+        last = timeline.seek(reference.cycle)
+        self.assertEqual(last, reference.cycle)
+        self.assertTrue(len(timeline.checkpoint_cycles) <= 8)
+        self.assertEqual(sorted(timeline.checkpoints),
+                         timeline.checkpoint_cycles)
+        ## ...and stay evenly spread over the run
+        cycles = timeline.checkpoint_cycles
+        gaps = [b - a for a, b in zip(cycles, cycles[1:-1])]
+        self.assertEqual(len(set(gaps)), 1)
+        ## Going back replays from the thinned snapshots
+        for cycle in (0, 5, 133, 240, 17, last):
+            self.assertEqual(timeline.record(cycle),
+                             reference.log.record(cycle))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+
+import io
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+from processor import Y86Processor
+from timeline import TraceTimeline
+from tracefile import TraceFile, TraceFileWriter
+
+def load(name):
+    processor = Y86Processor()
+    processor.set_log_capacity(None)
+    processor.set_max_step(None)
+    with open(os.path.join(TESTS, name), 'r') as input_file:
+        processor.set_input_file(input_file)
+    return processor
+
+def write_trace(processor, **options):
+    output = io.BytesIO()
+    writer = TraceFileWriter(output, processor.source, **options)
+    processor.set_trace_file(writer)
+    processor.run_processor()
+    writer.close()
+    return TraceFile(output)
+
+class TraceFileTest(unittest.TestCase):
+    def test_round_trip(self):
+        for compress in (True, False):
+            processor = load('conflict.yo')
+            trace = write_trace(processor, compress=compress, chunk_cycles=64)
+            self.assertEqual(trace.first(), 0)
+            self.assertEqual(trace.last(), processor.cycle)
+            for cycle in range(trace.first(), trace.last() + 1):
+                self.assertEqual(trace.record(cycle),
+                                 processor.log.record(cycle))
+
+    def test_resumed_run_starts_later(self):
+        ## A trace of a run resumed from a snapshot starts at its cycle,
+        ## and so does the timeline the GUI shows it with
+        first = load('conflict.yo')
+        first.set_max_step(100)
+        first.run_processor()
+        resumed = load('conflict.yo')
+        resumed.restore(first.snapshot())
+        resumed.set_max_step(None)
+        trace = write_trace(resumed)
+        timeline = TraceTimeline(trace)
+        self.assertEqual(timeline.first(), first.cycle + 1)
+        self.assertEqual(timeline.seek(0), timeline.first())
+
+if __name__ == '__main__':
+    unittest.main()
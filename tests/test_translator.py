@@ -0,0 +1,50 @@
+#!/usr/bin/python
+
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+from functional import Y86Functional
+from randprog import random_yo
+
+def load_lines(lines, translate, protection='code'):
+    machine = Y86Functional()
+    machine.set_translate(translate)
+    machine.set_max_step(None)
+    machine.set_input_file(lines)
+    machine.set_protection(protection)
+    return machine
+
+def final_states(lines, protection='code'):
+    ## Final state with and without translation
+    states = []
+    for translate in (True, False):
+        machine = load_lines(lines, translate, protection)
+        machine.run_processor()
+        states.append(machine.final_state())
+    return states
+
+class TranslatorTest(unittest.TestCase):
+    def test_self_modifying_code(self):
+        ## A store into a translated function, and into the instruction
+        ## right after it in the same block
+        with open(os.path.join(TESTS, 'smc.yo'), 'r') as input_file:
+            lines = input_file.readlines()
+        translated, stepped = final_states(lines, 'none')
+        self.assertEqual(translated, stepped)
+        self.assertEqual(translated['status'], 'HLT')
+        registers = translated['registers']
+        self.assertEqual((registers['%eax'], registers['%edx'],
+                          registers['%edi']), (8, 7, 9))
+
+    def test_random_programs(self):
+        for seed in range(50):
+            translated, stepped = final_states(
+                random_yo(seed).splitlines(True))
+            self.assertEqual(translated, stepped)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+
+from bisect import bisect_left
+
+## Cycles between two checkpoints
+CHECKPOINT_INTERVAL = 1000
+
+## Snapshots kept at most. Past that every other one is dropped, so a long
+## run takes bounded memory at the cost of longer replays.
+MAX_CHECKPOINTS = 512
+
+class Timeline():
+    ## Simulates a loaded processor lazily so any cycle can be looked at.
+    ## A snapshot is taken every `interval` cycles; going back restores the
+    ## closest earlier snapshot and replays the few cycles after it. The
+    ## last `interval` cycles simulated stay in the processor log, so
+    ## small steps back need no replay at all.
+    def __init__(self, processor, interval=CHECKPOINT_INTERVAL,
+                 max_checkpoints=MAX_CHECKPOINTS):
+        self.processor = processor
+        self.interval = interval
+        self.max_checkpoints = max_checkpoints
+        ## Cycles between the snapshots kept, doubled by each thinning
+        self.spacing = interval
+        processor.set_fast(False)
+        processor.set_log_capacity(interval)
+        processor.set_checkpoint(interval, self.save_checkpoint)
+
+        ## Cycle of the last cycle of the program, once it is known
+        self.last_cycle = None
+
+        ## Sorted cycles of the snapshots, and the snapshots themselves
+        self.checkpoint_cycles = []
+        self.checkpoints = {}
+        self.save_checkpoint(processor)
+
+    def save_checkpoint(self, processor):
+        if not self.is_saved(processor.cycle):
+            self.add_checkpoint(processor.cycle, processor.snapshot())
+
+    def is_saved(self, cycle):
+        return bool(self.checkpoint_cycles) and cycle <= self.checkpoint_cycles[-1]
+
+    def add_checkpoint(self, cycle, data):
+        ## Snapshots may also come from a processor running ahead elsewhere
+        if self.is_saved(cycle):
+            return
+        if self.checkpoint_cycles and \
+                cycle - self.checkpoint_cycles[-1] < self.spacing:
+            return
+        self.checkpoint_cycles.append(cycle)
+        self.checkpoints[cycle] = data
+        if len(self.checkpoint_cycles) > self.max_checkpoints:
+            self.thin()
+
+    def thin(self):
+        ## Drop every other snapshot, keeping the first and the latest, and
+        ## space the later ones as far apart as those left
+        self.spacing *= 2
+        kept = self.checkpoint_cycles[::2]
+        if kept[-1] != self.checkpoint_cycles[-1]:
+            kept.append(self.checkpoint_cycles[-1])
+        self.checkpoints = dict((cycle, self.checkpoints[cycle])
+                                for cycle in kept)
+        self.checkpoint_cycles = kept
+
+    def first(self):
+        return 0
+
+    def finish(self, cycle):
+        self.last_cycle = cycle
+
+    def is_last(self, cycle):
+        return self.last_cycle is not None and cycle >= self.last_cycle
+
+    def seek(self, cycle):
+        ## Make `cycle` available in the log; returns the cycle actually
+        ## reached, which is earlier if the program stops before it
+        processor = self.processor
+        cycle = max(cycle, self.first())
+        if self.last_cycle is not None:
+            cycle = min(cycle, self.last_cycle)
+        log = processor.log
+        if log.first() <= cycle <= processor.cycle:
+            return cycle
+
+        ## Closest snapshot strictly before the cycle, so that the cycle
+        ## itself is replayed into the log
+        index = bisect_left(self.checkpoint_cycles, cycle) - 1
+        checkpoint = self.checkpoint_cycles[index]
+        if cycle < log.first() or checkpoint > processor.cycle:
+            processor.restore(self.checkpoints[checkpoint])
+
+        processor.set_max_step(cycle - processor.cycle)
+        processor.run_processor()
+        if processor.stop_reason == 'status':
+            self.last_cycle = processor.cycle
+        return processor.cycle
+
+    def record(self, cycle):
+        ## seek() may replace the log when it restores a snapshot
+        cycle = self.seek(cycle)
+        return self.processor.log.record(cycle)
+
+class TraceTimeline():
+    ## The cycles of a binary trace file, see tracefile.py, read from the
+    ## file as they are looked at instead of simulated
+    def __init__(self, trace, interval=CHECKPOINT_INTERVAL):
+        self.trace = trace
+        self.interval = interval
+
+    def first(self):
+        return self.trace.first()
+
+    def finish(self, cycle):
+        pass
+
+    def is_last(self, cycle):
+        return cycle >= self.trace.last()
+
+    def seek(self, cycle):
+        return min(max(cycle, self.first()), self.trace.last())
+
+    def record(self, cycle):
+        return self.trace.record(self.seek(cycle))
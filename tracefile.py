@@ -0,0 +1,282 @@
+#!/usr/bin/python
+
+## Binary trace files: every cycle of the pipeline as a fixed-width record
+## of the pipeline register fields, register file, stage addresses and
+## condition codes. Records are stored in zlib-compressed chunks of
+## CHUNK_CYCLES cycles, followed by an index of the chunk offsets, so any
+## cycle is found by decompressing a single chunk. The text trace is
+## regenerated from them on demand, see `processor.py trace`.
+
+import argparse
+import os
+import struct
+import sys
+import zlib
+from operator import attrgetter
+
+from loader import load_image
+from tracing import (FIELDS, CONDITIONS, STAGE_NAMES, TraceWriter,
+                     format_cycle, format_source, make_record,
+                     stage_addresses)
+
+## Cycles per chunk
+CHUNK_CYCLES = 4096
+
+## File layout: header, zlib-compressed .yo source, chunks, chunk offsets,
+## trailer. The header holds the version, whether the chunks are
+## compressed, the number of pipeline fields, the cycles per chunk, the
+## first cycle and the length of the source. The trailer holds where the
+## chunk offsets start, the number of cycles and the number of chunks.
+TRACE_MAGIC = b'Y86TRACE'
+TRACE_VERSION = 1
+HEADER = struct.Struct('<8sBBHIqI')
+INDEX_MAGIC = b'Y86INDEX'
+TRAILER = struct.Struct('<QqI8s')
+
+## Pipeline fields, registers, stage addresses, then condition codes
+RECORD = struct.Struct('<%di8i%di%db' % (len(FIELDS), len(STAGE_NAMES),
+                                         len(CONDITIONS)))
+REGISTERS_START = len(FIELDS)
+ADDRESSES_START = REGISTERS_START + 8
+CONDITIONS_START = ADDRESSES_START + len(STAGE_NAMES)
+
+class TraceFileError(Exception):
+    pass
+
+class TraceFileWriter():
+    ## Streams the cycles of a run to a binary file, one chunk at a time.
+    ## The header is written with the first cycle, the index by close().
+    def __init__(self, output_file, source=(), compress=True,
+                 chunk_cycles=CHUNK_CYCLES):
+        self.output_file = output_file
+        self.source = zlib.compress('\n'.join(source).encode('utf-8'))
+        self.compress = compress
+        self.chunk_cycles = chunk_cycles
+        self.get_fields = attrgetter(*(attr for name, attr, padded in FIELDS))
+        self.start = None
+        self.count = 0
+        self.offset = 0
+        self.offsets = []
+        self.buffer = bytearray()
+        self.buffered = 0
+        ## A full chunk of one repeated record, and its encoding
+        self.repeated = (None, None)
+
+    def pack(self, processor):
+        return RECORD.pack(*(self.get_fields(processor) +
+                             tuple(processor.registers[reg]
+                                   for reg in range(8)) +
+                             stage_addresses(processor) +
+                             tuple(processor.conditions[cc]
+                                   for cc in CONDITIONS)))
+
+    def write(self, data):
+        self.output_file.write(data)
+        self.offset += len(data)
+
+    def begin(self, cycle):
+        if self.start is not None:
+            return
+        self.start = cycle
+        self.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION, int(self.compress),
+                               len(FIELDS), self.chunk_cycles, cycle,
+                               len(self.source)))
+        self.write(self.source)
+
+    def append(self, processor):
+        self.begin(processor.cycle)
+        self.add(self.pack(processor), 1)
+
+    def repeat(self, processor, times):
+        ## The current cycle again for each of the next `times` cycles
+        self.begin(processor.cycle + 1)
+        self.add(self.pack(processor), times)
+
+    def add(self, record, times):
+        while times > 0:
+            count = min(times, self.chunk_cycles - self.buffered)
+            if count == self.chunk_cycles:
+                ## A program that stopped changing repeats whole chunks,
+                ## which are only encoded once
+                if self.repeated[0] != record:
+                    self.repeated = (record, self.encode(record * count))
+                self.write_chunk(self.repeated[1])
+            else:
+                self.buffer += record * count
+                self.buffered += count
+                if self.buffered == self.chunk_cycles:
+                    self.flush_chunk()
+            self.count += count
+            times -= count
+
+    def encode(self, data):
+        ## zlib.compress takes no bytearray on Python 2
+        data = bytes(data)
+        return zlib.compress(data) if self.compress else data
+
+    def write_chunk(self, data):
+        self.offsets.append(self.offset)
+        self.write(data)
+
+    def flush_chunk(self):
+        if self.buffered:
+            self.write_chunk(self.encode(self.buffer))
+            self.buffer = bytearray()
+            self.buffered = 0
+
+    def close(self):
+        ## Write the last chunk and the index; the file is complete after
+        ## this, but stays open
+        self.begin(0)
+        self.flush_chunk()
+        index_offset = self.offset
+        self.write(struct.pack('<%dQ' % len(self.offsets), *self.offsets))
+        self.write(TRAILER.pack(index_offset, self.count, len(self.offsets),
+                                INDEX_MAGIC))
+        self.output_file.flush()
+
+class TraceFile():
+    ## Random access to the cycles of a binary trace file. Only the header
+    ## and the index are read up front; a cycle costs at most one chunk to
+    ## be read and decompressed.
+    def __init__(self, trace_file):
+        self.trace_file = trace_file
+        header = self.read(0, HEADER.size)
+        (magic, version, self.compressed, fields, self.chunk_cycles,
+         self.start, source_length) = HEADER.unpack(header)
+        if magic != TRACE_MAGIC:
+            raise TraceFileError('not a Y86 trace file')
+        if version != TRACE_VERSION or fields != len(FIELDS):
+            raise TraceFileError('written by another version of the '
+                                 'simulator')
+        self.source = zlib.decompress(
+            self.read(HEADER.size, source_length)).decode('utf-8')
+
+        trace_file.seek(0, os.SEEK_END)
+        size = trace_file.tell()
+        if size < HEADER.size + TRAILER.size:
+            raise TraceFileError('truncated trace file')
+        index_offset, self.count, chunks, magic = TRAILER.unpack(
+            self.read(size - TRAILER.size, TRAILER.size))
+        if magic != INDEX_MAGIC:
+            raise TraceFileError('trace file without an index, the run did '
+                                 'not finish')
+        self.offsets = list(struct.unpack('<%dQ' % chunks,
+                                          self.read(index_offset, 8 * chunks)))
+        self.offsets.append(index_offset)
+        ## The chunk read last, decompressed
+        self.cached = (None, None)
+
+    def __len__(self):
+        return self.count
+
+    def first(self):
+        return self.start
+
+    def last(self):
+        return self.start + self.count - 1
+
+    def read(self, offset, size):
+        self.trace_file.seek(offset)
+        data = self.trace_file.read(size)
+        if len(data) != size:
+            raise TraceFileError('truncated trace file')
+        return data
+
+    def chunk(self, number):
+        if self.cached[0] != number:
+            start, end = self.offsets[number], self.offsets[number + 1]
+            data = self.read(start, end - start)
+            if self.compressed:
+                data = zlib.decompress(data)
+            self.cached = (number, data)
+        return self.cached[1]
+
+    def values(self, cycle):
+        if cycle < self.first() or cycle > self.last():
+            raise IndexError('cycle %d is not in the trace' % cycle)
+        number, slot = divmod(cycle - self.start, self.chunk_cycles)
+        return RECORD.unpack_from(self.chunk(number), slot * RECORD.size)
+
+    def row(self, cycle):
+        return self.values(cycle)[:REGISTERS_START]
+
+    def record(self, cycle):
+        ## The cycle in the format of tracing.CycleLog.record
+        values = self.values(cycle)
+        return make_record(values[:REGISTERS_START],
+                           values[REGISTERS_START:ADDRESSES_START],
+                           values[CONDITIONS_START:],
+                           values[ADDRESSES_START:CONDITIONS_START])
+
+    __getitem__ = record
+
+    def image(self):
+        ## The .yo file the trace was written from, as a loader.Image
+        return load_image(self.source.splitlines(True))
+
+    def text(self, cycle, index=None):
+        ## The cycle as the text trace shows it, followed by the source
+        ## lines of its stages when given a loader.SourceIndex
+        values = self.values(cycle)
+        text = format_cycle(cycle, values[:REGISTERS_START])
+        if index is not None:
+            text += format_source(values[ADDRESSES_START:CONDITIONS_START],
+                                  index)
+        return text
+
+def convert(trace, output_file, first=None, last=None, trace_source=False):
+    ## Write cycles first to last (inclusive) of a TraceFile as text
+    index = trace.image().index if trace_source else None
+    first = trace.first() if first is None else max(first, trace.first())
+    last = trace.last() if last is None else min(last, trace.last())
+    writer = TraceWriter(output_file)
+    for cycle in range(first, last + 1):
+        writer.write(trace.text(cycle, index))
+    writer.flush()
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='processor.py trace',
+        description='Convert binary trace files written with --trace-file '
+                    'to the text trace')
+    parser.add_argument('inputs', nargs='+', metavar='input',
+                        help='binary trace file')
+    parser.add_argument('-o', '--output',
+                        help="output file, '-' for stdout "
+                             "(default: the input path with a .txt suffix)")
+    parser.add_argument('--first', type=int, metavar='CYCLE',
+                        help='first cycle to convert')
+    parser.add_argument('--last', type=int, metavar='CYCLE',
+                        help='last cycle to convert')
+    parser.add_argument('--trace-source', action='store_true',
+                        help='show the .yo line of the instruction in each '
+                             'stage after every cycle')
+    args = parser.parse_args(argv)
+    if args.output not in (None, '-') and len(args.inputs) > 1:
+        parser.error('--output needs a single input unless it is -')
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    failed = 0
+    for input_path in args.inputs:
+        try:
+            with open(input_path, 'rb') as trace_file:
+                trace = TraceFile(trace_file)
+                if args.output == '-':
+                    convert(trace, sys.stdout, args.first, args.last,
+                            args.trace_source)
+                    continue
+                output_path = args.output or \
+                    os.path.splitext(input_path)[0] + '.txt'
+                with open(output_path, 'w') as output_file:
+                    convert(trace, output_file, args.first, args.last,
+                            args.trace_source)
+        except (IOError, TraceFileError) as error:
+            sys.stderr.write('Trace Error: %s: %s\n' % (input_path, error))
+            failed += 1
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
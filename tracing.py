@@ -0,0 +1,291 @@
+#!/usr/bin/python
+
+from array import array
+from operator import attrgetter
+
+from isa import REGISTER_NAMES, SBUB
+
+## Text trace format, one block per cycle
+CYCLE_FORMAT = 'Cycle_%d\n--------------------\n'
+
+FETCH_FORMAT = ('FETCH:\n'
+                '\tF_predPC \t= %s\n'
+                '\n')
+
+DECODE_FORMAT = ('DECODE:\n'
+                 '\tD_icode  \t= %s\n'
+                 '\tD_ifun   \t= %s\n'
+                 '\tD_rA     \t= %s\n'
+                 '\tD_rB     \t= %s\n'
+                 '\tD_valC   \t= %s\n'
+                 '\tD_valP   \t= %s\n'
+                 '\n')
+
+EXECUTE_FORMAT = ('EXECUTE:\n'
+                  '\tE_icode  \t= %s\n'
+                  '\tE_ifun   \t= %s\n'
+                  '\tE_valC   \t= %s\n'
+                  '\tE_valA   \t= %s\n'
+                  '\tE_valB   \t= %s\n'
+                  '\tE_dstE   \t= %s\n'
+                  '\tE_dstM   \t= %s\n'
+                  '\tE_srcA   \t= %s\n'
+                  '\tE_srcB   \t= %s\n'
+                  '\n')
+
+MEMORY_FORMAT = ('MEMORY:\n'
+                 '\tM_icode  \t= %s\n'
+                 '\tM_Bch    \t= %s\n'
+                 '\tM_valE   \t= %s\n'
+                 '\tM_valA   \t= %s\n'
+                 '\tM_dstE   \t= %s\n'
+                 '\tM_dstM   \t= %s\n'
+                 '\n')
+
+WRITEBACK_FORMAT = ('WRITE BACK:\n'
+                    '\tW_icode  \t= %s\n'
+                    '\tW_valE   \t= %s\n'
+                    '\tW_valM   \t= %s\n'
+                    '\tW_dstE   \t= %s\n'
+                    '\tW_dstM   \t= %s\n'
+                    '\n')
+
+## Pipeline register fields recorded every cycle, in trace order:
+## (name in the trace, processor attribute, printed with padding)
+FIELDS = (
+    ('F_predPC', 'F_predPC', False),
+    ('D_icode',  'D_icode',  False),
+    ('D_ifun',   'D_ifun',   False),
+    ('D_rA',     'D_rA',     False),
+    ('D_rB',     'D_rB',     False),
+    ('D_valC',   'D_valC',   True),
+    ('D_valP',   'D_valP',   True),
+    ('E_icode',  'E_icode',  False),
+    ('E_ifun',   'E_ifun',   False),
+    ('E_valC',   'E_valC',   True),
+    ('E_valA',   'E_valA',   True),
+    ('E_valB',   'E_valB',   True),
+    ('E_dstE',   'E_dstE',   False),
+    ('E_dstM',   'E_dstM',   False),
+    ('E_srcA',   'E_srcA',   False),
+    ('E_srcB',   'E_srcB',   False),
+    ('M_icode',  'M_icode',  False),
+    ('M_Bch',    'M_Cnd',    False),
+    ('M_valE',   'M_valE',   True),
+    ('M_valA',   'M_valA',   True),
+    ('M_dstE',   'M_dstE',   False),
+    ('M_dstM',   'M_dstM',   False),
+    ('W_icode',  'W_icode',  False),
+    ('W_valE',   'W_valE',   True),
+    ('W_valM',   'W_valM',   True),
+    ('W_dstE',   'W_dstE',   False),
+    ('W_dstM',   'W_dstM',   False),
+)
+
+FIELD_NAMES = tuple(name for name, attr, padded in FIELDS)
+
+CONDITIONS = ('ZF', 'SF', 'OF')
+
+## Offsets of each stage in a row of FIELDS
+FETCH_FIELDS = slice(0, 1)
+DECODE_FIELDS = slice(1, 7)
+EXECUTE_FIELDS = slice(7, 16)
+MEMORY_FIELDS = slice(16, 22)
+WRITEBACK_FIELDS = slice(22, 27)
+
+## Where each stage finds the address and status of the instruction it
+## worked on in a cycle
+STAGE_ADDRESSES = (
+    ('F', 'f_addr', 'f_stat'),
+    ('D', 'D_addr', 'D_stat'),
+    ('E', 'E_addr', 'E_stat'),
+    ('M', 'M_addr', 'M_stat'),
+    ('W', 'W_addr', 'W_stat'),
+)
+
+STAGE_NAMES = tuple(name for name, addr, stat in STAGE_ADDRESSES)
+
+def special_hex(x, padding = False):
+    if x < 0:
+        x = (~(-x) + 1) & 0xffffffff
+
+    if padding:
+        ans = "0x%08x" % x
+    else:
+        ans = "0x%x" % x
+
+    return ans.lower()
+
+def format_fields(row):
+    return tuple(special_hex(value, padded)
+                 for value, (name, attr, padded) in zip(row, FIELDS))
+
+def format_stages(row):
+    ## A cycle of the trace without its "Cycle_N" header
+    text = format_fields(row)
+    return ''.join((FETCH_FORMAT % text[FETCH_FIELDS],
+                    DECODE_FORMAT % text[DECODE_FIELDS],
+                    EXECUTE_FORMAT % text[EXECUTE_FIELDS],
+                    MEMORY_FORMAT % text[MEMORY_FIELDS],
+                    WRITEBACK_FORMAT % text[WRITEBACK_FIELDS]))
+
+def format_cycle(cycle, row):
+    return CYCLE_FORMAT % cycle + format_stages(row)
+
+def stage_addresses(processor):
+    ## Address of the instruction in each stage, -1 for a bubble
+    return tuple(-1 if getattr(processor, stat) == SBUB
+                 else getattr(processor, addr)
+                 for name, addr, stat in STAGE_ADDRESSES)
+
+def format_source(addresses, index):
+    ## The .yo line of the instruction in each stage, looked up in a
+    ## loader.SourceIndex
+    lines = ['SOURCE:\n']
+    for name, addr in zip(STAGE_NAMES, addresses):
+        entry = index.lookup(addr) if addr >= 0 else None
+        if addr < 0:
+            text = 'bubble'
+        elif entry is None:
+            text = '0x%x' % addr
+        else:
+            start, number, disassembly = entry
+            text = '0x%x line %d: %s' % (start, number, disassembly)
+        lines.append('\t%s \t= %s\n' % (name, text))
+    lines.append('\n')
+    return ''.join(lines)
+
+def format_state(lines, registers, conditions, changes):
+    ## Final state report: the given header lines, then registers,
+    ## condition codes and changed memory words
+    lines = list(lines)
+    for name, value in zip(REGISTER_NAMES, registers):
+        lines.append('%s\t= %s' % (name, special_hex(value, True)))
+    for cc in ('ZF', 'SF', 'OF'):
+        lines.append('%s\t= %d' % (cc, conditions[cc]))
+    if changes:
+        lines.append('Changes to memory:')
+        for addr, old, new in changes:
+            lines.append('0x%04x:\t%s\t%s' % (addr, special_hex(old, True),
+                                              special_hex(new, True)))
+    return '\n'.join(lines) + '\n'
+
+def make_record(row, registers, conditions, addresses):
+    ## A cycle as the GUI shows it: formatted fields, then the register
+    ## file, condition codes and stage addresses by name
+    record = dict(zip(FIELD_NAMES, format_fields(row)))
+    record['registers'] = dict(enumerate(registers))
+    record['condition_code'] = dict(zip(CONDITIONS, conditions))
+    record['stage_addresses'] = dict(zip(STAGE_NAMES, addresses))
+    return record
+
+class CycleLog():
+    ## One typed column per pipeline field plus packed register file,
+    ## condition code and stage address columns. Values are only formatted
+    ## when a cycle is looked up.
+    ##
+    ## With a capacity the columns become ring buffers that keep only the
+    ## last `capacity` cycles; a capacity of 0 keeps nothing. `start` is
+    ## the cycle of the first appended row.
+    def __init__(self, capacity=None, start=0):
+        self.get_fields = attrgetter(*(attr for name, attr, padded in FIELDS))
+        self.capacity = capacity
+        self.start = start
+        self.count = start
+        if capacity is None:
+            size = 0
+        else:
+            size = capacity
+        self.columns = [array('i', [0]) * size for field in FIELDS]
+        self.registers = [array('i', [0]) * size for reg in range(8)]
+        self.conditions = [array('b', [0]) * size for cc in CONDITIONS]
+        self.addresses = [array('i', [0]) * size for stage in STAGE_NAMES]
+
+    def __len__(self):
+        if self.capacity is None:
+            return self.count - self.start
+        return min(self.count - self.start, self.capacity)
+
+    def first(self):
+        ## Oldest cycle still held in the log
+        return self.count - len(self)
+
+    def append(self, processor):
+        row = self.get_fields(processor)
+        if self.capacity is None:
+            for column, value in zip(self.columns, row):
+                column.append(value)
+            for column, reg in zip(self.registers, range(8)):
+                column.append(processor.registers[reg])
+            for column, cc in zip(self.conditions, CONDITIONS):
+                column.append(processor.conditions[cc])
+            for column, addr in zip(self.addresses,
+                                    stage_addresses(processor)):
+                column.append(addr)
+        elif self.capacity:
+            pos = self.count % self.capacity
+            for column, value in zip(self.columns, row):
+                column[pos] = value
+            for column, reg in zip(self.registers, range(8)):
+                column[pos] = processor.registers[reg]
+            for column, cc in zip(self.conditions, CONDITIONS):
+                column[pos] = processor.conditions[cc]
+            for column, addr in zip(self.addresses,
+                                    stage_addresses(processor)):
+                column[pos] = addr
+        self.count += 1
+        return row
+
+    def repeat(self, processor, times):
+        ## Append the current cycle `times` times. Rows that would fall
+        ## straight out of a ring buffer are only counted.
+        if self.capacity is not None and times > self.capacity:
+            self.count += times - self.capacity
+            times = self.capacity
+        row = self.get_fields(processor)
+        for i in range(times):
+            self.append(processor)
+        return row
+
+    def index(self, step):
+        if step < self.first() or step >= self.count:
+            raise IndexError('cycle %d is not in the log' % step)
+        if self.capacity is None:
+            return step - self.start
+        return step % self.capacity
+
+    def row(self, step):
+        pos = self.index(step)
+        return tuple(column[pos] for column in self.columns)
+
+    def record(self, step):
+        pos = self.index(step)
+        return make_record(self.row(step),
+                           [column[pos] for column in self.registers],
+                           [column[pos] for column in self.conditions],
+                           [column[pos] for column in self.addresses])
+
+    __getitem__ = record
+
+## Flush to the underlying file once this many characters are pending
+BUFFER_SIZE = 1 << 16
+
+class TraceWriter():
+    def __init__(self, output_file, buffer_size=BUFFER_SIZE):
+        self.output_file = output_file
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.pending = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.pending += len(text)
+        if self.pending >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.output_file.write(''.join(self.parts))
+            self.parts = []
+            self.pending = 0
+        self.output_file.flush()
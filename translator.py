@@ -0,0 +1,201 @@
+#!/usr/bin/python
+
+from isa import (IRRMOVL, IIRMOVL, IRMMOVL, IMRMOVL, IOPL, IJXX, ICALL, IRET,
+                 IPUSHL, IPOPL, RESP, RNONE, ALUADD, ALUSUB, ALUAND, ALUXOR,
+                 FJMP, FJLE, FJL, FJE, FJNE, FJGE, FJG, TMAX, TMIN, SAOK, SADR,
+                 decode_instruction)
+
+## Longest block translated, in instructions
+MAX_BLOCK = 64
+
+## Python for the condition of a jump or conditional move, by ifun
+CONDITION_CODE = {
+    FJMP: 'True',
+    FJLE: "(c['SF'] ^ c['OF']) | c['ZF']",
+    FJL:  "c['SF'] ^ c['OF']",
+    FJE:  "c['ZF']",
+    FJNE: "not c['ZF']",
+    FJGE: "not (c['SF'] ^ c['OF'])",
+    FJG:  "not ((c['SF'] ^ c['OF']) | c['ZF'])",
+}
+
+ALU_CODE = {
+    ALUADD: '%(b)s + %(a)s',
+    ALUSUB: '%(b)s - %(a)s',
+    ALUAND: '%(b)s & %(a)s',
+    ALUXOR: '%(b)s ^ %(a)s',
+}
+
+BLOCK_HEADER = '''def block(m):
+    r = m.registers
+    c = m.conditions
+    read_word = m.memory.read_word
+    i = 0
+    try:
+'''
+
+BLOCK_FOOTER = '''    except IndexError:
+        m.pc = pcs[i]
+        m.retired += i
+        m.stat = SADR
+'''
+
+def register(reg):
+    return '0' if reg == RNONE else 'r[%d]' % reg
+
+def wrap(expression):
+    return '((%s) + 0x80000000 & 0xffffffff) - 0x80000000' % expression
+
+class Block():
+    def __init__(self, start, end, length, function):
+        ## Instructions in [start, end), run by function(machine)
+        self.start = start
+        self.end = end
+        self.length = length
+        self.function = function
+        self.valid = True
+        ## Blocks that followed this one, by start address
+        self.successors = {}
+
+class BlockCache():
+    ## Translates straight-line runs of instructions into Python functions
+    ## that execute the whole run at once on a Y86Functional. Blocks end at
+    ## the first jump, call or ret. A write into a translated block drops
+    ## it; a block that overwrites its own code stops right after the write.
+    def __init__(self, machine):
+        self.machine = machine
+        self.blocks = {}
+        ## Start addresses of the blocks covering each code byte
+        self.covering = {}
+
+    def lookup(self, pc):
+        block = self.blocks.get(pc)
+        if block is None:
+            block = self.translate(pc)
+        return block
+
+    def invalidate(self, addr, size=4):
+        ## Returns whether any translated code was overwritten
+        hit = False
+        for a in range(addr, addr + size):
+            starts = self.covering.pop(a, None)
+            if not starts:
+                continue
+            for start in starts:
+                block = self.blocks.pop(start, None)
+                if block is not None:
+                    block.valid = False
+                    hit = True
+        return hit
+
+    def translate(self, pc):
+        lines = []
+        pcs = []
+        start = pc
+        emit = lines.append
+        branched = False
+        while len(pcs) < MAX_BLOCK:
+            icode, ifun, rA, rB, valC, valP, predPC, stat = \
+                decode_instruction(self.machine.memory, pc)
+            if stat != SAOK:
+                break
+            index = len(pcs)
+            pcs.append(pc)
+            done = index + 1
+
+            if icode == IRRMOVL:
+                condition = CONDITION_CODE.get(ifun, 'False')
+                if rB != RNONE and condition == 'True':
+                    emit('r[%d] = %s' % (rB, register(rA)))
+                elif rB != RNONE and condition != 'False':
+                    emit('if %s: r[%d] = %s' % (condition, rB, register(rA)))
+            elif icode == IIRMOVL:
+                if rB != RNONE:
+                    emit('r[%d] = %d' % (rB, valC))
+            elif icode == IRMMOVL:
+                emit('i = %d' % index)
+                emit('m.write_memory(%s, %s)' % (
+                    wrap('%d + %s' % (valC, register(rB))), register(rA)))
+                self.emit_code_check(emit, valP, done)
+            elif icode == IMRMOVL:
+                emit('i = %d' % index)
+                emit('v = read_word(%s)' % wrap('%d + %s' % (valC,
+                                                             register(rB))))
+                if rA != RNONE:
+                    emit('r[%d] = v' % rA)
+            elif icode == IOPL:
+                if ifun in ALU_CODE:
+                    emit('t = ' + ALU_CODE[ifun] % {'a': register(rA),
+                                                    'b': register(rB)})
+                else:
+                    emit('t = 0')
+                emit("c['ZF'] = 1 if t == 0 else 0")
+                emit("c['SF'] = 1 if t < 0 else 0")
+                if ifun in (ALUADD, ALUSUB):
+                    emit("c['OF'] = 1 if t > %d or t < %d else 0"
+                         % (TMAX, TMIN))
+                else:
+                    emit("c['OF'] = 0")
+                if rB != RNONE:
+                    emit('r[%d] = %s' % (rB, wrap('t')))
+            elif icode == IPUSHL:
+                emit('v = %s' % register(rA))
+                emit('sp = %s' % wrap('r[%d] - 4' % RESP))
+                emit('i = %d' % index)
+                emit('m.write_memory(sp, v)')
+                emit('r[%d] = sp' % RESP)
+                self.emit_code_check(emit, valP, done)
+            elif icode == IPOPL:
+                emit('sp = r[%d]' % RESP)
+                emit('i = %d' % index)
+                emit('v = read_word(sp)')
+                emit('r[%d] = %s' % (RESP, wrap('sp + 4')))
+                if rA != RNONE:
+                    emit('r[%d] = v' % rA)
+            elif icode == IJXX:
+                condition = CONDITION_CODE.get(ifun, 'False')
+                if condition == 'True':
+                    emit('m.pc = %d' % valC)
+                else:
+                    emit('m.pc = %d if %s else %d' % (valC, condition, valP))
+            elif icode == ICALL:
+                emit('sp = %s' % wrap('r[%d] - 4' % RESP))
+                emit('i = %d' % index)
+                emit('m.write_memory(sp, %d)' % valP)
+                emit('r[%d] = sp' % RESP)
+                emit('m.pc = %d' % valC)
+            elif icode == IRET:
+                emit('sp = r[%d]' % RESP)
+                emit('i = %d' % index)
+                emit('m.pc = read_word(sp)')
+                emit('r[%d] = %s' % (RESP, wrap('sp + 4')))
+            pc = valP
+            if icode in (IJXX, ICALL, IRET):
+                branched = True
+                break
+
+        if not pcs:
+            return None
+        if not branched:
+            emit('m.pc = %d' % pc)
+        emit('m.retired += %d' % len(pcs))
+
+        source = BLOCK_HEADER + ''.join('        %s\n' % line
+                                        for line in lines) + BLOCK_FOOTER
+        namespace = {'pcs': tuple(pcs), 'SADR': SADR}
+        exec(compile(source, '<block 0x%x>' % start, 'exec'), namespace)
+
+        self.machine.decoded_at(start)
+        self.machine.decoded_at(pcs[-1])
+        block = Block(start, pc, len(pcs), namespace['block'])
+        self.blocks[start] = block
+        for a in range(start, pc):
+            self.covering.setdefault(a, []).append(start)
+        return block
+
+    def emit_code_check(self, emit, next_pc, done):
+        ## Leave the block if the write changed translated code
+        emit('if m.code_written:')
+        emit('    m.pc = %d' % next_pc)
+        emit('    m.retired += %d' % done)
+        emit('    return')